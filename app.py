@@ -1,13 +1,22 @@
 import os
 import json
 import uuid
+import hashlib
+import queue
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from flask import Flask, request, jsonify, render_template, session, redirect, url_for, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
 from google.cloud import bigquery
 from invoice_processor import InvoiceProcessor
-from services.gmail_service import GmailService
+from services.gmail_service import GmailService, GmailHistoryExpiredError
+from services.gmail_sync_checkpoint import GmailSyncCheckpoints
+from services.gmail_import_ledger import GmailImportLedger, DOCUMENT_EXTRACTED, DOCUMENT_INCOMPLETE, DOCUMENT_FAILED, DOCUMENT_SKIPPED
+from services.email_prefilter import EmailPrefilter
+from services.entity_verdict_cache import EntityVerdictCache
 from services.token_storage import SecureTokenStorage
 from services.bigquery_service import BigQueryService
 from services.vendor_csv_mapper import VendorCSVMapper
@@ -21,6 +30,9 @@ from services.issue_detector import IssueDetector
 from services.action_manager import ActionManager
 from services.pdf_generator import PDFInvoiceGenerator
 from services.invoice_composer import InvoiceComposer
+from services.job_queue import JobQueue, JobQueueFullError
+from utils.metrics import metrics
+from utils.gemini_usage import gemini_usage, current_run
 from config import config
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
@@ -435,6 +447,11 @@ _vertex_search_service = None
 _agent_search_service = None
 _issue_detector = None
 _action_manager = None
+_job_queue = None
+_email_prefilter = None
+_entity_verdict_cache = None
+_gmail_sync_checkpoints = None
+_gmail_import_ledger = None
 
 def get_processor():
     """Lazy initialization of InvoiceProcessor to avoid blocking app startup"""
@@ -478,6 +495,59 @@ def get_vertex_search_service():
         _vertex_search_service = VertexSearchService()
     return _vertex_search_service
 
+def get_email_prefilter():
+    """Lazy initialization of EmailPrefilter (None when disabled)"""
+    global _email_prefilter
+    if _email_prefilter is None and config.EMAIL_PREFILTER_ENABLED:
+        _email_prefilter = EmailPrefilter()
+    return _email_prefilter
+
+def get_entity_verdict_cache():
+    """Lazy initialization of EntityVerdictCache (None when disabled); starts the rejected-entity preload when due"""
+    global _entity_verdict_cache
+    if _entity_verdict_cache is None and config.ENTITY_CACHE_ENABLED:
+        _entity_verdict_cache = EntityVerdictCache()
+        if config.ENTITY_CACHE_PRELOAD_REJECTED and _entity_verdict_cache.preload_due():
+            threading.Thread(target=preload_rejected_entities, args=(_entity_verdict_cache,), daemon=True).start()
+    return _entity_verdict_cache
+
+def preload_rejected_entities(verdict_cache):
+    """Seed the verdict cache with every entity rejected so far (knowledge-base documents)"""
+    try:
+        rejected = get_vertex_search_service().list_rejected_entities()
+        stored = verdict_cache.preload_rejected(rejected)
+        print(f"✓ Entity verdict cache preloaded with {stored} rejected entities")
+    except Exception as e:
+        print(f"⚠️ Rejected entity preload failed (non-critical): {e}")
+
+def get_entity_classifier(gemini_service):
+    """SemanticEntityClassifier backed by the verdict cache and the vendor directory"""
+    vendor_directory = None
+    if config.ENTITY_DIRECTORY_SHORT_CIRCUIT:
+        vendor_directory = lambda name_keys: get_bigquery_service().find_known_vendor_keys(name_keys)
+    return SemanticEntityClassifier(gemini_service, verdict_cache=get_entity_verdict_cache(), vendor_directory=vendor_directory)
+
+def get_gmail_sync_checkpoints():
+    """Lazy initialization of GmailSyncCheckpoints (None when incremental sync is disabled)"""
+    global _gmail_sync_checkpoints
+    if _gmail_sync_checkpoints is None and config.GMAIL_INCREMENTAL_SYNC_ENABLED:
+        _gmail_sync_checkpoints = GmailSyncCheckpoints()
+    return _gmail_sync_checkpoints
+
+def get_gmail_import_ledger():
+    """Lazy initialization of GmailImportLedger (None when disabled)"""
+    global _gmail_import_ledger
+    if _gmail_import_ledger is None and config.GMAIL_IMPORT_LEDGER_ENABLED:
+        _gmail_import_ledger = GmailImportLedger()
+    return _gmail_import_ledger
+
+def get_job_queue():
+    """Lazy initialization of JobQueue"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
+
 def get_agent_services():
     """Lazy initialization of agent services"""
     global _agent_search_service, _issue_detector, _action_manager
@@ -528,12 +598,154 @@ def api_info():
         'version': '1.0.0',
         'architecture': '3-layer hybrid (Document AI + Vertex Search + Gemini)',
         'endpoints': {
-            'POST /process': 'Process invoice from GCS URI',
-            'POST /upload': 'Upload and process invoice file',
-            'GET /health': 'Health check'
+            'POST /process': 'Queue processing of invoice from GCS URI (?wait=true for synchronous)',
+            'POST /upload': 'Upload invoice file and queue processing (?wait=true for synchronous)',
+            'POST /process/batch': 'Bulk-process a GCS prefix or URI list (NDJSON stream)',
+            'GET /jobs/<job_id>': 'Job status, per-layer progress and result',
+            'GET /health': 'Health check',
+            'GET /metrics': 'Prometheus metrics (per-stage latency and outcomes, Gemini primary vs fallback)',
+            'GET /api/gemini/usage': 'Gemini tokens, latency, retries and cost per call site and per import run'
         }
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Per-stage latency histograms and outcome counters in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/gemini/usage', methods=['GET'])
+def gemini_usage_report():
+    """
+    Gemini token, latency and cost totals per call site (biggest consumers first)
+    
+    Query params:
+        run_id: Restrict totals to one import run (ids are listed under recent_runs)
+        runs: Number of recent runs to list (default 20)
+    """
+    try:
+        report = gemini_usage.summary(
+            run_id=request.args.get('run_id'),
+            run_limit=request.args.get('runs', 20, type=int)
+        )
+        return jsonify(report)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def stream_in_usage_run(kind, chunks):
+    """Attribute every Gemini call a streaming response makes to one usage run"""
+    with gemini_usage.run(kind):
+        yield from chunks
+
+def run_with_progress_events(func, *args, keepalive_seconds=15, **kwargs):
+    """
+    Run a pipeline call in a worker thread and relay its progress while it runs
+    
+    func is called with an extra progress_callback(layer, status, **details), like
+    JobQueue jobs. Yields ('progress', (layer, status, details)) as callbacks arrive,
+    ('keepalive', None) after keepalive_seconds of silence, then ('result', value).
+    Exceptions raised by func are re-raised in the caller.
+    """
+    events = queue.Queue()
+    
+    def progress_callback(layer, status, **details):
+        events.put(('progress', (layer, status, details)))
+    
+    def worker():
+        try:
+            events.put(('result', func(*args, progress_callback=progress_callback, **kwargs)))
+        except Exception as e:
+            events.put(('error', e))
+    
+    threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True).start()
+    
+    while True:
+        try:
+            kind, value = events.get(timeout=keepalive_seconds)
+        except queue.Empty:
+            yield 'keepalive', None
+            continue
+        if kind == 'error':
+            raise value
+        yield kind, value
+        if kind == 'result':
+            return
+
+def relay_in_parallel(generators, max_workers, keepalive_seconds=15):
+    """
+    Drive several generators on worker threads and relay what they yield as it arrives
+    
+    At most max_workers generators run at once, each in a copy of the caller's
+    context (Gemini usage run, deadline). Yields ('item', value) in arrival order
+    and ('keepalive', None) after keepalive_seconds of silence. Exceptions raised
+    by a generator are re-raised in the caller. When the caller stops early (SSE
+    client disconnect) or a generator raises, queued generators never start and
+    running ones are closed at their next yield.
+    """
+    events = queue.Queue()
+    stopped = threading.Event()
+    
+    def drain(generator):
+        try:
+            for value in generator:
+                if stopped.is_set():
+                    break
+                events.put(('item', value))
+        except Exception as e:
+            events.put(('error', e))
+        finally:
+            generator.close()
+            events.put(('done', None))
+    
+    executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix='sse-relay')
+    futures = [executor.submit(contextvars.copy_context().run, drain, generator) for generator in generators]
+    executor.shutdown(wait=False)
+    
+    remaining = len(futures)
+    try:
+        while remaining:
+            try:
+                kind, value = events.get(timeout=keepalive_seconds)
+            except queue.Empty:
+                yield 'keepalive', None
+                continue
+            if kind == 'done':
+                remaining -= 1
+            elif kind == 'error':
+                raise value
+            else:
+                yield kind, value
+    finally:
+        stopped.set()
+        for future in futures:
+            future.cancel()
+
+def stream_extraction_progress(send_event, func, *args, **kwargs):
+    """
+    Run a pipeline call while relaying fields streamed from Gemini validation as SSE progress
+    
+    Use as `result = yield from stream_extraction_progress(send_event, func, ...)` inside
+    an SSE generator. Each 'partial' event carries the newly parsed fields in its message
+    and every field parsed so far in 'fields'; keepalives are sent while nothing arrives.
+    """
+    labels = {'vendor': 'Vendor', 'invoiceNumber': 'Invoice #', 'documentDate': 'Date', 'total': 'Total'}
+    
+    for kind, value in run_with_progress_events(func, *args, **kwargs):
+        if kind == 'result':
+            return value
+        if kind == 'keepalive':
+            yield send_event('progress', {'type': 'keepalive', 'message': '⏳ Still processing...'})
+            continue
+        
+        layer, status, details = value
+        latest = details.get('latest') or {}
+        parts = [f"{label}: {latest[name]}" for name, label in labels.items() if latest.get(name) not in (None, '')]
+        if status == 'partial' and parts:
+            yield send_event('progress', {
+                'type': 'partial',
+                'message': f"    ⚡ {' | '.join(parts)}",
+                'fields': details.get('fields') or {}
+            })
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({
@@ -543,16 +755,60 @@ def health():
         'vertex_search_datastore': config.VERTEX_SEARCH_DATA_STORE_ID
     })
 
+def wants_sync_response():
+    """Callers can opt out of the job queue with ?wait=true (legacy blocking behaviour)"""
+    return request.args.get('wait', 'false').lower() == 'true'
+
+def enqueue_job(job_type, func, *args):
+    """
+    Queue a pipeline job and return a 202 response with its status URL
+    
+    Returns:
+        Flask response tuple (202 on success, 503 if the queue is full)
+    """
+    try:
+        job_id = get_job_queue().submit(job_type, func, *args)
+    except JobQueueFullError as e:
+        return jsonify({'error': str(e), 'retry_after_seconds': 30}), 503
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('get_job_status', job_id=job_id)
+    }), 202
+
+def run_process_pipeline(gcs_uri, mime_type, progress_callback=None):
+    """Job body for /process: run the 3-layer pipeline on a GCS URI"""
+    return get_processor().process_invoice(gcs_uri, mime_type, progress_callback=progress_callback)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Get status of a queued /upload or /process job
+    
+    Returns job status (queued | running | completed | failed), per-layer progress and,
+    once finished, the same result payload the synchronous endpoint would return.
+    """
+    job = get_job_queue().get(job_id)
+    
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify(job), 200
+
 @app.route('/process', methods=['POST'])
 def process_invoice():
     """
-    Process an invoice from GCS URI
+    Queue processing of an invoice from GCS URI
     
     Request body:
     {
         "gcs_uri": "gs://bucket/invoice.pdf",
         "mime_type": "application/pdf"
     }
+    
+    Returns 202 with a job id (poll GET /jobs/<job_id>). Pass ?wait=true to block
+    and return the pipeline result directly.
     """
     data = request.get_json()
     
@@ -562,14 +818,98 @@ def process_invoice():
     gcs_uri = data['gcs_uri']
     mime_type = data.get('mime_type', 'application/pdf')
     
-    result = get_processor().process_invoice(gcs_uri, mime_type)
+    if wants_sync_response():
+        result = get_processor().process_invoice(gcs_uri, mime_type)
+        return jsonify(result), 200
+    
+    return enqueue_job('process', run_process_pipeline, gcs_uri, mime_type)
+
+@app.route('/process/batch', methods=['POST'])
+def process_invoice_batch():
+    """
+    Bulk-process invoices already in GCS (Document AI batch processing + bounded fan-out)
+    
+    Request body (one of gcs_prefix / gcs_uris):
+    {
+        "gcs_prefix": "gs://payouts-invoices/2024/",
+        "gcs_uris": ["gs://payouts-invoices/a.pdf", "gs://payouts-invoices/b.png"],
+        "max_workers": 4
+    }
+    
+    Streams NDJSON: one line per document as it completes, then a summary line.
+    """
+    data = request.get_json() or {}
+    gcs_prefix = data.get('gcs_prefix')
+    gcs_uris = data.get('gcs_uris') or []
+    
+    if not gcs_prefix and not gcs_uris:
+        return jsonify({'error': 'gcs_prefix or gcs_uris is required'}), 400
+    if gcs_prefix and not gcs_prefix.startswith('gs://'):
+        return jsonify({'error': 'gcs_prefix must start with gs://'}), 400
+    
+    max_workers = data.get('max_workers')
+    if max_workers is not None:
+        try:
+            max_workers = int(max_workers)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'max_workers must be an integer'}), 400
+        max_workers = max(1, min(max_workers, config.BATCH_PIPELINE_WORKERS * 4))
+    
+    documents = []
+    for gcs_uri in gcs_uris:
+        ext = gcs_uri.rsplit('.', 1)[-1].lower() if '.' in gcs_uri else ''
+        if not gcs_uri.startswith('gs://') or ext not in MIME_TYPES:
+            return jsonify({'error': f'Unsupported GCS URI: {gcs_uri}'}), 400
+        documents.append((gcs_uri, MIME_TYPES[ext]))
+    
+    processor = get_processor()
+    if gcs_prefix:
+        try:
+            documents.extend(processor.list_gcs_documents(gcs_prefix, MIME_TYPES))
+        except Exception as e:
+            return jsonify({'error': f'Could not list {gcs_prefix}: {str(e)}'}), 500
+    
+    if not documents:
+        return jsonify({'error': 'No supported invoice files found'}), 404
     
-    return jsonify(result), 200
+    def generate():
+        completed = 0
+        failed = 0
+        start_time = datetime.now()
+        
+        try:
+            for result in processor.process_batch(documents, max_workers=max_workers):
+                if result.get('status') == 'completed':
+                    completed += 1
+                else:
+                    failed += 1
+                yield json.dumps({'type': 'result', 'result': result}, default=str) + '\n'
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+        
+        elapsed = (datetime.now() - start_time).total_seconds()
+        yield json.dumps({
+            'type': 'summary',
+            'total': len(documents),
+            'completed': completed,
+            'failed': failed,
+            'elapsed_seconds': round(elapsed, 1),
+            'documents_per_hour': round((completed + failed) * 3600 / elapsed) if elapsed else None,
+            'usage_run_id': current_run.get()
+        }) + '\n'
+    
+    response = Response(stream_with_context(stream_in_usage_run('batch', generate())), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/upload', methods=['POST'])
 def upload_invoice():
     """
-    Upload and process an invoice file with automatic vendor matching
+    Upload an invoice file and queue it for processing with automatic vendor matching
+    
+    Returns 202 with a job id (poll GET /jobs/<job_id> for per-layer status and the
+    final result). Pass ?wait=true to block and return the result directly.
     """
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
@@ -583,17 +923,63 @@ def upload_invoice():
         return jsonify({'error': f'File type not allowed. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
     
     filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    filepath = upload_path(filename)
     file.save(filepath)
     
     ext = filename.rsplit('.', 1)[1].lower()
     mime_type = MIME_TYPES.get(ext, 'application/pdf')
     
+    if wants_sync_response():
+        return jsonify(run_upload_pipeline(filepath, mime_type)), 200
+    
+    response = enqueue_job('upload', run_upload_pipeline, filepath, mime_type)
+    if response[1] != 202:
+        remove_upload(filepath)
+    return response
+
+def upload_path(filename):
+    """Local path for an incoming file in its own directory, so concurrent files with the same name never collide"""
+    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], uuid.uuid4().hex)
+    os.makedirs(upload_dir, exist_ok=True)
+    return os.path.join(upload_dir, secure_filename(filename))
+
+def extraction_failed(invoice_result):
+    """True when the pipeline did not complete (process_local_file reports failures in its result instead of raising)"""
+    return invoice_result.get('status') != 'completed' or 'error' in (invoice_result.get('validated_data') or {})
+
+def extraction_error(invoice_result):
+    """Error message of a failed pipeline result"""
+    return str(invoice_result.get('error') or (invoice_result.get('validated_data') or {}).get('error') or 'unknown error')
+
+def remove_upload(filepath):
+    """Delete an uploaded file and its per-request directory"""
+    try:
+        os.remove(filepath)
+        os.rmdir(os.path.dirname(filepath))
+    except OSError:
+        pass
+
+def run_upload_pipeline(filepath, mime_type, progress_callback=None):
+    """
+    Run the full /upload pipeline: 3-layer extraction, entity classification,
+    vendor matching and BigQuery insert
+    
+    Runs outside the request context (job worker), so it must not touch request/session.
+    
+    Args:
+        filepath: Local path of the uploaded file (deleted when done)
+        mime_type: MIME type of the file
+        progress_callback: Optional callable(layer, status, **details) for per-layer job progress
+    
+    Returns:
+        Result dictionary (same payload the synchronous /upload returns)
+    """
     # FIX ISSUE 1: Cache processor instance to prevent re-entrancy deadlock
     processor = get_processor()
-    result = processor.process_local_file(filepath, mime_type)
-    
-    os.remove(filepath)
+    try:
+        result = processor.process_local_file(filepath, mime_type, progress_callback=progress_callback)
+    finally:
+        remove_upload(filepath)
     
     # AUTOMATIC VENDOR MATCHING: Trigger vendor matching if invoice extraction succeeded
     vendor_match_result = None
@@ -626,6 +1012,9 @@ def upload_invoice():
             print(f"AUTOMATIC VENDOR MATCHING: {vendor_name}")
             print(f"{'='*60}\n")
             
+            if progress_callback:
+                progress_callback('vendor_matching', 'running')
+            
             try:
                 # FIX ISSUE 3: Add logging for troubleshooting
                 print(f"⚡ Starting automatic vendor matching for vendor: {vendor_name}")
@@ -633,7 +1022,7 @@ def upload_invoice():
                 # AI-FIRST ENTITY CLASSIFICATION (before vendor matching)
                 print(f"\n🤖 Step 0: Semantic Entity Classification")
                 print(f"-" * 60)
-                classifier = SemanticEntityClassifier(processor.gemini_service)
+                classifier = get_entity_classifier(processor.gemini_service)
                 
                 classification = classifier.classify_entity(
                     entity_name=vendor_name,
@@ -641,24 +1030,24 @@ def upload_invoice():
                 )
                 
                 # Log classification
-                print(f"🤖 Entity Classification: {classification['entity_type']} ({classification['confidence']})")
+                print(f"🤖 Entity Classification: {classification['entity_type']} ({classification['confidence']}, {classification.get('source', 'gemini')})")
                 print(f"   Reasoning: {classification['reasoning']}")
                 
                 # Reject non-vendors (banks, payment processors, government entities)
                 if not classification.get('is_valid_vendor', True):
                     print(f"❌ Rejected: {vendor_name} is classified as {classification['entity_type']}")
                     
-                    # Store rejected entity for RAG learning
-                    vertex_service = get_vertex_search_service()
-                    try:
-                        vertex_service.store_rejected_entity(
-                            entity_name=vendor_name,
-                            entity_type=classification['entity_type'],
-                            reasoning=classification['reasoning']
-                        )
-                        print(f"✓ Rejected entity stored in Vertex Search for learning")
-                    except Exception as store_error:
-                        print(f"⚠️ Failed to store rejected entity: {store_error}")
+                    # Store rejected entity for RAG learning (cached verdicts were stored when first made)
+                    if not classification.get('cached'):
+                        try:
+                            get_vertex_search_service().store_rejected_entity(
+                                entity_name=vendor_name,
+                                entity_type=classification['entity_type'],
+                                reasoning=classification['reasoning']
+                            )
+                            print(f"✓ Rejected entity stored in Vertex Search for learning")
+                        except Exception as store_error:
+                            print(f"⚠️ Failed to store rejected entity: {store_error}")
                     
                     vendor_match_result = {
                         'verdict': 'INVALID_VENDOR',
@@ -801,7 +1190,7 @@ def upload_invoice():
                                     'emails': row.emails if isinstance(row.emails, list) else [],
                                     'domains': row.domains if isinstance(row.domains, list) else []
                                 }
-                            
+                        
                         except Exception as e:
                             print(f"⚠️ Warning: Could not fetch database vendor details: {e}")
                             vendor_match_result['database_vendor_error'] = str(e)
@@ -823,7 +1212,7 @@ def upload_invoice():
                 # Log completion for rejected entities
                 if vendor_match_result and vendor_match_result.get('verdict') == 'INVALID_VENDOR':
                     print(f"✓ Entity classification complete: INVALID_VENDOR ({vendor_match_result.get('entity_type')})")
-                
+            
             except Exception as e:
                 # FIX ISSUE 3: Add explicit error logging
                 print(f"❌ Vendor matching failed: {e}")
@@ -859,6 +1248,8 @@ def upload_invoice():
     # Add vendor matching result to response
     if vendor_match_result:
         result['vendor_match'] = vendor_match_result
+        if progress_callback:
+            progress_callback('vendor_matching', 'success', verdict=vendor_match_result.get('verdict'))
     
     # SAVE INVOICE-VENDOR MATCH TO BIGQUERY
     if result.get('status') == 'completed' and 'validated_data' in result:
@@ -911,10 +1302,14 @@ def upload_invoice():
         try:
             bigquery_service = get_bigquery_service()
             bigquery_service.insert_invoice(invoice_data)
+            if progress_callback:
+                progress_callback('bigquery_insert', 'success')
         except Exception as e:
             print(f"⚠️ Warning: Could not save invoice to BigQuery: {e}")
+            if progress_callback:
+                progress_callback('bigquery_insert', 'error', error=str(e))
     
-    return jsonify(result), 200
+    return result
 
 @app.route('/api/vendor/match', methods=['POST'])
 def match_vendor():
@@ -985,7 +1380,7 @@ def match_vendor():
             'success': True,
             'result': result
         }), 200
-        
+    
     except Exception as e:
         print(f"❌ Vendor matching error: {e}")
         return jsonify({
@@ -1033,7 +1428,7 @@ def get_invoice_matches():
             'page': page,
             'limit': limit
         }), 200
-        
+    
     except Exception as e:
         print(f"❌ Error fetching invoice matches: {e}")
         return jsonify({
@@ -1168,7 +1563,7 @@ def get_invoice_download_url(invoice_id):
             'file_size': file_size,
             'expires_in': expiration_seconds
         }), 200
-        
+    
     except Exception as e:
         print(f"❌ Error generating download URL: {e}")
         return jsonify({
@@ -1287,43 +1682,14 @@ def gmail_import_stream():
             email = credentials.get('email', 'Gmail account')
             yield send_event('progress', {'type': 'status', 'message': f'Connected to {email}'})
             
-            # Get ACCURATE total count by fetching all message IDs in time range
-            from datetime import datetime, timedelta
-            after_date = (datetime.now() - timedelta(days=days)).strftime('%Y/%m/%d')
-            yield send_event('progress', {'type': 'status', 'message': f'\n📊 Counting total emails in last {time_label}...'})
-            
+            # Mailbox size for the funnel: one estimate call instead of paging through every message ID
             try:
-                # Paginate through ALL emails in time range to get accurate count
-                all_messages = []
-                page_token = None
-                
-                while True:
-                    params = {
-                        'userId': 'me',
-                        'q': f'after:{after_date}',
-                        'maxResults': 500  # Max per page
-                    }
-                    if page_token:
-                        params['pageToken'] = page_token
-                    
-                    response = service.users().messages().list(**params).execute()
-                    messages_page = response.get('messages', [])
-                    all_messages.extend(messages_page)
-                    
-                    page_token = response.get('nextPageToken')
-                    if not page_token:
-                        break
-                    
-                    # Show progress for large mailboxes
-                    if len(all_messages) % 1000 == 0:
-                        yield send_event('progress', {'type': 'status', 'message': f'  Counted {len(all_messages):,} emails so far...'})
-                
-                total_inbox_count = len(all_messages)
+                total_inbox_count = gmail_service.estimate_message_count(service, days)
             except Exception as e:
                 total_inbox_count = 0
                 yield send_event('progress', {'type': 'status', 'message': f'⚠️ Could not count emails: {str(e)}'})
             
-            yield send_event('progress', {'type': 'status', 'message': f'📬 Total emails in selected time range ({time_label}): {total_inbox_count:,} emails'})
+            yield send_event('progress', {'type': 'status', 'message': f'📬 Total emails in selected time range ({time_label}): ~{total_inbox_count:,} emails (estimate)'})
             
             # Stage 1: Broad Net Gmail Query
             stage1_msg = '\n🔍 STAGE 1: Broad Net Gmail Query (Multi-Language)'
@@ -1331,12 +1697,73 @@ def gmail_import_stream():
             yield send_event('progress', {'type': 'status', 'message': 'Casting wide net: English, Hebrew, French, German, Spanish keywords...'})
             yield send_event('progress', {'type': 'status', 'message': 'Excluding: newsletters, webinars, invitations...'})
             
-            messages = gmail_service.search_invoice_emails(service, 500, days)  # Get up to 500 for filtering
+            # Incremental sync: only the mail added since the last completed import of this account
+            sync_checkpoints = get_gmail_sync_checkpoints()
+            import_ledger = get_gmail_import_ledger()
+            account = None
+            sync_history_id = None
+            if sync_checkpoints or import_ledger:
+                try:
+                    profile = gmail_service.get_profile(service)
+                    account = profile.get('emailAddress')
+                    sync_history_id = profile.get('historyId')
+                except Exception as e:
+                    yield send_event('progress', {'type': 'status', 'message': f'⚠️ Could not read mailbox profile, incremental sync and import ledger off: {str(e)[:60]}'})
+            
+            start_history_id = None
+            if sync_checkpoints and account and request.args.get('mode') != 'full':
+                start_history_id = sync_checkpoints.get(account)
+            
+            messages = None
+            message_headers = None
+            sync_mode = 'full'
+            # Emails that must be listed again; the sync checkpoint only advances when none are left
+            unfinished_ids = set()
+            if start_history_id:
+                try:
+                    new_messages = gmail_service.list_new_messages(service, start_history_id)
+                    # Kept by an earlier import but not fully extracted: the history will not list them again
+                    listed_ids = {msg_ref['id'] for msg_ref in new_messages}
+                    retry_refs = [
+                        {'id': message_id} for message_id in (import_ledger.get_unsettled_messages(account) if import_ledger else [])
+                        if message_id not in listed_ids
+                    ]
+                    message_headers = gmail_service.get_messages_metadata(service, [msg_ref['id'] for msg_ref in new_messages + retry_refs])
+                    unfinished_ids.update(msg_ref['id'] for msg_ref in new_messages if not message_headers.get(msg_ref['id']))
+                    messages = [msg_ref for msg_ref in retry_refs if message_headers.get(msg_ref['id'])] + [
+                        msg_ref for msg_ref in new_messages
+                        if message_headers.get(msg_ref['id'])
+                        and gmail_service.matches_broad_net(gmail_service.get_email_metadata(message_headers[msg_ref['id']]))
+                    ]
+                    if retry_refs:
+                        yield send_event('progress', {'type': 'status', 'message': f'↻ Retrying {len(retry_refs)} emails whose extraction did not finish last time'})
+                    sync_mode = 'incremental'
+                    yield send_event('progress', {'type': 'status', 'message': f'⚡ Incremental sync: {len(new_messages)} new emails since the last import'})
+                except GmailHistoryExpiredError:
+                    sync_checkpoints.clear(account)
+                    message_headers = None
+                    unfinished_ids.clear()
+                    yield send_event('progress', {'type': 'status', 'message': '⚠️ Sync checkpoint expired, scanning the full time range'})
+                except Exception as e:
+                    message_headers = None
+                    unfinished_ids.clear()
+                    yield send_event('progress', {'type': 'status', 'message': f'⚠️ Incremental sync failed, scanning the full time range: {str(e)[:60]}'})
+            
+            if messages is None:
+                messages = gmail_service.search_invoice_emails(service, 500, days)  # Get up to 500 for filtering
             
             total_found = len(messages)
             stage1_percent = round((total_found / max(total_inbox_count, 1)) * 100, 2)
             yield send_event('progress', {'type': 'status', 'message': f'📧 Found {total_found} emails matching broad financial patterns ({stage1_percent}% of inbox)'})
             
+            # Import ledger: emails an earlier import already rejected or extracted are skipped outright
+            ledger_entries = {}
+            if import_ledger and account and request.args.get('reprocess') != 'true':
+                ledger_entries = import_ledger.get_messages(account, [msg_ref['id'] for msg_ref in messages])
+            handled_ids = {message_id for message_id, entry in ledger_entries.items() if GmailImportLedger.is_settled(entry)}
+            if handled_ids:
+                yield send_event('progress', {'type': 'status', 'message': f'↩ {len(handled_ids)} emails already handled by an earlier import (skipped)'})
+            
             # Stage 2: Elite Gatekeeper AI Filter
             stage2_msg = '\n🧠 STAGE 2: Elite Gatekeeper AI Filter (Gemini 1.5 Flash)'
             yield send_event('progress', {'type': 'status', 'message': stage2_msg})
@@ -1345,35 +1772,80 @@ def gmail_import_stream():
             
             processor = get_processor()
             gemini_service = processor.gemini_service
+            email_prefilter = get_email_prefilter()
             classified_invoices = []
             non_invoices = []
+            locally_decided = 0
             
-            # First pass: Classify all emails using AI Gatekeeper
-            for idx, msg_ref in enumerate(messages, 1):
+            # Headers, snippet and attachment names only (batched); full messages are fetched in Stage 3
+            if message_headers is None:
                 try:
-                    message = gmail_service.get_message_details(service, msg_ref['id'])
-                    
-                    if not message:
-                        non_invoices.append(('Failed to fetch', None))
+                    message_headers = gmail_service.get_messages_metadata(service, [msg_ref['id'] for msg_ref in messages if msg_ref['id'] not in handled_ids])
+                except Exception as e:
+                    message_headers = {}
+                    yield send_event('progress', {'type': 'status', 'message': f'  ⚠️ Error fetching email headers: {str(e)[:60]}'})
+            
+            # First pass: Classify all emails using AI Gatekeeper (one Gemini request per batch)
+            batch_size = max(1, min(config.GATEKEEPER_BATCH_SIZE, 50))
+            for batch_start in range(0, total_found, batch_size):
+                batch = []
+                for idx, msg_ref in enumerate(messages[batch_start:batch_start + batch_size], batch_start + 1):
+                    if msg_ref['id'] in handled_ids:
                         continue
-                    
-                    metadata = gmail_service.get_email_metadata(message)
+                    try:
+                        message = message_headers.get(msg_ref['id'])
+                        
+                        if not message:
+                            non_invoices.append(('Failed to fetch', None))
+                            unfinished_ids.add(msg_ref['id'])
+                            continue
+                        
+                        metadata = gmail_service.get_email_metadata(message)
+                        entry = ledger_entries.get(msg_ref['id'])
+                        if entry and entry['verdict'] == 'keep':
+                            # Kept by an earlier import whose extraction did not finish: reuse the verdict
+                            classified_invoices.append((metadata, entry['confidence'] or 1.0))
+                            continue
+                        
+                        batch.append((idx, message, metadata))
+                    except Exception as e:
+                        non_invoices.append((f'Error: {str(e)}', None))
+                        unfinished_ids.add(msg_ref['id'])
+                        yield send_event('progress', {'type': 'status', 'message': f'  ⚠️ Error classifying email: {str(e)[:60]}'})
+                
+                if not batch:
+                    continue
+                
+                yield send_event('progress', {'type': 'status', 'message': f'  🧠 Gatekeeper batch: emails {batch[0][0]}-{batch[-1][0]} of {total_found}...'})
+                
+                try:
+                    verdicts = gmail_service.classify_invoice_emails([metadata for _, _, metadata in batch], gemini_service, email_prefilter)
+                except Exception as e:
+                    for _, _, metadata in batch:
+                        non_invoices.append((f'Error: {str(e)}', None))
+                        unfinished_ids.add(metadata['id'])
+                    yield send_event('progress', {'type': 'status', 'message': f'  ⚠️ Error classifying emails: {str(e)[:60]}'})
+                    continue
+                
+                if import_ledger and account:
+                    import_ledger.record_verdicts(account, [
+                        (metadata['id'], is_invoice and confidence >= 0.3, confidence, reasoning)
+                        for (_, _, metadata), (is_invoice, confidence, reasoning) in zip(batch, verdicts)
+                    ])
+                
+                for (idx, message, metadata), (is_invoice, confidence, reasoning) in zip(batch, verdicts):
                     subject = metadata.get('subject', 'No subject')
-                    
-                    is_invoice, confidence, reasoning = gmail_service.classify_invoice_email(metadata, gemini_service)
+                    if reasoning.startswith('[Local Pre-filter]'):
+                        locally_decided += 1
                     
                     if is_invoice and confidence >= 0.3:
-                        classified_invoices.append((message, metadata, confidence))
+                        classified_invoices.append((metadata, confidence))
                         invoice_msg = f'  ✓ [{idx}/{total_found}] KEEP: "{subject[:50]}..." ({reasoning[:80]})'
                         yield send_event('progress', {'type': 'status', 'message': invoice_msg})
                     else:
                         non_invoices.append((subject, reasoning))
                         skip_msg = f'  ✗ [{idx}/{total_found}] KILL: "{subject[:50]}..." ({reasoning[:80]})'
                         yield send_event('progress', {'type': 'status', 'message': skip_msg})
-                    
-                except Exception as e:
-                    non_invoices.append((f'Error: {str(e)}', None))
-                    yield send_event('progress', {'type': 'status', 'message': f'  ⚠️ Error classifying email: {str(e)[:60]}'})
             
             invoice_count = len(classified_invoices)
             non_invoice_count = len(non_invoices)
@@ -1385,11 +1857,14 @@ def gmail_import_stream():
             # Send structured filtering funnel event
             funnel_stats = {
                 'timeRange': time_label,
+                'syncMode': sync_mode,
                 'totalInboxCount': total_inbox_count,
                 'totalEmails': total_found,
                 'afterLanguageFilter': total_found,
                 'languageFilterPercent': round((total_found / max(total_inbox_count, 1)) * 100, 2),
                 'afterAIFilter': invoice_count,
+                'decidedByLocalPrefilter': locally_decided,
+                'previouslyHandled': len(handled_ids),
                 'aiFilterPercent': after_ai_filter_percent,
                 'invoicesFound': 0,  # Will be updated after extraction
                 'invoicesPercent': 0.0
@@ -1402,6 +1877,8 @@ def gmail_import_stream():
             yield send_event('progress', {'type': 'status', 'message': f'  • After Stage 1 filter: {total_found} ({stage1_percent}%)'})
             yield send_event('progress', {'type': 'status', 'message': f'  • After Stage 2 AI filter: {invoice_count} ({after_ai_filter_percent}% of {total_found})'})
             yield send_event('progress', {'type': 'status', 'message': f'  • Rejected: {non_invoice_count} emails'})
+            if locally_decided:
+                yield send_event('progress', {'type': 'status', 'message': f'  • Decided by local pre-filter (no Gemini call): {locally_decided} emails'})
             
             # Stage 3: Extract invoice data through 3-layer AI
             stage3_msg = f'\n🤖 STAGE 3: Deep AI Extraction ({invoice_count} invoices)'
@@ -1411,50 +1888,101 @@ def gmail_import_stream():
             imported_invoices = []
             extraction_failures = []
             
-            for idx, (message, metadata, confidence) in enumerate(classified_invoices, 1):
+            # googleapiclient services share one httplib2.Http, which is not thread-safe:
+            # every extraction worker thread builds its own
+            worker_services = threading.local()
+            
+            def worker_gmail_service():
+                if not hasattr(worker_services, 'service'):
+                    worker_services.service = gmail_service.build_service(credentials)
+                return worker_services.service
+            
+            def extract_email(idx, metadata):
+                """Stage 3 for one kept email; its events carry email_index so parallel progress can be told apart"""
+                def send_email_event(event_type, data_dict):
+                    return send_event(event_type, dict(data_dict, email_index=idx))
+                
+                # Document outcomes; files extracted by an earlier import (same SHA-256) are skipped
+                outcomes = []
+                
+                def already_imported(file_data):
+                    return bool(import_ledger and account) and import_ledger.document_handled(account, hashlib.sha256(file_data).hexdigest())
+                
+                def record_document(file_data, filename, status):
+                    outcomes.append(status)
+                    if import_ledger and account:
+                        import_ledger.record_document(account, hashlib.sha256(file_data).hexdigest(), metadata['id'], filename, status)
+                
+                def retry_later():
+                    # The ledger keeps the email unsettled and incremental imports add it back;
+                    # without the ledger the sync checkpoint has to stay put instead
+                    if not (import_ledger and account):
+                        unfinished_ids.add(metadata['id'])
+                
                 try:
                     subject = metadata.get('subject', 'No subject')
                     sender = metadata.get('from', 'Unknown')
                     
                     processing_msg = f'\n[{idx}/{invoice_count}] Processing: "{subject[:50]}..."'
-                    yield send_event('progress', {'type': 'analyzing', 'message': processing_msg})
-                    yield send_event('progress', {'type': 'info', 'message': f'  From: {sender}'})
+                    yield send_email_event('progress', {'type': 'analyzing', 'message': processing_msg})
+                    yield send_email_event('progress', {'type': 'info', 'message': f'  From: {sender}'})
+                    
+                    message = gmail_service.get_message_details(worker_gmail_service(), metadata['id'])
+                    if not message:
+                        yield send_email_event('progress', {'type': 'warning', 'message': '  ⚠️ Failed to fetch message'})
+                        extraction_failures.append(subject)
+                        retry_later()
+                        return
                     
                     # Extract attachments
-                    attachments = gmail_service.extract_attachments(service, message)
+                    attachments = gmail_service.extract_attachments(worker_gmail_service(), message)
                     
                     # Extract links
                     links = gmail_service.extract_links_from_body(message)
                     
                     if not attachments and not links:
-                        yield send_event('progress', {'type': 'warning', 'message': f'  ⚠️ No PDFs or download links found'})
+                        yield send_email_event('progress', {'type': 'warning', 'message': f'  ⚠️ No PDFs or download links found'})
                         extraction_failures.append(subject)
-                        continue
                     
                     # Process attachments
                     for filename, file_data in attachments:
-                        yield send_event('progress', {'type': 'status', 'message': f'  📎 Attachment: {filename}'})
+                        yield send_email_event('progress', {'type': 'status', 'message': f'  📎 Attachment: {filename}'})
                         
-                        secure_name = secure_filename(filename)
-                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_name)
+                        if already_imported(file_data):
+                            yield send_email_event('progress', {'type': 'info', 'message': '    ↩ Already imported by an earlier run, skipped'})
+                            outcomes.append(DOCUMENT_SKIPPED)
+                            continue
+                        
+                        filepath = upload_path(filename)
                         
                         with open(filepath, 'wb') as f:
                             f.write(file_data)
                         
-                        yield send_event('progress', {'type': 'status', 'message': '    → Layer 1: Document AI OCR...'})
-                        yield send_event('progress', {'type': 'status', 'message': '    → Layer 2: Vertex Search RAG...'})
-                        yield send_event('progress', {'type': 'status', 'message': '    → Layer 3: Gemini Semantic Extraction...'})
-                        yield send_event('progress', {'type': 'keepalive', 'message': '⏳ Processing invoice (this may take 30-60 seconds)...'})
+                        yield send_email_event('progress', {'type': 'status', 'message': '    → Layer 1: Document AI OCR...'})
+                        yield send_email_event('progress', {'type': 'status', 'message': '    → Layer 2: Vertex Search RAG...'})
+                        yield send_email_event('progress', {'type': 'status', 'message': '    → Layer 3: Gemini Semantic Extraction...'})
+                        yield send_email_event('progress', {'type': 'keepalive', 'message': '⏳ Processing invoice (this may take 30-60 seconds)...'})
                         
                         try:
-                            invoice_result = processor.process_local_file(filepath, 'application/pdf')
+                            # Gemini fields are relayed as they stream in, ahead of the final result
+                            invoice_result = yield from stream_extraction_progress(send_email_event, processor.process_local_file, filepath, 'application/pdf')
                         except Exception as proc_error:
-                            os.remove(filepath)
-                            yield send_event('progress', {'type': 'error', 'message': f'  ❌ Processing failed: {str(proc_error)[:100]}'})
+                            remove_upload(filepath)
+                            record_document(file_data, filename, DOCUMENT_FAILED)
+                            retry_later()
+                            yield send_email_event('progress', {'type': 'error', 'message': f'  ❌ Processing failed: {str(proc_error)[:100]}'})
                             extraction_failures.append(subject)
                             continue
                         
-                        os.remove(filepath)
+                        remove_upload(filepath)
+                        
+                        # A Document AI / Gemini / GCS outage is a failure to retry, not an incomplete invoice
+                        if extraction_failed(invoice_result):
+                            record_document(file_data, filename, DOCUMENT_FAILED)
+                            retry_later()
+                            yield send_email_event('progress', {'type': 'error', 'message': f'  ❌ Processing failed: {extraction_error(invoice_result)[:100]}'})
+                            extraction_failures.append(subject)
+                            continue
                         
                         validated = invoice_result.get('validated_data', {})
                         vendor_data = validated.get('vendor', {})
@@ -1466,9 +1994,11 @@ def gmail_import_stream():
                         invoice_num = validated.get('invoiceNumber', 'N/A')
                         
                         if vendor and vendor != 'Unknown' and total and total > 0:
-                            yield send_event('progress', {'type': 'success', 'message': f'  ✅ SUCCESS: {vendor} | Invoice #{invoice_num} | {currency} {total}'})
+                            record_document(file_data, filename, DOCUMENT_EXTRACTED)
+                            yield send_email_event('progress', {'type': 'success', 'message': f'  ✅ SUCCESS: {vendor} | Invoice #{invoice_num} | {currency} {total}'})
                             
                             imported_invoices.append({
+                                'email_index': idx,
                                 'subject': subject,
                                 'sender': sender,
                                 'date': metadata.get('date'),
@@ -1480,12 +2010,13 @@ def gmail_import_stream():
                                 'full_data': validated
                             })
                         else:
-                            yield send_event('progress', {'type': 'warning', 'message': f'  ⚠️ Extraction incomplete: Vendor={vendor}, Total={total}'})
+                            record_document(file_data, filename, DOCUMENT_INCOMPLETE)
+                            yield send_email_event('progress', {'type': 'warning', 'message': f'  ⚠️ Extraction incomplete: Vendor={vendor}, Total={total}'})
                             extraction_failures.append(subject)
                     
                     # Process links with AI-semantic intelligent processing
                     for link_url in links[:2]:  # Limit to first 2 links per email
-                        yield send_event('progress', {'type': 'status', 'message': f'  🔗 Analyzing link: {link_url[:80]}...'})
+                        yield send_email_event('progress', {'type': 'status', 'message': f'  🔗 Analyzing link: {link_url[:80]}...'})
                         
                         # AI-semantic intelligent link processing
                         email_context = f"{subject} - {metadata.get('snippet', '')[:100]}"
@@ -1497,15 +2028,19 @@ def gmail_import_stream():
                             link_type = link_result['type']  # 'pdf' or 'screenshot'
                             classification = link_result['link_classification']
                             
+                            if already_imported(file_data):
+                                yield send_email_event('progress', {'type': 'info', 'message': f'  ↩ {filename} already imported by an earlier run, skipped'})
+                                outcomes.append(DOCUMENT_SKIPPED)
+                                continue
+                            
                             # Show appropriate message based on processing type
                             if link_type == 'screenshot':
-                                yield send_event('progress', {'type': 'success', 'message': f'  📸 Screenshot captured: {filename}'})
-                                yield send_event('progress', {'type': 'info', 'message': f'  ℹ️ Source: Web receipt (screenshot)'})
+                                yield send_email_event('progress', {'type': 'success', 'message': f'  📸 Screenshot captured: {filename}'})
+                                yield send_email_event('progress', {'type': 'info', 'message': f'  ℹ️ Source: Web receipt (screenshot)'})
                             else:
-                                yield send_event('progress', {'type': 'success', 'message': f'  ✓ Downloaded: {filename}'})
+                                yield send_email_event('progress', {'type': 'success', 'message': f'  ✓ Downloaded: {filename}'})
                             
-                            secure_name = secure_filename(filename)
-                            filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_name)
+                            filepath = upload_path(filename)
                             
                             with open(filepath, 'wb') as f:
                                 f.write(file_data)
@@ -1513,23 +2048,31 @@ def gmail_import_stream():
                             # Determine file type for processing
                             if link_type == 'screenshot':
                                 file_mimetype = 'image/png'
-                                yield send_event('progress', {'type': 'status', 'message': '    → Layer 1: Document AI OCR (Image)...'})
+                                yield send_email_event('progress', {'type': 'status', 'message': '    → Layer 1: Document AI OCR (Image)...'})
                             else:
                                 file_mimetype = 'application/pdf'
-                                yield send_event('progress', {'type': 'status', 'message': '    → Layer 1: Document AI OCR...'})
+                                yield send_email_event('progress', {'type': 'status', 'message': '    → Layer 1: Document AI OCR...'})
                             
-                            yield send_event('progress', {'type': 'status', 'message': '    → Layer 2: Vertex Search RAG...'})
-                            yield send_event('progress', {'type': 'status', 'message': '    → Layer 3: Gemini Semantic Extraction...'})
-                            yield send_event('progress', {'type': 'keepalive', 'message': '⏳ Processing file...'})
+                            yield send_email_event('progress', {'type': 'status', 'message': '    → Layer 2: Vertex Search RAG...'})
+                            yield send_email_event('progress', {'type': 'status', 'message': '    → Layer 3: Gemini Semantic Extraction...'})
+                            yield send_email_event('progress', {'type': 'keepalive', 'message': '⏳ Processing file...'})
                             
                             try:
-                                invoice_result = processor.process_local_file(filepath, file_mimetype)
+                                invoice_result = yield from stream_extraction_progress(send_email_event, processor.process_local_file, filepath, file_mimetype)
                             except Exception as link_proc_error:
-                                os.remove(filepath)
-                                yield send_event('progress', {'type': 'error', 'message': f'  ❌ Processing failed: {str(link_proc_error)[:100]}'})
+                                remove_upload(filepath)
+                                record_document(file_data, filename, DOCUMENT_FAILED)
+                                retry_later()
+                                yield send_email_event('progress', {'type': 'error', 'message': f'  ❌ Processing failed: {str(link_proc_error)[:100]}'})
                                 continue
                             
-                            os.remove(filepath)
+                            remove_upload(filepath)
+                            
+                            if extraction_failed(invoice_result):
+                                record_document(file_data, filename, DOCUMENT_FAILED)
+                                retry_later()
+                                yield send_email_event('progress', {'type': 'error', 'message': f'  ❌ Processing failed: {extraction_error(invoice_result)[:100]}'})
+                                continue
                             
                             validated = invoice_result.get('validated_data', {})
                             vendor = validated.get('vendor', {}).get('name', 'Unknown')
@@ -1537,6 +2080,7 @@ def gmail_import_stream():
                             totals = validated.get('totals', {})
                             total = totals.get('total', 0)
                             currency = validated.get('currency', 'USD')
+                            record_document(file_data, filename, DOCUMENT_EXTRACTED if vendor and vendor != 'Unknown' and total and total > 0 else DOCUMENT_INCOMPLETE)
                             
                             # Save to BigQuery if extraction succeeded
                             if invoice_result.get('status') == 'completed' and validated:
@@ -1577,8 +2121,9 @@ def gmail_import_stream():
                             
                             if vendor and vendor != 'Unknown' and total and total > 0:
                                 source_label = '📸 Screenshot' if link_type == 'screenshot' else '🔗 Link'
-                                yield send_event('progress', {'type': 'success', 'message': f'  ✅ Extracted from {source_label}: {vendor} | Invoice #{invoice_num} | {currency} {total}'})
+                                yield send_email_event('progress', {'type': 'success', 'message': f'  ✅ Extracted from {source_label}: {vendor} | Invoice #{invoice_num} | {currency} {total}'})
                                 imported_invoices.append({
+                                    'email_index': idx,
                                     'subject': subject,
                                     'sender': sender,
                                     'date': metadata.get('date'),
@@ -1593,11 +2138,29 @@ def gmail_import_stream():
                         else:
                             # Processing failed - show why
                             reasoning = link_result['reasoning']
-                            yield send_event('progress', {'type': 'warning', 'message': f'  ⚠️ Failed: {reasoning[:120]}'})
-                    
+                            yield send_email_event('progress', {'type': 'warning', 'message': f'  ⚠️ Failed: {reasoning[:120]}'})
+                
                 except Exception as e:
-                    yield send_event('progress', {'type': 'error', 'message': f'  ❌ Extraction error: {str(e)}'})
+                    yield send_email_event('progress', {'type': 'error', 'message': f'  ❌ Extraction error: {str(e)}'})
                     extraction_failures.append(subject)
+                    outcomes.append(DOCUMENT_FAILED)
+                    retry_later()
+                
+                if import_ledger and account:
+                    import_ledger.record_extraction(account, metadata['id'], GmailImportLedger.extraction_status(outcomes))
+            
+            # Several emails at once; Document AI and Gemini calls are capped by DEPENDENCY_CONCURRENCY_LIMITS
+            workers = max(1, min(config.GMAIL_EXTRACTION_WORKERS, invoice_count))
+            if workers > 1:
+                yield send_event('progress', {'type': 'info', 'message': f'Extracting up to {workers} emails in parallel'})
+            
+            extractions = [extract_email(idx, metadata) for idx, (metadata, confidence) in enumerate(classified_invoices, 1)]
+            for kind, chunk in relay_in_parallel(extractions, workers):
+                if kind == 'keepalive':
+                    yield send_event('progress', {'type': 'keepalive', 'message': '⏳ Still processing...'})
+                else:
+                    yield chunk
+            imported_invoices.sort(key=lambda invoice: invoice['email_index'])
             
             imported_count = len(imported_invoices)
             failed_extraction = len(extraction_failures)
@@ -1610,12 +2173,21 @@ def gmail_import_stream():
             yield send_event('progress', {'type': 'info', 'message': f'  • Clean invoices found: {invoice_count}'})
             yield send_event('progress', {'type': 'success', 'message': f'  • Successfully extracted: {imported_count} ✓'})
             yield send_event('progress', {'type': 'warning', 'message': f'  • Extraction failed: {failed_extraction}'})
-            yield send_event('complete', {'imported': imported_count, 'skipped': non_invoice_count, 'total': total_found, 'invoices': imported_invoices})
             
+            # Next import of this account starts from here (mail that arrived during this run included),
+            # unless some emails were not fetched, classified or extracted: they have to be listed again
+            if sync_checkpoints and account and sync_history_id:
+                if unfinished_ids:
+                    yield send_event('progress', {'type': 'info', 'message': f'  • Sync checkpoint kept: {len(unfinished_ids)} emails will be retried by the next import'})
+                else:
+                    sync_checkpoints.save(account, sync_history_id)
+            
+            yield send_event('complete', {'imported': imported_count, 'sync_mode': sync_mode, 'skipped': non_invoice_count, 'total': total_found, 'invoices': imported_invoices, 'usage_run_id': current_run.get()})
+        
         except Exception as e:
             yield send_event('error', {'message': f'Import failed: {str(e)}'})
     
-    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response = Response(stream_with_context(stream_in_usage_run('gmail_import', generate())), mimetype='text/event-stream')
     response.headers['Cache-Control'] = 'no-cache'
     response.headers['X-Accel-Buffering'] = 'no'
     response.headers['Connection'] = 'keep-alive'
@@ -1632,6 +2204,11 @@ def gmail_import():
         "days_back": 30
     }
     """
+    with gemini_usage.run('gmail_import'):
+        return _gmail_import()
+
+def _gmail_import():
+    """Gmail import body, run inside a Gemini usage run"""
     try:
         session_token = session.get('gmail_session_token')
         
@@ -1661,9 +2238,31 @@ def gmail_import():
         
         processor = get_processor()
         
+        # Import ledger: skip emails and attachments an earlier import already handled
+        import_ledger = get_gmail_import_ledger()
+        account = None
+        if import_ledger:
+            try:
+                account = gmail_service.get_profile(service).get('emailAddress')
+            except Exception as e:
+                print(f"⚠️ Could not read mailbox profile, import ledger off (non-critical): {e}")
+        ledger_entries = import_ledger.get_messages(account, [msg_ref['id'] for msg_ref in messages]) if account else {}
+        
+        message_headers = gmail_service.get_messages_metadata(service, [
+            msg_ref['id'] for msg_ref in messages
+            if not GmailImportLedger.is_settled(ledger_entries.get(msg_ref['id']))
+        ])
+        
         for msg_ref in messages:
+            if GmailImportLedger.is_settled(ledger_entries.get(msg_ref['id'])):
+                results['skipped'].append({
+                    'id': msg_ref['id'],
+                    'reason': 'Already handled by an earlier import'
+                })
+                continue
+            
             try:
-                message = gmail_service.get_message_details(service, msg_ref['id'])
+                message = message_headers.get(msg_ref['id'])
                 
                 if not message:
                     results['skipped'].append({
@@ -1685,9 +2284,19 @@ def gmail_import():
                     })
                     continue
                 
+                message = gmail_service.get_message_details(service, msg_ref['id'])
+                if not message:
+                    results['skipped'].append({
+                        'id': msg_ref['id'],
+                        'subject': metadata.get('subject'),
+                        'reason': 'Failed to fetch message'
+                    })
+                    continue
+                
                 attachments = gmail_service.extract_attachments(service, message)
                 
                 if not attachments:
+                    # No attachment is not settled here: this path does not follow download links
                     results['skipped'].append({
                         'id': msg_ref['id'],
                         'subject': metadata.get('subject'),
@@ -1695,7 +2304,19 @@ def gmail_import():
                     })
                     continue
                 
+                outcomes = []
                 for filename, file_data in attachments:
+                    content_hash = hashlib.sha256(file_data).hexdigest()
+                    if account and import_ledger.document_handled(account, content_hash):
+                        outcomes.append(DOCUMENT_SKIPPED)
+                        results['skipped'].append({
+                            'id': msg_ref['id'],
+                            'subject': metadata.get('subject'),
+                            'filename': filename,
+                            'reason': 'Attachment already imported'
+                        })
+                        continue
+                    
                     try:
                         secure_name = secure_filename(filename)
                         filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_name)
@@ -1708,7 +2329,7 @@ def gmail_import():
                         os.remove(filepath)
                         
                         # Save to BigQuery if extraction succeeded
-                        if invoice_result.get('status') == 'completed' and 'validated_data' in invoice_result:
+                        if not extraction_failed(invoice_result) and 'validated_data' in invoice_result:
                             validated_data = invoice_result.get('validated_data', {})
                             
                             # Extract invoice data
@@ -1749,6 +2370,11 @@ def gmail_import():
                                 bigquery_service.insert_invoice(invoice_data)
                             except Exception as e:
                                 print(f"⚠️ Warning: Could not save Gmail invoice to BigQuery: {e}")
+                            outcomes.append(DOCUMENT_EXTRACTED)
+                        else:
+                            outcomes.append(DOCUMENT_FAILED if extraction_failed(invoice_result) else DOCUMENT_INCOMPLETE)
+                        if account:
+                            import_ledger.record_document(account, content_hash, msg_ref['id'], filename, outcomes[-1])
                         
                         results['processed'].append({
                             'gmail_id': msg_ref['id'],
@@ -1759,13 +2385,17 @@ def gmail_import():
                             'confidence': confidence,
                             'extraction': invoice_result
                         })
-                        
+                    
                     except Exception as e:
+                        outcomes.append(DOCUMENT_FAILED)
                         results['errors'].append({
                             'gmail_id': msg_ref['id'],
                             'filename': filename,
                             'error': str(e)
                         })
+                
+                if account:
+                    import_ledger.record_extraction(account, msg_ref['id'], GmailImportLedger.extraction_status(outcomes))
             
             except Exception as e:
                 results['errors'].append({
@@ -1773,8 +2403,9 @@ def gmail_import():
                     'error': str(e)
                 })
         
+        results['usage_run_id'] = current_run.get()
         return jsonify(results), 200
-        
+    
     except Exception as e:
         return jsonify({'error': f'Gmail import failed: {str(e)}'}), 500
 
@@ -1833,7 +2464,7 @@ def analyze_vendor_csv():
             'headers': analysis_result['headers'],
             'sampleRows': analysis_result['sampleRows']
         }), 200
-        
+    
     except Exception as e:
         print(f"❌ Error analyzing CSV: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1888,29 +2519,29 @@ def import_vendor_csv():
         print(f"{'='*60}\n")
         
         processor = get_processor()
-        classifier = SemanticEntityClassifier(processor.gemini_service)
+        classifier = get_entity_classifier(processor.gemini_service)
         vertex_service = get_vertex_search_service()
         
         valid_vendors = []
         rejected_vendors = []
         
+        entities = []
         for vendor in transformed_vendors:
-            vendor_name = vendor.get('global_name', '')
             emails = vendor.get('emails', [])
             domains = vendor.get('domains', [])
             
             # Build context for classifier
             email_str = ', '.join(emails) if emails else 'None'
             domain_str = ', '.join(domains) if domains else 'None'
-            entity_context = f"Emails: {email_str}, Domains: {domain_str}"
+            entities.append((vendor.get('global_name', ''), f"Emails: {email_str}, Domains: {domain_str}"))
             
-            # Classify entity
-            classification = classifier.classify_entity(
-                entity_name=vendor_name,
-                entity_context=entity_context
-            )
+        # Cached names and vendors already in the directory are answered without Gemini
+        classifications = classifier.classify_entities(entities)
+            
+        for vendor, classification in zip(transformed_vendors, classifications):
+            vendor_name = vendor.get('global_name', '')
             
-            print(f"🤖 {vendor_name}: {classification['entity_type']} ({classification['confidence']})")
+            print(f"🤖 {vendor_name}: {classification['entity_type']} ({classification['confidence']}, {classification.get('source', 'gemini')})")
             print(f"   Reasoning: {classification['reasoning']}")
             
             # Separate valid vendors from rejected entities
@@ -1925,7 +2556,10 @@ def import_vendor_csv():
                     'confidence': classification['confidence']
                 })
                 
-                # Store rejected entity in Vertex Search for RAG learning
+                # Store rejected entity in Vertex Search for RAG learning (cached verdicts are already stored)
+                if classification.get('cached'):
+                    print(f"   ❌ REJECTED ({classification['entity_type']}) - Known rejected entity")
+                    continue
                 try:
                     vertex_service.store_rejected_entity(
                         entity_name=vendor_name,
@@ -1981,7 +2615,7 @@ def import_vendor_csv():
             'errors': merge_result['errors'],
             'rejections': rejected_vendors
         }), 200
-        
+    
     except Exception as e:
         print(f"❌ Error importing CSV: {e}")
         # Clean up upload data on error if upload_id is available
@@ -2007,7 +2641,7 @@ def search_vendors():
         vendors = bq_service.search_vendor_by_name(query, limit)
         
         return jsonify({'vendors': vendors}), 200
-        
+    
     except Exception as e:
         print(f"❌ Error searching vendors: {e}")
         return jsonify({'error': str(e)}), 500
@@ -2071,7 +2705,7 @@ def list_vendors():
             response['search'] = search_term
         
         return jsonify(response), 200
-        
+    
     except Exception as e:
         print(f"❌ Error listing vendors: {e}")
         return jsonify({'error': str(e)}), 500
@@ -2106,7 +2740,7 @@ def generate_api_key():
             'description': description,
             'created_at': datetime.now().isoformat()
         })
-        
+    
     except Exception as e:
         print(f"❌ Error generating API key: {e}")
         import traceback
@@ -2599,7 +3233,7 @@ def generate_invoice():
             'currency': currency,
             'message': 'Invoice generated successfully!'
         })
-        
+    
     except Exception as e:
         print(f"❌ Invoice generation error: {e}")
         import traceback
@@ -0,0 +1,5 @@
+"""
+End-to-end throughput benchmarks with simulated cloud backends
+
+Run with: python -m benchmarks.run_benchmark --help
+"""
@@ -0,0 +1,678 @@
+import os
+import re
+import json
+import math
+import time
+import base64
+import random
+import threading
+from collections import defaultdict
+from types import SimpleNamespace
+from google.cloud import documentai_v1 as documentai
+from invoice_processor import InvoiceProcessor
+from services import DocumentAIService, VertexSearchService, GeminiService
+from services.bigquery_service import BigQueryService
+from services.gmail_service import GmailService
+from services.knowledge_base_writer import get_write_queue
+from services.semantic_vendor_resolver import FUSED_RESOLUTION_KEY
+from config import config
+
+# Latency profile (milliseconds) per simulated dependency; override any key with --profile
+DEFAULT_PROFILE = {
+    'document_ai': {'p50_ms': 1500, 'p95_ms': 4000, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+    'vertex_search': {'p50_ms': 150, 'p95_ms': 600, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+    'gemini': {'p50_ms': 4000, 'p95_ms': 12000, 'error_rate': 0.0, 'rate_limit_rate': 0.02},
+    'gemini_fallback': {'p50_ms': 5000, 'p95_ms': 15000, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+    'bigquery': {'p50_ms': 300, 'p95_ms': 1200, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+    'gcs': {'p50_ms': 200, 'p95_ms': 800, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+    'gmail': {'p50_ms': 80, 'p95_ms': 300, 'error_rate': 0.0, 'rate_limit_rate': 0.0}
+}
+
+INVOICE_MARKER = re.compile(r'BENCH-INV-(\d+)')
+JUNK_MARKER = 'BENCH-JUNK'
+
+# Small vendor pool so repeat-vendor behaviour (templates, caches) shows up in long runs
+VENDORS = [
+    ('Northwind Office Supplies Ltd', 'GB123456789', 'GBP'),
+    ('Contoso Cloud Services Inc', 'US-94-1234567', 'USD'),
+    ('Fabrikam Logistik GmbH', 'DE811234567', 'EUR'),
+    ('Tailspin Consulting SARL', 'FR40123456789', 'EUR'),
+    ('Adatum Design Studio', 'IL514567890', 'ILS')
+]
+
+# Gemini call sites, recognised by a phrase from each prompt
+PROMPT_KINDS = (
+    ('validate_invoice', 'YOUR INTERNAL KNOWLEDGE BASE'),
+    ('gatekeeper_batch', 'numbered batch of'),
+    ('gatekeeper', 'Chief Financial Mailroom Guard'),
+    ('vendor_resolution', 'semantic vendor identity resolver'),
+    ('entity_classification', 'semantic entity classifier'),
+    ('supreme_judge', 'Supreme Judge'),
+    ('link_classification', 'classify what type of link')
+)
+
+
+class SimulatedBackendError(Exception):
+    """Raised by a simulated backend to mimic a failed or rate-limited API call"""
+    
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class SimulatedBackend:
+    """
+    Latency/error model and call accounting for one simulated dependency
+    
+    Latency is log-normal, fitted so that the configured p50 and p95 hold;
+    a fraction of calls fail with a 500 or a 429 (RESOURCE_EXHAUSTED).
+    """
+    
+    def __init__(self, name, p50_ms, p95_ms, error_rate=0.0, rate_limit_rate=0.0, latency_scale=1.0, seed=None):
+        self.name = name
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        
+        median = p50_ms / 1000.0 * latency_scale
+        self.mu = math.log(median) if median > 0 else None
+        self.sigma = math.log(max(p95_ms, p50_ms) / p50_ms) / 1.645 if p50_ms > 0 else 0.0
+        
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.errors = 0
+        self.rate_limited = 0
+    
+    def call(self, operation):
+        """Sleep for one simulated round-trip, then raise if this call is drawn as a failure"""
+        with self._lock:
+            delay = self._random.lognormvariate(self.mu, self.sigma) if self.mu is not None else 0.0
+            roll = self._random.random()
+            self.calls[operation] += 1
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+            elif roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+        
+        if delay:
+            time.sleep(delay)
+        
+        if roll < self.rate_limit_rate:
+            raise SimulatedBackendError(f"429 RESOURCE_EXHAUSTED: simulated {self.name} quota exceeded", status=429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise SimulatedBackendError(f"500 INTERNAL: simulated {self.name} failure", status=500)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': sum(self.calls.values()),
+                'by_operation': dict(self.calls),
+                'errors': self.errors,
+                'rate_limited': self.rate_limited
+            }
+
+
+class SimulatedCloud:
+    """Set of simulated backends built from a latency profile"""
+    
+    def __init__(self, profile=None, latency_scale=1.0, seed=0):
+        settings = {name: dict(values) for name, values in DEFAULT_PROFILE.items()}
+        for name, overrides in (profile or {}).items():
+            if name not in settings:
+                raise ValueError(f"Unknown backend in profile: {name} (expected one of {', '.join(settings)})")
+            settings[name].update(overrides)
+        
+        self.backends = {
+            name: SimulatedBackend(name, latency_scale=latency_scale, seed=seed + offset, **values)
+            for offset, (name, values) in enumerate(sorted(settings.items()))
+        }
+    
+    def __getitem__(self, name):
+        return self.backends[name]
+    
+    def stats(self):
+        return {name: backend.stats() for name, backend in self.backends.items()}
+    
+    def build_gemini_service(self):
+        return SimulatedGeminiService(self['gemini'], self['gemini_fallback'])
+    
+    def build_processor(self):
+        """InvoiceProcessor wired to the simulated Document AI, Vertex AI Search, Gemini and GCS"""
+        return InvoiceProcessor(
+            doc_ai_service=SimulatedDocumentAIService(self['document_ai']),
+            vertex_search_service=SimulatedVertexSearchService(self['vertex_search']),
+            gemini_service=self.build_gemini_service(),
+            storage_client=FakeStorageClient(self['gcs'])
+        )
+
+
+# ---------------------------------------------------------------------------
+# Synthetic invoices
+# ---------------------------------------------------------------------------
+
+def invoice_number(index):
+    return f"BENCH-INV-{index:06d}"
+
+
+def invoice_index(text):
+    """Recover the synthetic invoice index from document bytes, a URI or a prompt"""
+    match = INVOICE_MARKER.search(text or '')
+    return int(match.group(1)) if match else 0
+
+
+def synthetic_invoice(index):
+    """Deterministic invoice fields for a synthetic document"""
+    vendor, tax_id, currency = VENDORS[index % len(VENDORS)]
+    subtotal = round(100 + (index % 50) * 10.5, 2)
+    tax = round(subtotal * 0.2, 2)
+    return {
+        'number': invoice_number(index),
+        'vendor': vendor,
+        'tax_id': tax_id,
+        'currency': currency,
+        'date': f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}",
+        'subtotal': subtotal,
+        'tax': tax,
+        'total': round(subtotal + tax, 2)
+    }
+
+
+def synthetic_invoice_bytes(index, size_kb=200):
+    """Unique PDF-looking bytes for one invoice (padded to size_kb)"""
+    header = f"%PDF-1.4\n% {invoice_number(index)}\n".encode('utf-8')
+    return header + b'0' * max(size_kb * 1024 - len(header), 0)
+
+
+def _entity(entity_type, value, confidence=0.95):
+    return documentai.Document.Entity(
+        type_=entity_type,
+        mention_text=str(value),
+        confidence=confidence,
+        normalized_value=documentai.Document.Entity.NormalizedValue(text=str(value))
+    )
+
+
+def synthetic_document(index):
+    """Document AI Invoice Parser output for a synthetic invoice"""
+    invoice = synthetic_invoice(index)
+    text = (
+        f"{invoice['vendor']}\nVAT/Tax ID: {invoice['tax_id']}\n"
+        f"INVOICE {invoice['number']}\nDate: {invoice['date']}\n"
+        f"Consulting services 1 x {invoice['subtotal']:.2f}\n"
+        f"Subtotal: {invoice['subtotal']:.2f} {invoice['currency']}\n"
+        f"Tax (20%): {invoice['tax']:.2f} {invoice['currency']}\n"
+        f"Total: {invoice['total']:.2f} {invoice['currency']}\n"
+    )
+    return documentai.Document(
+        text=text,
+        entities=[
+            _entity('supplier_name', invoice['vendor']),
+            _entity('supplier_tax_id', invoice['tax_id']),
+            _entity('invoice_id', invoice['number']),
+            _entity('invoice_date', invoice['date']),
+            _entity('currency', invoice['currency']),
+            _entity('net_amount', f"{invoice['subtotal']:.2f}"),
+            _entity('total_tax_amount', f"{invoice['tax']:.2f}"),
+            _entity('total_amount', f"{invoice['total']:.2f}")
+        ]
+    )
+
+
+# ---------------------------------------------------------------------------
+# Document AI
+# ---------------------------------------------------------------------------
+
+class _FakeDocumentProcessorClient:
+    def __init__(self, backend):
+        self.backend = backend
+    
+    def process_document(self, request, **kwargs):
+        self.backend.call('process_document')
+        if request.raw_document.content:
+            source = request.raw_document.content[:256].decode('latin-1')
+        else:
+            source = request.gcs_document.gcs_uri
+        return SimpleNamespace(document=synthetic_document(invoice_index(source)))
+
+
+class SimulatedDocumentAIService(DocumentAIService):
+    """DocumentAIService with the processor client replaced by a simulated one (online processing only)"""
+    
+    def __init__(self, backend):
+        self.client = _FakeDocumentProcessorClient(backend)
+
+
+# ---------------------------------------------------------------------------
+# Vertex AI Search
+# ---------------------------------------------------------------------------
+
+class _FakeSearchClient:
+    def __init__(self, backend):
+        self.backend = backend
+    
+    def search(self, request, **kwargs):
+        self.backend.call('search')
+        return SimpleNamespace(results=[])
+
+
+class _FakeDocumentClient:
+    def __init__(self, backend):
+        self.backend = backend
+    
+    def create_document(self, request, **kwargs):
+        self.backend.call('create_document')
+        return request.document
+    
+    def import_documents(self, request, **kwargs):
+        self.backend.call('import_documents')
+        return SimpleNamespace(result=lambda timeout=None: SimpleNamespace(error_samples=[]))
+
+
+class SimulatedVertexSearchService(VertexSearchService):
+    """VertexSearchService backed by simulated search/document clients (searches return no matches)"""
+    
+    def __init__(self, backend):
+        self.client = _FakeSearchClient(backend)
+        self.document_client = _FakeDocumentClient(backend)
+        self.parent = (
+            "projects/benchmark/locations/global/collections/default_collection/"
+            "dataStores/benchmark/branches/default_branch"
+        )
+        self.write_queue = get_write_queue(self.document_client, self.parent) if config.KB_WRITE_BEHIND_ENABLED else None
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+# ---------------------------------------------------------------------------
+
+def _prompt_text(contents):
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return '\n'.join(_prompt_text(item) for item in contents)
+    return str(getattr(contents, 'text', '') or '')
+
+
+def prompt_kind(prompt):
+    lowered = prompt.lower()
+    for kind, marker in PROMPT_KINDS:
+        if marker.lower() in lowered:
+            return kind
+    return 'other'
+
+
+def _vendor_in(prompt):
+    for vendor, _, _ in VENDORS:
+        if vendor in prompt:
+            return vendor
+    return 'Unknown'
+
+
+def simulated_gemini_payload(kind, prompt):
+    """Well-formed JSON answer for each Gemini call site"""
+    if kind == 'validate_invoice':
+        invoice = synthetic_invoice(invoice_index(prompt))
+        return {
+            'vendor': {'name': invoice['vendor'], 'address': None, 'country': None, 'taxId': invoice['tax_id']},
+            'invoiceNumber': invoice['number'],
+            'documentDate': invoice['date'],
+            'currency': invoice['currency'],
+            'totals': {'subtotal': invoice['subtotal'], 'tax': invoice['tax'], 'total': invoice['total']},
+            'lineItems': [{
+                'description': 'Consulting services',
+                'quantity': 1,
+                'unitPrice': invoice['subtotal'],
+                'amount': invoice['subtotal']
+            }],
+            'documentType': 'Invoice',
+            'extractionConfidence': 0.95,
+            'auditReasoning': 'Simulated extraction',
+            'warnings': [],
+            **({FUSED_RESOLUTION_KEY: simulated_gemini_payload('vendor_resolution', prompt)} if FUSED_RESOLUTION_KEY in prompt else {})
+        }
+    if kind == 'gatekeeper_batch':
+        return [
+            dict(simulated_gemini_payload('gatekeeper', block), email_id=int(email_id))
+            for email_id, block in re.findall(r'<email id="(\d+)">(.*?)</email>', prompt, re.S)
+        ]
+    if kind == 'gatekeeper':
+        junk = JUNK_MARKER in prompt
+        return {
+            'is_financial_document': not junk,
+            'document_category': 'JUNK' if junk else 'INVOICE',
+            'confidence': 0.95,
+            'reasoning': 'Simulated gatekeeper decision'
+        }
+    if kind == 'vendor_resolution':
+        return {
+            'true_vendor': {'name': _vendor_in(prompt), 'confidence': 0.95, 'type': 'VENDOR'},
+            'reasoning': 'Simulated vendor resolution',
+            'is_intermediary_scenario': False,
+            'supplier_relationship': None,
+            'alternate_names': [],
+            'conflicts_detected': []
+        }
+    if kind == 'entity_classification':
+        return {
+            'entity_type': 'VENDOR',
+            'confidence': 0.95,
+            'reasoning': 'Simulated entity classification',
+            'is_valid_vendor': True
+        }
+    if kind == 'supreme_judge':
+        return {
+            'verdict': 'NEW_VENDOR',
+            'match_details': {
+                'selected_vendor_id': None,
+                'confidence_score': 0.0,
+                'match_reasoning': 'Simulated judge: no candidates',
+                'risk_analysis': 'NONE'
+            },
+            'database_updates': {},
+            'parent_child_logic': {'is_subsidiary': False, 'parent_company_detected': None}
+        }
+    if kind == 'link_classification':
+        return {'linkType': 'direct_pdf', 'confidence': 0.9, 'reasoning': 'Simulated link classification'}
+    return {}
+
+
+class _FakeModels:
+    def __init__(self, backend):
+        self.backend = backend
+    
+    def generate_content(self, model, contents, config=None, **kwargs):
+        prompt = _prompt_text(contents)
+        kind = prompt_kind(prompt)
+        self.backend.call(kind)
+        return SimpleNamespace(text=json.dumps(simulated_gemini_payload(kind, prompt)), usage_metadata=None)
+
+    def generate_content_stream(self, model, contents, config=None, **kwargs):
+        # Latency is paid before the first chunk; the text then arrives in 8 pieces
+        text = self.generate_content(model, contents, config).text
+        step = max(len(text) // 8, 1)
+        for start in range(0, len(text), step):
+            yield SimpleNamespace(text=text[start:start + step], usage_metadata=None)
+
+
+class FakeGenAIClient:
+    """Stand-in for google.genai.Client (only models.generate_content / generate_content_stream are simulated)"""
+    
+    def __init__(self, backend):
+        self.models = _FakeModels(backend)
+
+
+class SimulatedGeminiService(GeminiService):
+    """GeminiService with the AI Studio and fallback clients replaced by simulated ones"""
+    
+    def __init__(self, backend, fallback_backend=None):
+        if not (config.GOOGLE_GEMINI_API_KEY or os.getenv('GEMINI_API_KEY')):
+            os.environ['GEMINI_API_KEY'] = 'benchmark'
+        super().__init__()
+        self.client = FakeGenAIClient(backend)
+        self.fallback_client = FakeGenAIClient(fallback_backend) if fallback_backend else None
+
+
+# ---------------------------------------------------------------------------
+# BigQuery and Cloud Storage
+# ---------------------------------------------------------------------------
+
+class _FakeQueryJob:
+    def result(self, *args, **kwargs):
+        return []
+
+
+class _FakeBigQueryClient:
+    def __init__(self, backend):
+        self.backend = backend
+    
+    def query(self, query, job_config=None, **kwargs):
+        self.backend.call('query')
+        return _FakeQueryJob()
+    
+    def insert_rows_json(self, table, rows, **kwargs):
+        self.backend.call('insert_rows_json')
+        return []
+
+
+class SimulatedBigQueryService(BigQueryService):
+    """BigQueryService with a simulated client (queries return no rows, inserts succeed)"""
+    
+    def __init__(self, backend):
+        self.client = _FakeBigQueryClient(backend)
+        self.dataset_id = "vendors_ai"
+        self.table_id = "global_vendors"
+        self.full_table_id = f"{config.GOOGLE_CLOUD_PROJECT_ID}.{self.dataset_id}.{self.table_id}"
+
+
+class _FakeBlob:
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+    
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self.backend.call('upload')
+    
+    def download_as_bytes(self, **kwargs):
+        self.backend.call('download')
+        return synthetic_invoice_bytes(invoice_index(self.name))
+    
+    def exists(self, **kwargs):
+        self.backend.call('exists')
+        return True
+
+
+class _FakeBucket:
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+    
+    def blob(self, blob_name):
+        return _FakeBlob(self.backend, blob_name)
+
+
+class FakeStorageClient:
+    """Stand-in for google.cloud.storage.Client (objects are synthesised from their names)"""
+    
+    def __init__(self, backend):
+        self.backend = backend
+    
+    def bucket(self, bucket_name):
+        return _FakeBucket(self.backend, bucket_name)
+    
+    def list_blobs(self, bucket_or_name, prefix=None, **kwargs):
+        self.backend.call('list_blobs')
+        return []
+
+
+# ---------------------------------------------------------------------------
+# Gmail
+# ---------------------------------------------------------------------------
+
+class SimulatedMailbox:
+    """
+    Synthetic mailbox: `size` messages, a `junk_ratio` share of them newsletters
+    (no attachment, rejected by the simulated gatekeeper), the rest invoices with one PDF
+    """
+    
+    def __init__(self, size, junk_ratio=0.3, offset=0, seed=0, document_kb=200):
+        self.size = size
+        self.offset = offset
+        self.document_kb = document_kb
+        rng = random.Random(seed + offset)
+        self.junk = [rng.random() < junk_ratio for _ in range(size)]
+        self.message_ids = [f"bench{offset + i:010x}" for i in range(size)]
+    
+    def _index(self, message_id):
+        return int(message_id[len('bench'):], 16)
+    
+    def message(self, message_id):
+        index = self._index(message_id)
+        is_junk = self.junk[index - self.offset]
+        number = invoice_number(index)
+        
+        if is_junk:
+            subject = f"{JUNK_MARKER} Weekly newsletter #{index}"
+            body = "Join our webinar and read this week's product news."
+        else:
+            subject = f"Invoice {number} from {synthetic_invoice(index)['vendor']}"
+            body = f"Please find attached invoice {number}. Payment is due in 30 days."
+        
+        parts = [{'mimeType': 'text/plain', 'filename': '', 'body': {'data': base64.urlsafe_b64encode(body.encode('utf-8')).decode('ascii')}}]
+        if not is_junk:
+            parts.append({'mimeType': 'application/pdf', 'filename': f"{number}.pdf", 'body': {'attachmentId': f"att-{message_id}"}})
+        
+        return {
+            'id': message_id,
+            'threadId': message_id,
+            'snippet': body[:100],
+            'payload': {
+                'headers': [
+                    {'name': 'Subject', 'value': subject},
+                    {'name': 'From', 'value': 'billing@vendor.example'},
+                    {'name': 'Date', 'value': 'Mon, 1 Jan 2024 09:00:00 +0000'}
+                ],
+                'parts': parts
+            }
+        }
+    
+    def attachment(self, message_id):
+        data = synthetic_invoice_bytes(self._index(message_id), self.document_kb)
+        return {'size': len(data), 'data': base64.urlsafe_b64encode(data).decode('ascii')}
+
+
+class _FakeGmailRequest:
+    def __init__(self, backend, operation, produce):
+        self.backend = backend
+        self.operation = operation
+        self.produce = produce
+    
+    def execute(self, **kwargs):
+        self.backend.call(self.operation)
+        return self.produce()
+
+
+class _FakeGmailAttachments:
+    def __init__(self, backend, mailbox):
+        self.backend = backend
+        self.mailbox = mailbox
+    
+    def get(self, userId, messageId, id, **kwargs):
+        return _FakeGmailRequest(self.backend, 'attachments.get', lambda: self.mailbox.attachment(messageId))
+
+
+class _FakeGmailMessages:
+    def __init__(self, backend, mailbox):
+        self.backend = backend
+        self.mailbox = mailbox
+    
+    def list(self, userId, q=None, maxResults=100, pageToken=None, **kwargs):
+        def produce():
+            start = int(pageToken or 0)
+            end = start + maxResults
+            response = {
+                'messages': [{'id': message_id, 'threadId': message_id} for message_id in self.mailbox.message_ids[start:end]],
+                'resultSizeEstimate': self.mailbox.size
+            }
+            if end < self.mailbox.size:
+                response['nextPageToken'] = str(end)
+            return response
+        return _FakeGmailRequest(self.backend, 'messages.list', produce)
+    
+    def get(self, userId, id, format='full', fields=None, **kwargs):
+        def produce():
+            message = self.mailbox.message(id)
+            if fields:
+                # Partial response: the Gatekeeper mask drops every body
+                for part in message['payload']['parts']:
+                    part.pop('body', None)
+            return message
+        return _FakeGmailRequest(self.backend, 'messages.get', produce)
+    
+    def attachments(self):
+        return _FakeGmailAttachments(self.backend, self.mailbox)
+
+
+class _FakeGmailBatch:
+    """Stand-in for BatchHttpRequest: one simulated round-trip, then a callback per request"""
+    
+    def __init__(self, backend, callback):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+    
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+    
+    def execute(self):
+        self.backend.call('batch')
+        for request_id, request in self.requests:
+            self.callback(request_id, request.produce(), None)
+
+
+class FakeGmailApi:
+    """Stand-in for the googleapiclient Gmail v1 resource (profile, messages and batch requests)"""
+    
+    def __init__(self, backend, mailbox):
+        self.backend = backend
+        self.mailbox = mailbox
+        self._messages = _FakeGmailMessages(backend, mailbox)
+    
+    def users(self):
+        return self
+    
+    def getProfile(self, userId):
+        return _FakeGmailRequest(self.backend, 'getProfile', lambda: {
+            'emailAddress': f"mailbox-{self.mailbox.offset}@bench.example",
+            'messagesTotal': self.mailbox.size,
+            'historyId': '1'
+        })
+    
+    def messages(self):
+        return self._messages
+    
+    def new_batch_http_request(self, callback=None):
+        return _FakeGmailBatch(self.backend, callback)
+
+
+class SimulatedGmailService(GmailService):
+    """
+    GmailService whose build_service returns a simulated mailbox
+    
+    Session tokens of the form 'bench-<n>' map to mailbox n, so concurrent
+    imports work on disjoint invoices.
+    """
+    
+    def __init__(self, backend, mailbox_size=20, junk_ratio=0.3, seed=0, document_kb=200):
+        self.client_id = 'benchmark'
+        self.client_secret = 'benchmark'
+        self.backend = backend
+        self.mailbox_size = mailbox_size
+        self.junk_ratio = junk_ratio
+        self.seed = seed
+        self.document_kb = document_kb
+    
+    def build_service(self, credentials_dict):
+        mailbox_number = int(credentials_dict['token'].rsplit('-', 1)[-1])
+        mailbox = SimulatedMailbox(
+            self.mailbox_size,
+            junk_ratio=self.junk_ratio,
+            offset=mailbox_number * self.mailbox_size,
+            seed=self.seed,
+            document_kb=self.document_kb
+        )
+        return FakeGmailApi(self.backend, mailbox)
+
+
+class FakeTokenStorage:
+    """Stand-in for SecureTokenStorage: every session token is a connected benchmark account"""
+    
+    def get_credentials(self, session_token):
+        if not session_token:
+            return None
+        return {'token': session_token, 'email': f"{session_token}@benchmark.local"}
+    
+    def store_credentials(self, credentials):
+        return credentials.get('token')
+    
+    def delete_credentials(self, session_token):
+        return True
@@ -0,0 +1,272 @@
+"""
+End-to-end throughput benchmark for the invoice pipeline against simulated cloud backends
+
+Document AI, Vertex AI Search, Gemini (primary + fallback), BigQuery, Cloud Storage and
+Gmail are replaced by in-process stand-ins with configurable latency distributions and
+error/429 rates (see benchmarks/fake_backends.py); everything else is the real code path.
+
+Usage:
+    python -m benchmarks.run_benchmark --target process_invoice --requests 50 --concurrency 8
+    python -m benchmarks.run_benchmark --target upload --requests 20 --latency-scale 0.1
+    python -m benchmarks.run_benchmark --target gmail_stream --requests 2 --mailbox-size 30
+    python -m benchmarks.run_benchmark --profile my_profile.json --json
+
+A profile is a JSON object keyed by backend name (document_ai, vertex_search, gemini,
+gemini_fallback, bigquery, gcs, gmail) with any of p50_ms, p95_ms, error_rate and
+rate_limit_rate; missing values come from DEFAULT_PROFILE.
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import tempfile
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+TARGETS = ('process_invoice', 'upload', 'gmail_stream')
+
+# Local state files redirected to a scratch directory so a benchmark never touches real caches/metrics
+STATE_PATH_SETTINGS = {
+    'EXTRACTION_CACHE_PATH': 'extraction_cache.sqlite3',
+    'GEMINI_CACHE_PATH': 'gemini_cache.sqlite3',
+    'EMAIL_PREFILTER_DB_PATH': 'email_prefilter.sqlite3',
+    'ENTITY_CACHE_DB_PATH': 'entity_verdicts.sqlite3',
+    'GMAIL_SYNC_DB_PATH': 'gmail_sync.sqlite3',
+    'GMAIL_IMPORT_LEDGER_DB_PATH': 'gmail_import_ledger.sqlite3',
+    'GEMINI_USAGE_DB_PATH': 'gemini_usage.sqlite3',
+    'JOB_QUEUE_DB_PATH': 'jobs.sqlite3',
+    'KB_WRITE_QUEUE_PATH': 'kb_write_queue.sqlite3',
+    'VENDOR_TEMPLATE_DB_PATH': 'vendor_templates.sqlite3',
+    'METRICS_DB_PATH': 'metrics.sqlite3'
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Invoice pipeline throughput benchmark (simulated backends)')
+    parser.add_argument('--target', choices=TARGETS, default='process_invoice',
+                        help='Entry point to drive (default: process_invoice)')
+    parser.add_argument('--requests', type=int, default=20,
+                        help='Invoices (process_invoice, upload) or import streams (gmail_stream) to run')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent requests in flight')
+    parser.add_argument('--profile', help='JSON file with per-backend latency/error overrides')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='Multiply every simulated latency (e.g., 0.1 for a quick smoke run)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for latency/error draws')
+    parser.add_argument('--document-kb', type=int, default=200, help='Size of each synthetic PDF')
+    parser.add_argument('--mailbox-size', type=int, default=20, help='Messages per simulated Gmail mailbox')
+    parser.add_argument('--junk-ratio', type=float, default=0.3, help='Share of non-invoice emails in each mailbox')
+    parser.add_argument('--days', type=int, default=7, help='days= parameter for the Gmail import stream')
+    parser.add_argument('--enable-caches', action='store_true',
+                        help='Keep the extraction cache, Gemini response cache and vendor templates on (off by default)')
+    parser.add_argument('--write-behind', action='store_true',
+                        help='Keep the knowledge-base write-behind queue on (off by default)')
+    parser.add_argument('--client-rate-limits', action='store_true',
+                        help='Keep client-side Gemini rate limiting on (off by default; quotas are not latency-scaled)')
+    parser.add_argument('--fused-vendor-resolution', action='store_true',
+                        help='Resolve the vendor inside the validate_invoice call instead of a second Gemini call')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--verbose', action='store_true', help='Show pipeline logs instead of silencing them')
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """Point config at a scratch state directory; must run before config is imported"""
+    state_dir = tempfile.mkdtemp(prefix='invoice-benchmark-')
+    os.environ['LOCAL_STATE_DIR'] = state_dir
+    for name, filename in STATE_PATH_SETTINGS.items():
+        os.environ[name] = os.path.join(state_dir, filename)
+    
+    toggle = 'true' if args.enable_caches else 'false'
+    os.environ['EXTRACTION_CACHE_ENABLED'] = toggle
+    os.environ['GEMINI_CACHE_ENABLED'] = toggle
+    os.environ['EMAIL_PREFILTER_ENABLED'] = toggle
+    os.environ['VENDOR_TEMPLATES_ENABLED'] = toggle
+    # Every simulated import should scan and extract its whole mailbox
+    os.environ['GMAIL_INCREMENTAL_SYNC_ENABLED'] = 'false'
+    os.environ['GMAIL_IMPORT_LEDGER_ENABLED'] = 'false'
+    os.environ['KB_WRITE_BEHIND_ENABLED'] = 'true' if args.write_behind else 'false'
+    os.environ['GEMINI_RATE_LIMITING_ENABLED'] = 'true' if args.client_rate_limits else 'false'
+    os.environ['FUSED_VENDOR_RESOLUTION_ENABLED'] = 'true' if args.fused_vendor_resolution else 'false'
+    return state_dir
+
+
+def load_profile(path):
+    if not path:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def install_app_fakes(app_module, cloud, args, state_dir):
+    """Swap the Flask app's lazily-built singletons for simulated services"""
+    from benchmarks.fake_backends import SimulatedBigQueryService, SimulatedGmailService, FakeTokenStorage
+    
+    processor = cloud.build_processor()
+    app_module._processor = processor
+    app_module._vertex_search_service = processor.vertex_search_service
+    app_module._bigquery_service = SimulatedBigQueryService(cloud['bigquery'])
+    app_module._gmail_service = SimulatedGmailService(
+        cloud['gmail'],
+        mailbox_size=args.mailbox_size,
+        junk_ratio=args.junk_ratio,
+        seed=args.seed,
+        document_kb=args.document_kb
+    )
+    app_module._token_storage = FakeTokenStorage()
+    
+    upload_folder = os.path.join(state_dir, 'uploads')
+    os.makedirs(upload_folder, exist_ok=True)
+    app_module.app.config['UPLOAD_FOLDER'] = upload_folder
+
+
+def build_target(args, cloud, state_dir):
+    """
+    Return a callable(index) -> (succeeded, invoices) for the selected entry point
+    """
+    from config import config
+    from benchmarks.fake_backends import invoice_number, synthetic_invoice_bytes
+    
+    if args.target == 'process_invoice':
+        processor = cloud.build_processor()
+        
+        def run(index):
+            result = processor.process_invoice(f"gs://{config.GCS_INPUT_BUCKET}/benchmark/{invoice_number(index)}.pdf")
+            return result.get('status') == 'completed', 1
+        return run
+    
+    import app as app_module
+    install_app_fakes(app_module, cloud, args, state_dir)
+    flask_app = app_module.app
+    
+    if args.target == 'upload':
+        def run(index):
+            client = flask_app.test_client()
+            response = client.post(
+                '/upload?wait=true',
+                data={'file': (io.BytesIO(synthetic_invoice_bytes(index, args.document_kb)), f"{invoice_number(index)}.pdf")},
+                content_type='multipart/form-data'
+            )
+            body = response.get_json(silent=True) or {}
+            return response.status_code == 200 and body.get('status') == 'completed', 1
+        return run
+    
+    def run(index):
+        client = flask_app.test_client()
+        # Session cookies are Secure, so talk to the test client over https
+        with client.session_transaction(base_url='https://localhost') as flask_session:
+            flask_session['gmail_session_token'] = f"bench-{index}"
+        response = client.get(
+            f"/api/ap-automation/gmail/import/stream?days={args.days}",
+            base_url='https://localhost'
+        )
+        complete = None
+        for block in response.get_data(as_text=True).split('\n\n'):
+            if block.startswith('event: complete'):
+                complete = json.loads(block.split('data: ', 1)[1])
+        if not complete:
+            return False, 0
+        return True, complete.get('imported', 0)
+    return run
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def run_benchmark(args):
+    state_dir = configure_environment(args)
+    
+    from benchmarks.fake_backends import SimulatedCloud
+    
+    cloud = SimulatedCloud(load_profile(args.profile), latency_scale=args.latency_scale, seed=args.seed)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    
+    latencies = []
+    succeeded = 0
+    invoices = 0
+    
+    with quiet:
+        target = build_target(args, cloud, state_dir)
+        
+        def timed(index):
+            start = time.perf_counter()
+            try:
+                ok, count = target(index)
+            except Exception as e:
+                print(f"❌ Benchmark request {index} raised: {e}", file=sys.stderr)
+                ok, count = False, 0
+            return ok, count, time.perf_counter() - start
+        
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix='benchmark') as pool:
+            futures = [pool.submit(timed, index) for index in range(args.requests)]
+            for future in as_completed(futures):
+                ok, count, seconds = future.result()
+                latencies.append(seconds)
+                succeeded += 1 if ok else 0
+                invoices += count
+        elapsed = time.perf_counter() - start
+    
+    backend_stats = cloud.stats()
+    return {
+        'target': args.target,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'latency_scale': args.latency_scale,
+        'caches_enabled': args.enable_caches,
+        'succeeded': succeeded,
+        'failed': args.requests - succeeded,
+        'invoices': invoices,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(args.requests / elapsed, 3) if elapsed else None,
+        'invoices_per_hour': round(invoices / elapsed * 3600, 1) if elapsed else None,
+        'latency_seconds': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3),
+            'mean': round(sum(latencies) / len(latencies), 3)
+        } if latencies else {},
+        'calls_per_invoice': {
+            name: round(stats['calls'] / invoices, 2) if invoices else None
+            for name, stats in backend_stats.items()
+        },
+        'backends': backend_stats,
+        'state_dir': state_dir
+    }
+
+
+def print_report(report):
+    latency = report['latency_seconds']
+    print(f"\n📊 Benchmark: {report['target']} ({report['requests']} requests, concurrency {report['concurrency']}, latency scale {report['latency_scale']})")
+    print(f"   Succeeded: {report['succeeded']}  Failed: {report['failed']}  Invoices: {report['invoices']}")
+    print(f"   Elapsed: {report['elapsed_seconds']}s  Throughput: {report['requests_per_second']} req/s, {report['invoices_per_hour']} invoices/hour")
+    if latency:
+        print(f"   Latency: p50 {latency['p50']}s  p95 {latency['p95']}s  p99 {latency['p99']}s  max {latency['max']}s")
+    print("\n   Backend            calls  per invoice  errors  429s")
+    for name, stats in sorted(report['backends'].items()):
+        per_invoice = report['calls_per_invoice'][name]
+        print(f"   {name:<18} {stats['calls']:>5}  {per_invoice if per_invoice is not None else '-':>11}  {stats['errors']:>6}  {stats['rate_limited']:>4}")
+        for operation, count in sorted(stats['by_operation'].items()):
+            print(f"     · {operation:<24} {count:>5}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,10 +15,165 @@ class Config:
     VERTEX_SEARCH_DATA_STORE_ID = os.getenv('VERTEX_SEARCH_DATA_STORE_ID') or os.getenv('VERTEX_AI_SEARCH_DATA_STORE_ID', 'invoices-ds')
     VERTEX_SEARCH_COLLECTION = os.getenv('VERTEX_SEARCH_COLLECTION') or os.getenv('VERTEX_AI_SEARCH_COLLECTION_ID', 'default_collection')
     
+    # Layer 1.5 + Layer 2 concurrent fan-out (currency detection + Vertex lookups)
+    CONTEXT_LOOKUP_WORKERS = int(os.getenv('CONTEXT_LOOKUP_WORKERS', '8'))
+    CONTEXT_LOOKUP_TIMEOUT_SECONDS = float(os.getenv('CONTEXT_LOOKUP_TIMEOUT_SECONDS', '10'))
+    
     GOOGLE_GEMINI_API_KEY = os.getenv('GOOGLE_GEMINI_API_KEY')
+    # Additional AI Studio keys (comma-separated), each with its own quota, tried before the Replit fallback
+    GEMINI_EXTRA_API_KEYS = [k.strip() for k in os.getenv('GEMINI_EXTRA_API_KEYS', '').split(',') if k.strip()]
+    
+    # Client-side Gemini rate limiting: token buckets per API key and model, sized to the
+    # project quotas below ("model=rpm/tpm,...") and split across gunicorn workers
+    GEMINI_RATE_LIMITING_ENABLED = os.getenv('GEMINI_RATE_LIMITING_ENABLED', 'true').lower() == 'true'
+    GEMINI_RATE_LIMITS = os.getenv('GEMINI_RATE_LIMITS', 'gemini-2.0-flash-exp=10/4000000,gemini-2.5-flash=1000/1000000,gemini-2.5-pro=150/2000000')
+    GEMINI_DEFAULT_RPM = float(os.getenv('GEMINI_DEFAULT_RPM', '60'))
+    GEMINI_DEFAULT_TPM = float(os.getenv('GEMINI_DEFAULT_TPM', '1000000'))
+    GEMINI_RATE_LIMIT_PROCESSES = int(os.getenv('GEMINI_RATE_LIMIT_PROCESSES', '2'))
+    GEMINI_MAX_QUEUE_SECONDS = float(os.getenv('GEMINI_MAX_QUEUE_SECONDS', '30'))
+    GEMINI_RATE_LIMIT_COOLDOWN_SECONDS = float(os.getenv('GEMINI_RATE_LIMIT_COOLDOWN_SECONDS', '20'))
+    GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '3'))
+    GEMINI_BACKOFF_BASE_SECONDS = float(os.getenv('GEMINI_BACKOFF_BASE_SECONDS', '1'))
+    GEMINI_BACKOFF_MAX_SECONDS = float(os.getenv('GEMINI_BACKOFF_MAX_SECONDS', '30'))
+    
+    # Static validate_invoice prompt registered as a Gemini cached context (per API key and model)
+    GEMINI_CONTEXT_CACHE_ENABLED = os.getenv('GEMINI_CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv('GEMINI_CONTEXT_CACHE_TTL_SECONDS', '3600'))
+    GEMINI_CONTEXT_CACHE_RETRY_SECONDS = int(os.getenv('GEMINI_CONTEXT_CACHE_RETRY_SECONDS', '3600'))
+    
+    # Stream validate_invoice when a caller listens for partial fields (Gmail SSE, job progress)
+    GEMINI_STREAMING_ENABLED = os.getenv('GEMINI_STREAMING_ENABLED', 'true').lower() == 'true'
+    
+    # asyncio Gemini path (services/async_gemini_service.py): max calls in flight per batch.
+    # When enabled, multi-chunk gatekeeper batches send their chunks concurrently.
+    GEMINI_ASYNC_ENABLED = os.getenv('GEMINI_ASYNC_ENABLED', 'false').lower() == 'true'
+    GEMINI_ASYNC_CONCURRENCY = int(os.getenv('GEMINI_ASYNC_CONCURRENCY', '16'))
+    
+    # Fused Layer 3 + Layer 3.5: validate_invoice also returns the true-vendor resolution,
+    # saving the separate vendor_resolution Gemini call (false keeps the two-call path)
+    FUSED_VENDOR_RESOLUTION_ENABLED = os.getenv('FUSED_VENDOR_RESOLUTION_ENABLED', 'false').lower() == 'true'
+    
+    # Local persistent state (caches, queues, ledgers)
+    LOCAL_STATE_DIR = os.getenv('LOCAL_STATE_DIR', 'local_state')
+    
+    # Content-addressed extraction cache (SHA-256 of document bytes → validated result)
+    EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'true').lower() == 'true'
+    EXTRACTION_CACHE_PATH = os.getenv('EXTRACTION_CACHE_PATH', os.path.join(LOCAL_STATE_DIR, 'extraction_cache.sqlite3'))
+    EXTRACTION_CACHE_MAX_AGE_DAYS = int(os.getenv('EXTRACTION_CACHE_MAX_AGE_DAYS', '30'))
+    EXTRACTION_CACHE_MAX_MB = int(os.getenv('EXTRACTION_CACHE_MAX_MB', '512'))
+    # Bump when the validate_invoice prompt or output schema changes to invalidate cached results
+    EXTRACTION_SCHEMA_VERSION = os.getenv('EXTRACTION_SCHEMA_VERSION', '1')
+    
+    # Persistent Gemini response cache (model + prompt + generation config → response text).
+    # Only calls at or below GEMINI_CACHE_MAX_TEMPERATURE are cached; call sites listed in
+    # GEMINI_CACHE_SKIP_CALL_SITES always go to the API.
+    GEMINI_CACHE_ENABLED = os.getenv('GEMINI_CACHE_ENABLED', 'true').lower() == 'true'
+    GEMINI_CACHE_PATH = os.getenv('GEMINI_CACHE_PATH', os.path.join(LOCAL_STATE_DIR, 'gemini_cache.sqlite3'))
+    GEMINI_CACHE_TTL_HOURS = float(os.getenv('GEMINI_CACHE_TTL_HOURS', '168'))
+    GEMINI_CACHE_MAX_ENTRIES = int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', '50000'))
+    GEMINI_CACHE_MAX_TEMPERATURE = float(os.getenv('GEMINI_CACHE_MAX_TEMPERATURE', '0.2'))
+    GEMINI_CACHE_SKIP_CALL_SITES = [s.strip() for s in os.getenv('GEMINI_CACHE_SKIP_CALL_SITES', 'validate_invoice').split(',') if s.strip()]
+    
+    # Gmail Stage 2: emails classified per Gemini gatekeeper request (max 50)
+    GATEKEEPER_BATCH_SIZE = int(os.getenv('GATEKEEPER_BATCH_SIZE', '25'))
+    GATEKEEPER_BATCH_SNIPPET_CHARS = int(os.getenv('GATEKEEPER_BATCH_SNIPPET_CHARS', '500'))
+    
+    # Local pre-filter in front of the Gatekeeper (learned from its verdicts). Asymmetric
+    # thresholds: KEEP above EMAIL_PREFILTER_KEEP_THRESHOLD, KILL only below the much stricter
+    # EMAIL_PREFILTER_KILL_THRESHOLD from a sender domain that has never been kept.
+    EMAIL_PREFILTER_ENABLED = os.getenv('EMAIL_PREFILTER_ENABLED', 'true').lower() == 'true'
+    EMAIL_PREFILTER_DB_PATH = os.getenv('EMAIL_PREFILTER_DB_PATH', os.path.join(LOCAL_STATE_DIR, 'email_prefilter.sqlite3'))
+    EMAIL_PREFILTER_MIN_TRAINING = int(os.getenv('EMAIL_PREFILTER_MIN_TRAINING', '200'))
+    EMAIL_PREFILTER_KEEP_THRESHOLD = float(os.getenv('EMAIL_PREFILTER_KEEP_THRESHOLD', '0.95'))
+    EMAIL_PREFILTER_KILL_THRESHOLD = float(os.getenv('EMAIL_PREFILTER_KILL_THRESHOLD', '0.005'))
+    EMAIL_PREFILTER_KILL_MIN_DOMAIN_SAMPLES = int(os.getenv('EMAIL_PREFILTER_KILL_MIN_DOMAIN_SAMPLES', '5'))
+    EMAIL_PREFILTER_AUDIT_RATE = float(os.getenv('EMAIL_PREFILTER_AUDIT_RATE', '0.05'))
+    
+    # Persistent entity classification verdicts (SemanticEntityClassifier). Names already in the
+    # vendor directory skip Gemini; rejected entities from the knowledge base are preloaded.
+    ENTITY_CACHE_ENABLED = os.getenv('ENTITY_CACHE_ENABLED', 'true').lower() == 'true'
+    ENTITY_CACHE_DB_PATH = os.getenv('ENTITY_CACHE_DB_PATH', os.path.join(LOCAL_STATE_DIR, 'entity_verdicts.sqlite3'))
+    ENTITY_CACHE_TTL_DAYS = int(os.getenv('ENTITY_CACHE_TTL_DAYS', '90'))
+    ENTITY_CACHE_PRELOAD_REJECTED = os.getenv('ENTITY_CACHE_PRELOAD_REJECTED', 'true').lower() == 'true'
+    ENTITY_CACHE_PRELOAD_INTERVAL_HOURS = float(os.getenv('ENTITY_CACHE_PRELOAD_INTERVAL_HOURS', '24'))
+    ENTITY_DIRECTORY_SHORT_CIRCUIT = os.getenv('ENTITY_DIRECTORY_SHORT_CIRCUIT', 'true').lower() == 'true'
+    
+    # Background job queue for /upload and /process
+    JOB_QUEUE_DB_PATH = os.getenv('JOB_QUEUE_DB_PATH', os.path.join(LOCAL_STATE_DIR, 'jobs.sqlite3'))
+    JOB_QUEUE_WORKERS = int(os.getenv('JOB_QUEUE_WORKERS', '4'))
+    JOB_QUEUE_MAX_PENDING = int(os.getenv('JOB_QUEUE_MAX_PENDING', '100'))
+    JOB_QUEUE_TTL_SECONDS = int(os.getenv('JOB_QUEUE_TTL_SECONDS', '86400'))
+    
+    # Bulk /process/batch (Document AI batch LRO → bounded Layers 2-3 fan-out)
+    DOCAI_BATCH_OUTPUT_URI = os.getenv('DOCAI_BATCH_OUTPUT_URI', f"gs://{GCS_INPUT_BUCKET}/docai-batch-output/")
+    DOCAI_BATCH_SIZE = int(os.getenv('DOCAI_BATCH_SIZE', '100'))
+    DOCAI_BATCH_TIMEOUT_SECONDS = int(os.getenv('DOCAI_BATCH_TIMEOUT_SECONDS', '1800'))
+    BATCH_PIPELINE_WORKERS = int(os.getenv('BATCH_PIPELINE_WORKERS', '4'))
+    
+    # Gmail import Stage 3: kept emails extracted in parallel
+    GMAIL_EXTRACTION_WORKERS = int(os.getenv('GMAIL_EXTRACTION_WORKERS', '4'))
+    # Per-worker-process caps on in-flight calls per dependency ("dependency=n,..."), shared by
+    # every parallel pipeline so Document AI and Gemini stay inside their quotas
+    DEPENDENCY_CONCURRENCY_LIMITS = os.getenv('DEPENDENCY_CONCURRENCY_LIMITS', 'document_ai=4,gemini=8')
+    
+    # Local files up to this size go to Document AI inline while the GCS archive upload runs in parallel
+    DOCAI_INLINE_MAX_MB = int(os.getenv('DOCAI_INLINE_MAX_MB', '20'))
+    GCS_UPLOAD_WORKERS = int(os.getenv('GCS_UPLOAD_WORKERS', '4'))
+    GCS_UPLOAD_TIMEOUT_SECONDS = float(os.getenv('GCS_UPLOAD_TIMEOUT_SECONDS', '120'))
+    
+    # Write-behind queue for knowledge-base feedback writes (Discovery Engine bulk import)
+    KB_WRITE_BEHIND_ENABLED = os.getenv('KB_WRITE_BEHIND_ENABLED', 'true').lower() == 'true'
+    KB_WRITE_QUEUE_PATH = os.getenv('KB_WRITE_QUEUE_PATH', os.path.join(LOCAL_STATE_DIR, 'kb_write_queue.sqlite3'))
+    KB_WRITE_BATCH_SIZE = int(os.getenv('KB_WRITE_BATCH_SIZE', '50'))
+    KB_WRITE_FLUSH_SECONDS = float(os.getenv('KB_WRITE_FLUSH_SECONDS', '30'))
+    KB_WRITE_MAX_ATTEMPTS = int(os.getenv('KB_WRITE_MAX_ATTEMPTS', '8'))
+    KB_WRITE_IMPORT_TIMEOUT_SECONDS = float(os.getenv('KB_WRITE_IMPORT_TIMEOUT_SECONDS', '300'))
+    
+    # Learned per-vendor templates: recurring layouts skip Gemini when local checks pass
+    VENDOR_TEMPLATES_ENABLED = os.getenv('VENDOR_TEMPLATES_ENABLED', 'true').lower() == 'true'
+    VENDOR_TEMPLATE_DB_PATH = os.getenv('VENDOR_TEMPLATE_DB_PATH', os.path.join(LOCAL_STATE_DIR, 'vendor_templates.sqlite3'))
+    VENDOR_TEMPLATE_MIN_SAMPLES = int(os.getenv('VENDOR_TEMPLATE_MIN_SAMPLES', '3'))
+    VENDOR_TEMPLATE_MIN_CONFIDENCE = float(os.getenv('VENDOR_TEMPLATE_MIN_CONFIDENCE', '0.9'))
+    VENDOR_TEMPLATE_MIN_ENTITY_CONFIDENCE = float(os.getenv('VENDOR_TEMPLATE_MIN_ENTITY_CONFIDENCE', '0.8'))
+    
+    # End-to-end latency budget for interactive runs (/upload, /process, Gmail import; 0 disables).
+    # Optional layers are skipped once less than their budget remains; Gemini validation keeps
+    # its reserve. Skipped Layer 3.5 / feedback-loop work is finished in the background.
+    PIPELINE_DEADLINE_SECONDS = float(os.getenv('PIPELINE_DEADLINE_SECONDS', '90'))
+    PIPELINE_BUDGET_RAG_SECONDS = float(os.getenv('PIPELINE_BUDGET_RAG_SECONDS', '10'))
+    PIPELINE_BUDGET_GEMINI_SECONDS = float(os.getenv('PIPELINE_BUDGET_GEMINI_SECONDS', '45'))
+    PIPELINE_BUDGET_VENDOR_RESOLUTION_SECONDS = float(os.getenv('PIPELINE_BUDGET_VENDOR_RESOLUTION_SECONDS', '15'))
+    PIPELINE_BUDGET_FEEDBACK_SECONDS = float(os.getenv('PIPELINE_BUDGET_FEEDBACK_SECONDS', '5'))
+    DEFERRED_ENRICHMENT_ENABLED = os.getenv('DEFERRED_ENRICHMENT_ENABLED', 'true').lower() == 'true'
+    DEFERRED_ENRICHMENT_WORKERS = int(os.getenv('DEFERRED_ENRICHMENT_WORKERS', '2'))
+    
+    # Per-call-site / per-import-run Gemini token and cost accounting (GET /api/gemini/usage).
+    # GEMINI_PRICING is USD per 1M input/output tokens.
+    GEMINI_USAGE_DB_PATH = os.getenv('GEMINI_USAGE_DB_PATH', os.path.join(LOCAL_STATE_DIR, 'gemini_usage.sqlite3'))
+    GEMINI_USAGE_RETENTION_DAYS = int(os.getenv('GEMINI_USAGE_RETENTION_DAYS', '30'))
+    GEMINI_PRICING = os.getenv('GEMINI_PRICING', 'gemini-2.0-flash-exp=0.10/0.40,gemini-2.5-flash=0.30/2.50,gemini-2.5-pro=1.25/10.00')
+    GEMINI_CACHED_INPUT_PRICE_RATIO = float(os.getenv('GEMINI_CACHED_INPUT_PRICE_RATIO', '0.25'))
+    
+    # /metrics (per-worker snapshots merged through SQLite)
+    METRICS_DB_PATH = os.getenv('METRICS_DB_PATH', os.path.join(LOCAL_STATE_DIR, 'metrics.sqlite3'))
+    METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
     
     GMAIL_CLIENT_ID = os.getenv('GMAIL_CLIENT_ID')
     GMAIL_CLIENT_SECRET = os.getenv('GMAIL_CLIENT_SECRET')
+    # Gmail Stage 2: messages.get requests per batch HTTP call (max 100; Gmail advises <= 50)
+    GMAIL_BATCH_SIZE = int(os.getenv('GMAIL_BATCH_SIZE', '50'))
+    
+    # Incremental Gmail sync: per-account historyId checkpoint; imports list only mail added since
+    # the last completed run (users.history.list), falling back to the `days` scan when it expires
+    GMAIL_INCREMENTAL_SYNC_ENABLED = os.getenv('GMAIL_INCREMENTAL_SYNC_ENABLED', 'true').lower() == 'true'
+    GMAIL_SYNC_DB_PATH = os.getenv('GMAIL_SYNC_DB_PATH', os.path.join(LOCAL_STATE_DIR, 'gmail_sync.sqlite3'))
+    GMAIL_SYNC_CHECKPOINT_MAX_AGE_DAYS = int(os.getenv('GMAIL_SYNC_CHECKPOINT_MAX_AGE_DAYS', '7'))
+    
+    # Gmail import ledger: per-account Gatekeeper verdicts, extraction outcomes and attachment hashes,
+    # so re-importing the same mail skips what an earlier import already rejected or extracted
+    GMAIL_IMPORT_LEDGER_ENABLED = os.getenv('GMAIL_IMPORT_LEDGER_ENABLED', 'true').lower() == 'true'
+    GMAIL_IMPORT_LEDGER_DB_PATH = os.getenv('GMAIL_IMPORT_LEDGER_DB_PATH', os.path.join(LOCAL_STATE_DIR, 'gmail_import_ledger.sqlite3'))
+    GMAIL_IMPORT_LEDGER_RETENTION_DAYS = int(os.getenv('GMAIL_IMPORT_LEDGER_RETENTION_DAYS', '365'))
     
     VERTEX_RUNNER_SA_PATH = os.getenv('VERTEX_RUNNER_SA_PATH', 'vertex-runner.json')
     DOCUMENTAI_ACCESS_SA_PATH = os.getenv('DOCUMENTAI_ACCESS_SA_PATH', 'documentai-access.json')
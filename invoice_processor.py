@@ -1,10 +1,29 @@
+import copy
 import json
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from services import DocumentAIService, VertexSearchService, GeminiService
-from services.semantic_vendor_resolver import SemanticVendorResolver
+from services.semantic_vendor_resolver import SemanticVendorResolver, FUSED_RESOLUTION_KEY
+from services.extraction_cache import ExtractionCache
+from services.vendor_template_store import VendorTemplateStore
 from utils import extract_vendor_name, format_search_results
 from utils.multi_currency_detector import MultiCurrencyDetector
+from utils.metrics import metrics
+from utils.deadline import PipelineDeadline
 from config import config
 
+# Metric stage names for the Layer 1.5 + Layer 2 fan-out lookups
+LOOKUP_METRIC_STAGES = {
+    'currency': 'currency_detection',
+    'similar_invoices': 'vertex_similar_invoices',
+    'rejected_entity': 'vertex_rejected_entity',
+    'vendor_search': 'vertex_vendor_search'
+}
+
+# Optional layers a latency-bounded run may skip and finish_enrichment() can complete later
+DEFERRABLE_LAYERS = ('layer3_5_vendor_resolution', 'feedback_loop')
+
 class InvoiceProcessor:
     """
     Main invoice processing pipeline orchestrating the 3-layer architecture:
@@ -14,28 +33,281 @@ class InvoiceProcessor:
     Layer 3: Gemini for semantic validation and reasoning
     """
     
-    def __init__(self):
-        self.doc_ai_service = DocumentAIService()
+    def __init__(self, doc_ai_service=None, vertex_search_service=None, gemini_service=None, storage_client=None):
+        """
+        Build the pipeline; services default to the real Google Cloud clients
+        
+        Args:
+            doc_ai_service: Optional DocumentAIService (e.g., a simulated backend for benchmarks)
+            vertex_search_service: Optional VertexSearchService
+            gemini_service: Optional GeminiService
+            storage_client: Optional google.cloud.storage.Client (built lazily otherwise)
+        """
+        self.doc_ai_service = doc_ai_service or DocumentAIService()
         self.multi_currency_detector = MultiCurrencyDetector()
-        self.vertex_search_service = VertexSearchService()
-        self.gemini_service = GeminiService()
+        self.vertex_search_service = vertex_search_service or VertexSearchService()
+        self.gemini_service = gemini_service or GeminiService()
         self.vendor_resolver = SemanticVendorResolver(self.gemini_service)
+        self.extraction_cache = ExtractionCache() if config.EXTRACTION_CACHE_ENABLED else None
+        self.template_store = VendorTemplateStore() if config.VENDOR_TEMPLATES_ENABLED else None
+        self.storage_client = storage_client
+        
+        # Shared pool for the Layer 1.5 + Layer 2 fan-out (independent lookups run in parallel)
+        self.lookup_executor = ThreadPoolExecutor(
+            max_workers=config.CONTEXT_LOOKUP_WORKERS,
+            thread_name_prefix='context-lookup'
+        )
+        # Background archival uploads for local files (Document AI reads the bytes inline)
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=config.GCS_UPLOAD_WORKERS,
+            thread_name_prefix='gcs-upload'
+        )
+        # Enrichment skipped by the latency budget is finished here after the response is returned
+        self.enrichment_executor = ThreadPoolExecutor(
+            max_workers=config.DEFERRED_ENRICHMENT_WORKERS,
+            thread_name_prefix='deferred-enrichment'
+        )
     
-    def process_invoice(self, gcs_uri, mime_type='application/pdf'):
+    def _fan_out_context_lookups(self, raw_text, extracted_entities, vendor_name, include_vertex=True, timeout=None):
+        """
+        Run Layer 1.5 (currency detection) and Layer 2 (Vertex AI Search) lookups concurrently
+        
+        The rejected-entity probe, vendor search and similar-invoice search are independent
+        network round-trips, so they are issued together and joined with a shared timeout.
+        
+        Args:
+            raw_text: Raw OCR text from Document AI
+            extracted_entities: Structured entities from Document AI
+            vendor_name: Vendor name extracted from Layer 1 (may be None)
+            include_vertex: False to run only the local currency detection (RAG skipped)
+            timeout: Shared timeout in seconds (defaults to CONTEXT_LOOKUP_TIMEOUT_SECONDS)
+            
+        Returns:
+            Dictionary mapping lookup name to {'value': ..., 'error': str or None}
+        """
+        timeout = timeout or config.CONTEXT_LOOKUP_TIMEOUT_SECONDS
+        
+        lookups = {
+            'currency': (
+                self.multi_currency_detector.analyze_invoice_currencies,
+                {'document_text': raw_text, 'document_ai_result': extracted_entities}
+            )
+        }
+        if include_vertex:
+            lookups['similar_invoices'] = (
+                self.vertex_search_service.search_similar_invoices,
+                {'document_text': raw_text, 'vendor_name': vendor_name, 'limit': 3, 'timeout': timeout, 'raise_errors': True}
+            )
+        if include_vertex and vendor_name:
+            lookups['rejected_entity'] = (
+                self.vertex_search_service.check_rejected_entity,
+                {'vendor_query': vendor_name, 'timeout': timeout, 'raise_errors': True}
+            )
+            lookups['vendor_search'] = (
+                self.vertex_search_service.search_vendor_documents,
+                {'vendor_query': vendor_name, 'timeout': timeout, 'raise_errors': True}
+            )
+        
+        futures = {
+            name: self.lookup_executor.submit(self._timed_lookup, LOOKUP_METRIC_STAGES[name], func, kwargs)
+            for name, (func, kwargs) in lookups.items()
+        }
+        wait(futures.values(), timeout=timeout)
+        
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                results[name] = {'value': None, 'error': f'timed out after {timeout:.1f}s'}
+                continue
+            try:
+                results[name] = {'value': future.result(), 'error': None}
+            except Exception as e:
+                results[name] = {'value': None, 'error': str(e)}
+        
+        return results
+    
+    def _timed_lookup(self, stage, func, kwargs):
+        """Run one fan-out lookup under a metrics stage timer (Vertex lookups raise, so failures count as errors)"""
+        with metrics.stage_timer(stage):
+            return func(**kwargs)
+    
+    def process_invoice(self, gcs_uri, mime_type='application/pdf', content_hash=None, progress_callback=None, document=None, raw_content=None, deadline=None):
         """
         Process an invoice through the complete 3-layer pipeline
         
+        Checks the content-addressed extraction cache first; identical document bytes
+        return the stored result without calling Document AI, Vertex Search or Gemini.
+        
         Args:
             gcs_uri: GCS URI of the invoice (e.g., gs://bucket/invoice.pdf)
             mime_type: MIME type of the invoice file
+            content_hash: Optional cache key (SHA-256 of the bytes; GCS checksums if omitted)
+            progress_callback: Optional callable(layer, status, **details) notified as each layer starts/finishes
+            document: Optional Document AI result already parsed (e.g., by a batch run); skips the Layer 1 call
+            raw_content: Optional document bytes; Layer 1 sends them inline instead of reading gcs_uri
+            deadline: Optional PipelineDeadline (defaults to PIPELINE_DEADLINE_SECONDS from now);
+                      optional layers that no longer fit are skipped and listed in degraded_layers
             
         Returns:
             Dictionary containing validated invoice data
         """
+        start = time.perf_counter()
+        deadline = deadline or PipelineDeadline(config.PIPELINE_DEADLINE_SECONDS)
+        cache_version = None
+        if self.extraction_cache:
+            if not content_hash:
+                content_hash = ExtractionCache.hash_bytes(raw_content) if raw_content is not None else self._gcs_content_key(gcs_uri)
+            if content_hash:
+                cache_version = self.gemini_service.prompt_version()
+                cached = self.extraction_cache.get(content_hash, mime_type, cache_version)
+                if cached:
+                    print(f"⚡ EXTRACTION CACHE HIT: {content_hash[:12]}… (skipping 3-layer pipeline)")
+                    self._notify(progress_callback, 'extraction_cache', 'hit')
+                    metrics.record_stage('pipeline', time.perf_counter() - start, 'cache_hit')
+                    cached['gcs_uri'] = gcs_uri
+                    return cached
+        
+        result = self._run_pipeline(
+            gcs_uri,
+            mime_type,
+            progress_callback=progress_callback,
+            document=document,
+            raw_content=raw_content,
+            deadline=deadline
+        )
+        
+        pending_enrichment = result.pop('_pending_enrichment', None)
+        if cache_version and self._is_cacheable(result):
+            self.extraction_cache.put(content_hash, mime_type, cache_version, result)
+            result['cache'] = {'hit': False, 'content_hash': content_hash, 'version': cache_version}
+        
+        if pending_enrichment and config.DEFERRED_ENRICHMENT_ENABLED:
+            # Finish on a copy: the caller owns (and may serialize) the returned result.
+            # copy_context keeps the Gemini usage run of the caller (e.g., a Gmail import).
+            self.enrichment_executor.submit(
+                contextvars.copy_context().run,
+                self._run_deferred_enrichment,
+                copy.deepcopy(result),
+                pending_enrichment,
+                content_hash,
+                mime_type,
+                cache_version
+            )
+            result['deferred_enrichment'] = {'status': 'scheduled', 'layers': pending_enrichment['layers']}
+        
+        metrics.record_stage('pipeline', time.perf_counter() - start, 'success' if result.get('status') == 'completed' else 'error')
+        return result
+    
+    def _notify(self, progress_callback, layer, status, **details):
+        """Report layer progress to an optional callback (never fails the pipeline)"""
+        if not progress_callback:
+            return
+        try:
+            progress_callback(layer, status, **details)
+        except Exception as e:
+            print(f"⚠️ Progress callback error (non-critical): {e}")
+    
+    def _partial_reporter(self, progress_callback):
+        """
+        Forward streamed Gemini fields as ('layer3_gemini', 'partial') progress
+        
+        Each report carries every field parsed so far (fields) and the ones new in this
+        report (latest). Returns None without a callback, so validation is not streamed.
+        """
+        if not progress_callback:
+            return None
+        fields = {}
+        
+        def on_partial(latest):
+            fields.update(latest)
+            self._notify(progress_callback, 'layer3_gemini', 'partial', fields=dict(fields), latest=latest)
+        
+        return on_partial
+    
+    def _notify_layer(self, progress_callback, result, layer):
+        """Report the final status recorded for a layer in result['layers']"""
+        self._notify(progress_callback, layer, result['layers'].get(layer, {}).get('status', 'unknown'))
+    
+    def _is_cacheable(self, result):
+        """Only completed, non-degraded extractions without Gemini errors are stored in the cache"""
+        validated_data = result.get('validated_data') or {}
+        return (
+            result.get('status') == 'completed'
+            and 'error' not in validated_data
+            and not result.get('degraded_layers')
+        )
+    
+    def _get_storage_client(self):
+        """Lazily build (and reuse) the GCS client with the Vertex runner service account"""
+        if self.storage_client is not None:
+            return self.storage_client
+        
+        from google.cloud import storage
+        from google.oauth2 import service_account
+        import os
+        
+        credentials = None
+        
+        sa_json = os.getenv('GOOGLE_CLOUD_SERVICE_ACCOUNT_JSON')
+        if sa_json:
+            try:
+                sa_info = json.loads(sa_json)
+                credentials = service_account.Credentials.from_service_account_info(sa_info)
+            except json.JSONDecodeError:
+                print("Warning: Failed to parse GOOGLE_CLOUD_SERVICE_ACCOUNT_JSON")
+        elif os.path.exists(config.VERTEX_RUNNER_SA_PATH):
+            credentials = service_account.Credentials.from_service_account_file(
+                config.VERTEX_RUNNER_SA_PATH
+            )
+        
+        self.storage_client = storage.Client(
+            project=config.GOOGLE_CLOUD_PROJECT_ID,
+            credentials=credentials
+        )
+        return self.storage_client
+    
+    def _gcs_content_key(self, gcs_uri):
+        """
+        Extraction cache key for a GCS object, from its stored MD5/CRC32C
+        
+        Reads object metadata only; Document AI is the one that reads the bytes.
+        Callers that already hold the bytes key on their SHA-256 instead.
+        
+        Returns:
+            Key string, or None if the object metadata could not be read
+        """
+        try:
+            bucket_name, _, blob_name = gcs_uri[len('gs://'):].partition('/')
+            blob = self._get_storage_client().bucket(bucket_name).get_blob(blob_name)
+            return ExtractionCache.checksum_key(blob.md5_hash, blob.crc32c, blob.size) if blob else None
+        except Exception as e:
+            print(f"⚠️ Could not read {gcs_uri} checksums for extraction cache (non-critical): {e}")
+            return None
+    
+    def _run_pipeline(self, gcs_uri, mime_type, progress_callback=None, document=None, raw_content=None, deadline=None):
+        """
+        Run Document AI → currency/RAG fan-out → Gemini → vendor resolution → feedback loop
+        
+        Args:
+            gcs_uri: GCS URI of the invoice
+            mime_type: MIME type of the invoice file
+            progress_callback: Optional callable(layer, status, **details) for per-layer progress;
+                               while Gemini streams, layer3_gemini reports status 'partial'
+                               with the fields parsed so far
+            document: Optional pre-parsed Document AI result (Layer 1 call is skipped)
+            raw_content: Optional document bytes sent inline to Document AI (gcs_uri need not exist yet)
+            deadline: PipelineDeadline shared by the layers (unbounded if omitted)
+            
+        Returns:
+            Dictionary containing validated invoice data
+        """
+        deadline = deadline or PipelineDeadline()
         result = {
             'gcs_uri': gcs_uri,
             'status': 'processing',
-            'layers': {}
+            'layers': {},
+            'degraded_layers': []
         }
         
         print(f"\n{'='*60}")
@@ -47,10 +319,18 @@ class InvoiceProcessor:
         vendor_name = None
         rag_context = "No vendor history found in database."
         
+        self._notify(progress_callback, 'layer1_document_ai', 'running')
         try:
             print("LAYER 1: Document AI - Structure Extraction")
             print("-" * 60)
-            document = self.doc_ai_service.process_document(gcs_uri, mime_type)
+            if document is None:
+                with metrics.stage_timer('document_ai'):
+                    if raw_content is not None:
+                        document = self.doc_ai_service.process_document_bytes(raw_content, mime_type)
+                    else:
+                        document = self.doc_ai_service.process_document(gcs_uri, mime_type)
+            else:
+                print("✓ Using Document AI batch result")
             raw_text = self.doc_ai_service.get_raw_text(document)
             extracted_entities = self.doc_ai_service.extract_entities(document)
             
@@ -65,27 +345,50 @@ class InvoiceProcessor:
             }
         except Exception as e:
             print(f"✗ Document AI error: {str(e)}")
-            result['layers']['layer1_document_ai'] = {
-                'status': 'error',
-                'error': str(e)
-            }
-            result['status'] = 'error'
-            result['error'] = f"Document AI failed: {str(e)}"
-            result['validated_data'] = {
-                'error': str(e),
-                'validation_flags': ['Document AI processing failed']
-            }
+            self._mark_document_ai_failed(result, e)
+            self._notify_layer(progress_callback, result, 'layer1_document_ai')
             return result
         
+        self._notify_layer(progress_callback, result, 'layer1_document_ai')
+        vendor_name = extract_vendor_name(extracted_entities)
+        
+        # VENDOR TEMPLATE FAST PATH: recurring layouts are built locally (no Vertex/Gemini calls)
+        if self.template_store and vendor_name:
+            with metrics.stage_timer('vendor_template') as timer:
+                validated_data, fast_path = self.template_store.apply(vendor_name, extracted_entities)
+                timer.outcome = 'hit' if validated_data else 'fallback'
+            result['fast_path'] = fast_path
+            if validated_data:
+                return self._complete_fast_path(result, validated_data, progress_callback)
+            print(f"ℹ️ Vendor template fast path not used: {fast_path.get('reason')}")
+        
+        # LATENCY BUDGET: Vertex RAG is optional and must leave Gemini's reserved budget intact
+        rag_allowed = deadline.allows(config.PIPELINE_BUDGET_RAG_SECONDS, reserve_seconds=config.PIPELINE_BUDGET_GEMINI_SECONDS)
+        lookup_timeout = config.CONTEXT_LOOKUP_TIMEOUT_SECONDS
+        if rag_allowed:
+            lookup_timeout = min(lookup_timeout, deadline.remaining() - config.PIPELINE_BUDGET_GEMINI_SECONDS)
+        
+        # LAYER 1.5 + LAYER 2 FAN-OUT: independent lookups issued concurrently
+        print("\n⚡ Fan-out: currency detection + Vertex AI Search lookups (parallel)")
+        self._notify(progress_callback, 'layer1_5_multi_currency', 'running')
+        if rag_allowed:
+            self._notify(progress_callback, 'layer2_vertex_search', 'running')
+        lookups = self._fan_out_context_lookups(
+            raw_text,
+            extracted_entities,
+            vendor_name,
+            include_vertex=rag_allowed,
+            timeout=lookup_timeout
+        )
+        
         # LAYER 1.5: Multi-Currency Detection
         currency_context = None
         try:
             print("\nLAYER 1.5: Multi-Currency Detection & Analysis")
             print("-" * 60)
-            currency_context = self.multi_currency_detector.analyze_invoice_currencies(
-                document_text=raw_text,
-                document_ai_result=extracted_entities
-            )
+            if lookups['currency']['error']:
+                raise RuntimeError(lookups['currency']['error'])
+            currency_context = lookups['currency']['value']
             
             is_multi = currency_context.get('is_multi_currency', False)
             currencies_found = currency_context.get('currency_symbols_found', [])
@@ -120,67 +423,98 @@ class InvoiceProcessor:
                 'status': 'warning',
                 'error': str(e)
             }
+        self._notify_layer(progress_callback, result, 'layer1_5_multi_currency')
         
-        try:
-            print("\nLAYER 2: Vertex AI Search (RAG) - Context Retrieval")
-            print("-" * 60)
-            vendor_name = extract_vendor_name(extracted_entities)
-            print(f"✓ Extracted vendor name: {vendor_name}")
-            
-            # Search for vendor information
-            vendor_search_results = []
-            vendor_context = "No vendor history found in database."
-            
-            if vendor_name:
-                vendor_search_results = self.vertex_search_service.search_vendor(vendor_name)
-                vendor_context = self.vertex_search_service.format_context(vendor_search_results)
-                print(f"✓ Found {len(vendor_search_results)} vendor matches in RAG datastore")
-            else:
-                print("⚠ No vendor name found, skipping vendor lookup")
-            
-            # Search for similar past invoice extractions (RAG self-learning)
-            print("🧠 Searching for similar past invoice extractions...")
-            invoice_extraction_results = self.vertex_search_service.search_similar_invoices(
-                document_text=raw_text,
-                vendor_name=vendor_name,
-                limit=3
-            )
-            
-            invoice_extraction_context = self.vertex_search_service.format_invoice_extraction_context(
-                invoice_extraction_results
-            )
-            
-            if invoice_extraction_results:
-                print(f"✓ Found {len(invoice_extraction_results)} similar past invoice extractions")
-            else:
-                print("ℹ️ No similar past extractions found - this is a new pattern")
-            
-            # Combine vendor context and invoice extraction context
-            rag_context = f"{vendor_context}\n\n{invoice_extraction_context}"
-            
-            result['layers']['layer2_vertex_search'] = {
-                'status': 'success',
-                'vendor_query': vendor_name,
-                'vendor_matches_found': len(vendor_search_results),
-                'similar_invoices_found': len(invoice_extraction_results)
-            }
-        except Exception as e:
-            print(f"⚠ Vertex Search error (non-critical): {str(e)}")
-            result['layers']['layer2_vertex_search'] = {
-                'status': 'warning',
-                'error': str(e)
-            }
+        if not rag_allowed:
+            self._skip_for_budget(result, 'layer2_vertex_search', config.PIPELINE_BUDGET_RAG_SECONDS, deadline)
+        else:
+            try:
+                print("\nLAYER 2: Vertex AI Search (RAG) - Context Retrieval")
+                print("-" * 60)
+                print(f"✓ Extracted vendor name: {vendor_name}")
+                
+                # Join vendor lookups (rejected-entity probe takes precedence, as in search_vendor)
+                vendor_search_results = []
+                vendor_context = "No vendor history found in database."
+                lookup_errors = {
+                    name: lookup['error']
+                    for name, lookup in lookups.items()
+                    if name != 'currency' and lookup['error']
+                }
+                for name, error in lookup_errors.items():
+                    print(f"⚠ Vertex lookup '{name}' failed (non-critical): {error}")
+                
+                if vendor_name:
+                    vendor_search_results = (
+                        lookups['rejected_entity']['value']
+                        or lookups['vendor_search']['value']
+                        or []
+                    )
+                    vendor_context = self.vertex_search_service.format_context(vendor_search_results)
+                    print(f"✓ Found {len(vendor_search_results)} vendor matches in RAG datastore")
+                else:
+                    print("⚠ No vendor name found, skipping vendor lookup")
+                
+                # Similar past invoice extractions (RAG self-learning)
+                invoice_extraction_results = lookups['similar_invoices']['value'] or []
+                
+                invoice_extraction_context = self.vertex_search_service.format_invoice_extraction_context(
+                    invoice_extraction_results
+                )
+                
+                if invoice_extraction_results:
+                    print(f"✓ Found {len(invoice_extraction_results)} similar past invoice extractions")
+                else:
+                    print("ℹ️ No similar past extractions found - this is a new pattern")
+                
+                # Combine vendor context and invoice extraction context
+                rag_context = f"{vendor_context}\n\n{invoice_extraction_context}"
+                
+                result['layers']['layer2_vertex_search'] = {
+                    'status': 'warning' if lookup_errors else 'success',
+                    'vendor_query': vendor_name,
+                    'vendor_matches_found': len(vendor_search_results),
+                    'similar_invoices_found': len(invoice_extraction_results)
+                }
+                if lookup_errors:
+                    result['layers']['layer2_vertex_search']['lookup_errors'] = lookup_errors
+            except Exception as e:
+                print(f"⚠ Vertex Search error (non-critical): {str(e)}")
+                result['layers']['layer2_vertex_search'] = {
+                    'status': 'warning',
+                    'error': str(e)
+                }
+        
+        self._notify_layer(progress_callback, result, 'layer2_vertex_search')
         
         try:
+            self._notify(progress_callback, 'layer3_gemini', 'running')
             print("\nLAYER 3: Gemini - Semantic Validation & Math Checking")
             print("-" * 60)
-            validated_data = self.gemini_service.validate_invoice(
-                gcs_uri,
-                raw_text,
-                extracted_entities,
-                rag_context,
-                currency_context=currency_context
-            )
+            # FUSED MODE: Layer 3.5 vendor resolution is answered by the same Gemini request
+            fused = config.FUSED_VENDOR_RESOLUTION_ENABLED
+            with metrics.stage_timer('gemini_validation') as timer:
+                validated_data = self.gemini_service.validate_invoice(
+                    gcs_uri,
+                    raw_text,
+                    extracted_entities,
+                    rag_context,
+                    currency_context=currency_context,
+                    extra_prompt=self.vendor_resolver.fused_prompt_section() if fused else None,
+                    on_partial=self._partial_reporter(progress_callback)
+                )
+                if 'error' in validated_data:
+                    timer.outcome = 'error'
+            
+            fused_resolution = None
+            if fused and 'error' not in validated_data:
+                fused_resolution = self.vendor_resolver.parse_fused_resolution(
+                    validated_data.pop(FUSED_RESOLUTION_KEY, None),
+                    {'entities': extracted_entities},
+                    validated_data
+                )
+            elif fused:
+                validated_data.pop(FUSED_RESOLUTION_KEY, None)
             
             if 'error' in validated_data:
                 print(f"⚠ Gemini validation completed with warnings: {validated_data.get('error', 'Unknown')}")
@@ -205,129 +539,37 @@ class InvoiceProcessor:
                     'validation_flags': flags
                 }
             
-            # LAYER 3.5: Semantic Vendor Identity Resolution (AI-First Vendor Identification)
-            try:
-                print("\n🧠 LAYER 3.5: Semantic Vendor Identity Resolution")
-                print("-" * 60)
-                
-                # Resolve TRUE vendor identity using AI reasoning
-                vendor_resolution = self.vendor_resolver.resolve_vendor_identity(
-                    document_ai_entities={'entities': extracted_entities},
-                    validated_data=validated_data,
-                    rag_context=result['layers'].get('layer2_vertex_search')
-                )
-                
-                # Replace vendor in validated_data with semantically resolved vendor
-                if vendor_resolution and 'true_vendor' in vendor_resolution:
-                    true_vendor_name = vendor_resolution['true_vendor']['name']
-                    true_vendor_confidence = vendor_resolution['true_vendor']['confidence']
-                    
-                    # Update vendor in validated_data
-                    if 'vendor' not in validated_data:
-                        validated_data['vendor'] = {}
-                    
-                    # Store original vendor for audit trail
-                    original_brand_name = validated_data.get('vendor', {}).get('name')
-                    validated_data['vendor']['original_supplier_name'] = original_brand_name
-                    validated_data['vendor']['original_ocr_name'] = original_brand_name
-                    
-                    # CRITICAL FIX #1 & #2: Use resolved legal beneficiary or fallback to Gemini's legal_name
-                    if true_vendor_name and true_vendor_name != 'Unknown':
-                        print(f"🔄 UPDATING VENDOR: '{original_brand_name}' → '{true_vendor_name}'")
-                        validated_data['vendor']['name'] = true_vendor_name
-                        
-                        # CRITICAL FIX #2: Only update vendorMatch if we have a valid true vendor
-                        if 'vendorMatch' not in validated_data:
-                            validated_data['vendorMatch'] = {}
-                        validated_data['vendorMatch']['normalizedName'] = true_vendor_name
-                    else:
-                        # CRITICAL FIX #1: Resolver failed - fallback to legal_name if available
-                        print(f"⚠️ Resolver returned empty vendor name, applying fallback logic...")
-                        legal_name = validated_data.get('vendor', {}).get('legal_name') or validated_data.get('vendor', {}).get('legalName')
-                        if legal_name and legal_name != 'Unknown' and legal_name != original_brand_name:
-                            print(f"🔄 FALLBACK: Using Gemini's legal_name '{legal_name}' instead of brand name '{original_brand_name}'")
-                            validated_data['vendor']['name'] = legal_name
-                            
-                            # Update vendorMatch with legal name
-                            if 'vendorMatch' not in validated_data:
-                                validated_data['vendorMatch'] = {}
-                            validated_data['vendorMatch']['normalizedName'] = legal_name
-                        else:
-                            print(f"ℹ️ No legal_name fallback available, keeping original: '{original_brand_name}'")
-                    
-                    # Add resolution metadata
-                    validated_data['vendor_resolution'] = {
-                        'is_intermediary': vendor_resolution.get('is_intermediary_scenario', False),
-                        'supplier_relationship': vendor_resolution.get('supplier_relationship'),
-                        'resolution_confidence': true_vendor_confidence,
-                        'reasoning': vendor_resolution.get('reasoning'),
-                        'conflicts_detected': vendor_resolution.get('conflicts_detected', []),
-                        'alternate_names': vendor_resolution.get('alternate_names', [])
-                    }
-                    
-                    print(f"✓ Vendor resolution complete")
-                    
-                    result['layers']['layer3_5_vendor_resolution'] = {
-                        'status': 'success',
-                        'true_vendor': true_vendor_name,
-                        'original_supplier': validated_data['vendor'].get('original_supplier_name'),
-                        'confidence': true_vendor_confidence,
-                        'is_intermediary': vendor_resolution.get('is_intermediary_scenario', False)
-                    }
-                else:
-                    print("⚠️ Vendor resolution returned no results")
-                    result['layers']['layer3_5_vendor_resolution'] = {
-                        'status': 'warning',
-                        'message': 'No vendor resolution results'
-                    }
-                    
-            except Exception as e:
-                print(f"⚠️ Vendor resolution error (non-critical): {str(e)}")
-                result['layers']['layer3_5_vendor_resolution'] = {
-                    'status': 'error',
-                    'error': str(e)
-                }
+            self._notify_layer(progress_callback, result, 'layer3_gemini')
+            
+            # LATENCY BUDGET: optional enrichment only runs while its budget still fits
+            # (a fused resolution costs no further call, so it is always applied)
+            if fused_resolution or deadline.allows(config.PIPELINE_BUDGET_VENDOR_RESOLUTION_SECONDS):
+                # LAYER 3.5: Semantic Vendor Identity Resolution (AI-First Vendor Identification)
+                self._apply_vendor_resolution(result, validated_data, extracted_entities, progress_callback, vendor_resolution=fused_resolution)
+            else:
+                self._skip_for_budget(result, 'layer3_5_vendor_resolution', config.PIPELINE_BUDGET_VENDOR_RESOLUTION_SECONDS, deadline, progress_callback)
             
             result['status'] = 'completed'
             result['validated_data'] = validated_data
             
             # FEEDBACK LOOP: Store successful extraction to knowledge base for future learning
-            try:
-                extraction_confidence = validated_data.get('extractionConfidence', 0.0)
-                if extraction_confidence > 0.7 and 'error' not in validated_data:
-                    print("\n🧠 FEEDBACK LOOP: Storing extraction to knowledge base...")
-                    extracted_vendor_name = validated_data.get('vendor', {}).get('name') or vendor_name
-                    
-                    stored = self.vertex_search_service.store_invoice_extraction(
-                        document_text=raw_text,
-                        vendor_name=extracted_vendor_name,
-                        extracted_data=validated_data,
-                        success=True
-                    )
-                    
-                    if stored:
-                        result['layers']['feedback_loop'] = {
-                            'status': 'success',
-                            'stored_to_knowledge_base': True,
-                            'confidence': extraction_confidence
-                        }
-                    else:
-                        result['layers']['feedback_loop'] = {
-                            'status': 'warning',
-                            'stored_to_knowledge_base': False,
-                            'reason': 'Storage failed but extraction succeeded'
-                        }
-                else:
-                    print(f"ℹ️ Skipping knowledge base storage (confidence={extraction_confidence:.2f}, threshold=0.7)")
-                    result['layers']['feedback_loop'] = {
-                        'status': 'skipped',
-                        'reason': f'Confidence too low ({extraction_confidence:.2f} < 0.7) or extraction had errors'
-                    }
-            except Exception as e:
-                print(f"⚠ Feedback loop error (non-critical): {str(e)}")
-                result['layers']['feedback_loop'] = {
-                    'status': 'error',
-                    'error': str(e)
+            if deadline.allows(config.PIPELINE_BUDGET_FEEDBACK_SECONDS):
+                self._store_feedback(result, validated_data, raw_text, vendor_name, progress_callback)
+            else:
+                self._skip_for_budget(result, 'feedback_loop', config.PIPELINE_BUDGET_FEEDBACK_SECONDS, deadline, progress_callback)
+            
+            # Learn/reinforce the vendor's template from this Gemini extraction (complete results only)
+            if self.template_store and vendor_name and not result['degraded_layers']:
+                self.template_store.learn(vendor_name, extracted_entities, validated_data)
+            
+            result['latency_budget'] = deadline.summary()
+            deferrable = [layer for layer in result['degraded_layers'] if layer in DEFERRABLE_LAYERS]
+            if deferrable:
+                result['_pending_enrichment'] = {
+                    'raw_text': raw_text,
+                    'extracted_entities': extracted_entities,
+                    'vendor_name': vendor_name,
+                    'layers': deferrable
                 }
             
             print(f"\n{'='*60}")
@@ -348,60 +590,443 @@ class InvoiceProcessor:
                 'error': str(e),
                 'validation_flags': ['Gemini validation failed']
             }
+            self._notify_layer(progress_callback, result, 'layer3_gemini')
             return result
     
-    def process_local_file(self, file_path, mime_type='application/pdf'):
+    def _apply_vendor_resolution(self, result, validated_data, extracted_entities, progress_callback=None, vendor_resolution=None):
+        """
+        Layer 3.5: replace the vendor in validated_data with the semantically resolved identity
+        
+        Updates validated_data and result['layers'] in place; errors are recorded, never raised.
+        A vendor_resolution already returned by the fused Layer 3 call is applied without
+        calling the resolver again.
+        """
+        self._notify(progress_callback, 'layer3_5_vendor_resolution', 'running')
+        mode = 'fused' if vendor_resolution else 'separate'
+        try:
+            print("\n🧠 LAYER 3.5: Semantic Vendor Identity Resolution")
+            print("-" * 60)
+            
+            # Resolve TRUE vendor identity using AI reasoning
+            if vendor_resolution:
+                print("✓ Resolved in the Layer 3 Gemini response (fused mode)")
+                metrics.increment('invoice_stage_total', stage='vendor_resolution', outcome='fused')
+            else:
+                with metrics.stage_timer('vendor_resolution'):
+                    vendor_resolution = self.vendor_resolver.resolve_vendor_identity(
+                        document_ai_entities={'entities': extracted_entities},
+                        validated_data=validated_data,
+                        rag_context=result['layers'].get('layer2_vertex_search')
+                    )
+            
+            # Replace vendor in validated_data with semantically resolved vendor
+            if vendor_resolution and 'true_vendor' in vendor_resolution:
+                true_vendor_name = vendor_resolution['true_vendor']['name']
+                true_vendor_confidence = vendor_resolution['true_vendor']['confidence']
+                
+                # Update vendor in validated_data
+                if 'vendor' not in validated_data:
+                    validated_data['vendor'] = {}
+                
+                # Store original vendor for audit trail
+                original_brand_name = validated_data.get('vendor', {}).get('name')
+                validated_data['vendor']['original_supplier_name'] = original_brand_name
+                validated_data['vendor']['original_ocr_name'] = original_brand_name
+                
+                # CRITICAL FIX #1 & #2: Use resolved legal beneficiary or fallback to Gemini's legal_name
+                if true_vendor_name and true_vendor_name != 'Unknown':
+                    print(f"🔄 UPDATING VENDOR: '{original_brand_name}' → '{true_vendor_name}'")
+                    validated_data['vendor']['name'] = true_vendor_name
+                    
+                    # CRITICAL FIX #2: Only update vendorMatch if we have a valid true vendor
+                    if 'vendorMatch' not in validated_data:
+                        validated_data['vendorMatch'] = {}
+                    validated_data['vendorMatch']['normalizedName'] = true_vendor_name
+                else:
+                    # CRITICAL FIX #1: Resolver failed - fallback to legal_name if available
+                    print(f"⚠️ Resolver returned empty vendor name, applying fallback logic...")
+                    legal_name = validated_data.get('vendor', {}).get('legal_name') or validated_data.get('vendor', {}).get('legalName')
+                    if legal_name and legal_name != 'Unknown' and legal_name != original_brand_name:
+                        print(f"🔄 FALLBACK: Using Gemini's legal_name '{legal_name}' instead of brand name '{original_brand_name}'")
+                        validated_data['vendor']['name'] = legal_name
+                        
+                        # Update vendorMatch with legal name
+                        if 'vendorMatch' not in validated_data:
+                            validated_data['vendorMatch'] = {}
+                        validated_data['vendorMatch']['normalizedName'] = legal_name
+                    else:
+                        print(f"ℹ️ No legal_name fallback available, keeping original: '{original_brand_name}'")
+                
+                # Add resolution metadata
+                validated_data['vendor_resolution'] = {
+                    'is_intermediary': vendor_resolution.get('is_intermediary_scenario', False),
+                    'supplier_relationship': vendor_resolution.get('supplier_relationship'),
+                    'resolution_confidence': true_vendor_confidence,
+                    'reasoning': vendor_resolution.get('reasoning'),
+                    'conflicts_detected': vendor_resolution.get('conflicts_detected', []),
+                    'alternate_names': vendor_resolution.get('alternate_names', [])
+                }
+                
+                print(f"✓ Vendor resolution complete")
+                
+                result['layers']['layer3_5_vendor_resolution'] = {
+                    'status': 'success',
+                    'mode': mode,
+                    'true_vendor': true_vendor_name,
+                    'original_supplier': validated_data['vendor'].get('original_supplier_name'),
+                    'confidence': true_vendor_confidence,
+                    'is_intermediary': vendor_resolution.get('is_intermediary_scenario', False)
+                }
+            else:
+                print("⚠️ Vendor resolution returned no results")
+                result['layers']['layer3_5_vendor_resolution'] = {
+                    'status': 'warning',
+                    'message': 'No vendor resolution results'
+                }
+                
+        except Exception as e:
+            print(f"⚠️ Vendor resolution error (non-critical): {str(e)}")
+            result['layers']['layer3_5_vendor_resolution'] = {
+                'status': 'error',
+                'error': str(e)
+            }
+        self._notify_layer(progress_callback, result, 'layer3_5_vendor_resolution')
+    
+    def _store_feedback(self, result, validated_data, raw_text, vendor_name, progress_callback=None):
+        """Feedback loop: store a confident extraction in the knowledge base (errors are recorded, never raised)"""
+        try:
+            extraction_confidence = validated_data.get('extractionConfidence', 0.0)
+            if extraction_confidence > 0.7 and 'error' not in validated_data:
+                print("\n🧠 FEEDBACK LOOP: Storing extraction to knowledge base...")
+                extracted_vendor_name = validated_data.get('vendor', {}).get('name') or vendor_name
+                
+                with metrics.stage_timer('vertex_store_extraction') as timer:
+                    stored = self.vertex_search_service.store_invoice_extraction(
+                        document_text=raw_text,
+                        vendor_name=extracted_vendor_name,
+                        extracted_data=validated_data,
+                        success=True
+                    )
+                    if not stored:
+                        timer.outcome = 'error'
+                
+                if stored:
+                    result['layers']['feedback_loop'] = {
+                        'status': 'success',
+                        'stored_to_knowledge_base': True,
+                        'write_behind': self.vertex_search_service.write_queue is not None,
+                        'confidence': extraction_confidence
+                    }
+                else:
+                    result['layers']['feedback_loop'] = {
+                        'status': 'warning',
+                        'stored_to_knowledge_base': False,
+                        'reason': 'Storage failed but extraction succeeded'
+                    }
+            else:
+                print(f"ℹ️ Skipping knowledge base storage (confidence={extraction_confidence:.2f}, threshold=0.7)")
+                result['layers']['feedback_loop'] = {
+                    'status': 'skipped',
+                    'reason': f'Confidence too low ({extraction_confidence:.2f} < 0.7) or extraction had errors'
+                }
+        except Exception as e:
+            print(f"⚠ Feedback loop error (non-critical): {str(e)}")
+            result['layers']['feedback_loop'] = {
+                'status': 'error',
+                'error': str(e)
+            }
+        self._notify_layer(progress_callback, result, 'feedback_loop')
+    
+    def _skip_for_budget(self, result, layer, budget_seconds, deadline, progress_callback=None):
+        """Record an optional layer skipped because the latency budget no longer covers it"""
+        remaining = deadline.remaining()
+        print(f"⏱️ LATENCY BUDGET: skipping {layer} ({remaining:.1f}s left, layer budget {budget_seconds:g}s)")
+        result['layers'][layer] = {
+            'status': 'skipped',
+            'reason': 'latency_budget',
+            'remaining_seconds': round(remaining, 3)
+        }
+        result['degraded_layers'].append(layer)
+        metrics.increment('invoice_degraded_layers_total', layer=layer)
+        self._notify_layer(progress_callback, result, layer)
+    
+    def finish_enrichment(self, result, raw_text, extracted_entities, vendor_name=None, progress_callback=None):
         """
-        Process a local file by uploading to GCS first
+        Run the optional layers a latency-bounded pipeline skipped (Layer 3.5, feedback loop)
+        
+        A skipped Layer 2 lookup stays degraded: its context only matters before Gemini runs.
+        
+        Args:
+            result: Result dictionary returned by process_invoice (updated in place)
+            raw_text: Raw OCR text from Document AI
+            extracted_entities: Structured entities from Document AI
+            vendor_name: Vendor name extracted from Layer 1 (may be None)
+            progress_callback: Optional callable(layer, status, **details) for per-layer progress
+            
+        Returns:
+            The updated result dictionary
+        """
+        validated_data = result.get('validated_data') or {}
+        degraded = result.setdefault('degraded_layers', [])
+        
+        if 'layer3_5_vendor_resolution' in degraded:
+            self._apply_vendor_resolution(result, validated_data, extracted_entities, progress_callback)
+            degraded.remove('layer3_5_vendor_resolution')
+        
+        if 'feedback_loop' in degraded:
+            self._store_feedback(result, validated_data, raw_text, vendor_name, progress_callback)
+            degraded.remove('feedback_loop')
+        
+        if self.template_store and vendor_name and not degraded:
+            self.template_store.learn(vendor_name, extracted_entities, validated_data)
+        
+        return result
+    
+    def _run_deferred_enrichment(self, result, pending, content_hash, mime_type, cache_version):
+        """Background body for enrichment skipped by the latency budget; caches the completed result"""
+        try:
+            print(f"🕒 Deferred enrichment for {result.get('gcs_uri')}: {', '.join(pending['layers'])}")
+            with metrics.stage_timer('deferred_enrichment'):
+                self.finish_enrichment(result, pending['raw_text'], pending['extracted_entities'], pending['vendor_name'])
+            result['deferred_enrichment'] = {'status': 'completed', 'layers': pending['layers']}
+            
+            if cache_version and self._is_cacheable(result):
+                self.extraction_cache.put(content_hash, mime_type, cache_version, result)
+        except Exception as e:
+            print(f"⚠️ Deferred enrichment failed for {result.get('gcs_uri')} (non-critical): {e}")
+    
+    def _complete_fast_path(self, result, validated_data, progress_callback=None):
+        """Finish a result built from a vendor template: Layers 1.5-3.5 and the feedback loop are skipped"""
+        print("\n⚡ VENDOR TEMPLATE FAST PATH: built validated data locally (Gemini skipped)")
+        print(f"✓ Checks passed: {'; '.join(result['fast_path'].get('checks', []))}")
+        
+        skipped = {'status': 'skipped', 'reason': 'vendor_template_fast_path'}
+        for layer in ('layer1_5_multi_currency', 'layer2_vertex_search', 'layer3_5_vendor_resolution', 'feedback_loop'):
+            result['layers'][layer] = dict(skipped)
+        result['layers']['layer3_gemini'] = {
+            'status': 'fast_path',
+            'validation_flags': validated_data.get('validation_flags', [])
+        }
+        result['status'] = 'completed'
+        result['validated_data'] = validated_data
+        
+        for layer in ('layer1_5_multi_currency', 'layer2_vertex_search', 'layer3_gemini', 'layer3_5_vendor_resolution', 'feedback_loop'):
+            self._notify_layer(progress_callback, result, layer)
+        
+        return result
+    
+    def _mark_document_ai_failed(self, result, error):
+        """Record a Layer 1 failure on a result dictionary (the pipeline cannot continue)"""
+        result['layers']['layer1_document_ai'] = {
+            'status': 'error',
+            'error': str(error)
+        }
+        result['status'] = 'error'
+        result['error'] = f"Document AI failed: {str(error)}"
+        result['validated_data'] = {
+            'error': str(error),
+            'validation_flags': ['Document AI processing failed']
+        }
+        return result
+    
+    def list_gcs_documents(self, gcs_prefix, mime_types):
+        """
+        List invoice files under a GCS prefix
+        
+        Args:
+            gcs_prefix: GCS prefix (e.g., gs://payouts-invoices/2024/)
+            mime_types: Dictionary mapping lowercase file extension to MIME type;
+                        files with other extensions are skipped
+            
+        Returns:
+            List of (gcs_uri, mime_type, content_key) tuples; content_key is the extraction
+            cache key from the listed checksums (see ExtractionCache.checksum_key)
+        """
+        bucket_name, _, prefix = gcs_prefix[len('gs://'):].partition('/')
+        documents = []
+        for blob in self._get_storage_client().list_blobs(bucket_name, prefix=prefix):
+            ext = blob.name.rsplit('.', 1)[-1].lower() if '.' in blob.name else ''
+            if ext in mime_types:
+                content_key = ExtractionCache.checksum_key(blob.md5_hash, blob.crc32c, blob.size)
+                documents.append((f"gs://{bucket_name}/{blob.name}", mime_types[ext], content_key))
+        return documents
+    
+    def _batch_content_keys(self, documents):
+        """
+        Extraction cache keys for batch documents
+        
+        Keys listed with the document are used as-is; the rest are read from object
+        metadata in parallel. No object is downloaded.
+        
+        Returns:
+            dict of {gcs_uri: content_key} for the documents that have one
+        """
+        keys = {document[0]: document[2] for document in documents if len(document) > 2 and document[2]}
+        missing = [document[0] for document in documents if document[0] not in keys]
+        if missing:
+            self._get_storage_client()
+            with ThreadPoolExecutor(max_workers=min(16, len(missing)), thread_name_prefix='gcs-metadata') as pool:
+                for gcs_uri, content_key in zip(missing, pool.map(self._gcs_content_key, missing)):
+                    if content_key:
+                        keys[gcs_uri] = content_key
+        return keys
+    
+    def process_batch(self, documents, max_workers=None):
+        """
+        Process many GCS invoices for throughput: Layer 1 via Document AI batch
+        processing, then Layers 1.5-3 with bounded concurrency
+        
+        Documents are split into DOCAI_BATCH_SIZE chunks. While one chunk runs through
+        Layers 2-3, the Document AI operation for the next chunk is already in flight.
+        Cache hits are returned up front and never sent to Document AI.
+        
+        Args:
+            documents: List of (gcs_uri, mime_type) or (gcs_uri, mime_type, content_key) tuples
+                       (list_gcs_documents returns the latter)
+            max_workers: Concurrent Layers 2-3 pipelines (defaults to BATCH_PIPELINE_WORKERS)
+            
+        Yields:
+            Per-document result dictionaries (same shape as process_invoice), in completion order
+        """
+        max_workers = max_workers or config.BATCH_PIPELINE_WORKERS
+        
+        pending = []
+        content_hashes = self._batch_content_keys(documents) if self.extraction_cache else {}
+        for gcs_uri, mime_type, *_ in documents:
+            content_hash = content_hashes.get(gcs_uri)
+            if content_hash:
+                cached = self.extraction_cache.get(content_hash, mime_type, self.gemini_service.prompt_version())
+                if cached:
+                    cached['gcs_uri'] = gcs_uri
+                    yield cached
+                    continue
+            pending.append((gcs_uri, mime_type))
+        
+        if not pending:
+            return
+        
+        chunks = [pending[i:i + config.DOCAI_BATCH_SIZE] for i in range(0, len(pending), config.DOCAI_BATCH_SIZE)]
+        print(f"\n📦 BATCH: {len(pending)} documents in {len(chunks)} Document AI batch(es), {max_workers} pipeline workers")
+        
+        storage_client = self._get_storage_client()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='docai-batch') as docai_pool, \
+                ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-pipeline') as pipeline_pool:
+            next_batch = docai_pool.submit(self.doc_ai_service.batch_process_documents, chunks[0], storage_client)
+            
+            for index, chunk in enumerate(chunks):
+                try:
+                    parsed = next_batch.result()
+                except Exception as e:
+                    print(f"✗ Document AI batch {index + 1}/{len(chunks)} failed: {e}")
+                    parsed = {gcs_uri: e for gcs_uri, _ in chunk}
+                
+                if index + 1 < len(chunks):
+                    next_batch = docai_pool.submit(self.doc_ai_service.batch_process_documents, chunks[index + 1], storage_client)
+                
+                futures = {}
+                for gcs_uri, mime_type in chunk:
+                    document = parsed.get(gcs_uri)
+                    if isinstance(document, Exception):
+                        yield self._mark_document_ai_failed({'gcs_uri': gcs_uri, 'status': 'processing', 'layers': {}}, document)
+                        continue
+                    future = pipeline_pool.submit(
+                        contextvars.copy_context().run,
+                        self.process_invoice,
+                        gcs_uri,
+                        mime_type,
+                        content_hash=content_hashes.get(gcs_uri),
+                        document=document,
+                        deadline=PipelineDeadline()  # Batch runs are not interactive: no latency budget
+                    )
+                    futures[future] = gcs_uri
+                
+                for future in as_completed(futures):
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        yield {'gcs_uri': futures[future], 'status': 'error', 'error': str(e)}
+    
+    def _upload_to_gcs(self, content, blob_name, mime_type):
+        """Upload document bytes to the input bucket and return the gs:// URI"""
+        with metrics.stage_timer('gcs_upload'):
+            bucket = self._get_storage_client().bucket(config.GCS_INPUT_BUCKET)
+            bucket.blob(blob_name).upload_from_string(content, content_type=mime_type)
+        return f"gs://{config.GCS_INPUT_BUCKET}/{blob_name}"
+    
+    def process_local_file(self, file_path, mime_type='application/pdf', progress_callback=None):
+        """
+        Process a local file
+        
+        Files up to DOCAI_INLINE_MAX_MB are sent to Document AI inline as raw bytes while
+        the GCS upload (archival + download endpoint) runs in the background and is joined
+        before returning. Larger files are uploaded first and processed by URI.
         
         Args:
             file_path: Local path to invoice file
             mime_type: MIME type of the file
+            progress_callback: Optional callable(layer, status, **details) for per-layer progress
             
         Returns:
             Dictionary containing validated invoice data
         """
-        from google.cloud import storage
-        from google.oauth2 import service_account
         import os
-        import json
         
+        deadline = PipelineDeadline(config.PIPELINE_DEADLINE_SECONDS)
         try:
-            credentials = None
-            
-            sa_json = os.getenv('GOOGLE_CLOUD_SERVICE_ACCOUNT_JSON')
-            if sa_json:
-                try:
-                    sa_info = json.loads(sa_json)
-                    credentials = service_account.Credentials.from_service_account_info(sa_info)
-                except json.JSONDecodeError:
-                    print("Warning: Failed to parse GOOGLE_CLOUD_SERVICE_ACCOUNT_JSON")
-            elif os.path.exists(config.VERTEX_RUNNER_SA_PATH):
-                credentials = service_account.Credentials.from_service_account_file(
-                    config.VERTEX_RUNNER_SA_PATH
-                )
+            filename = os.path.basename(file_path)
+            file_size = os.path.getsize(file_path)
+            file_type = mime_type.split('/')[-1] if '/' in mime_type else mime_type
             
-            storage_client = storage.Client(
-                project=config.GOOGLE_CLOUD_PROJECT_ID,
-                credentials=credentials
-            )
-            bucket = storage_client.bucket(config.GCS_INPUT_BUCKET)
+            with open(file_path, 'rb') as f:
+                content = f.read()
             
-            filename = os.path.basename(file_path)
-            blob = bucket.blob(f"uploads/{filename}")
+            # Content-addressed cache: identical bytes skip the upload and the whole pipeline
+            content_hash = None
+            if self.extraction_cache:
+                content_hash = ExtractionCache.hash_bytes(content)
+                cached = self.extraction_cache.get(content_hash, mime_type, self.gemini_service.prompt_version())
+                if cached:
+                    print(f"⚡ EXTRACTION CACHE HIT: {filename} ({content_hash[:12]}…) - skipping upload and 3-layer pipeline")
+                    self._notify(progress_callback, 'extraction_cache', 'hit')
+                    cached['file_type'] = file_type
+                    cached['file_size'] = file_size
+                    cached['file_name'] = filename
+                    return cached
             
-            print(f"Uploading {filename} to GCS...")
-            blob.upload_from_filename(file_path, content_type=mime_type)
+            blob_name = f"uploads/{filename}"
+            gcs_uri = f"gs://{config.GCS_INPUT_BUCKET}/{blob_name}"
+            inline = file_size <= config.DOCAI_INLINE_MAX_MB * 1024 * 1024
             
-            gcs_uri = f"gs://{config.GCS_INPUT_BUCKET}/uploads/{filename}"
-            print(f"✓ Uploaded to: {gcs_uri}")
+            print(f"Uploading {filename} to GCS{' (background, Document AI reads bytes inline)' if inline else ''}...")
+            self._notify(progress_callback, 'gcs_upload', 'running')
+            upload_future = self.upload_executor.submit(self._upload_to_gcs, content, blob_name, mime_type)
             
-            # Get file size
-            file_size = os.path.getsize(file_path)
-            file_type = mime_type.split('/')[-1] if '/' in mime_type else mime_type
+            if not inline:
+                upload_future.result()
+                print(f"✓ Uploaded to: {gcs_uri}")
+                self._notify(progress_callback, 'gcs_upload', 'success')
             
             # Process the invoice
-            result = self.process_invoice(gcs_uri, mime_type)
+            result = self.process_invoice(
+                gcs_uri,
+                mime_type,
+                content_hash=content_hash,
+                progress_callback=progress_callback,
+                raw_content=content if inline else None,
+                deadline=deadline
+            )
+            
+            # Join the background upload: the extraction stands even if archival fails
+            if inline:
+                try:
+                    upload_future.result(timeout=config.GCS_UPLOAD_TIMEOUT_SECONDS)
+                    print(f"✓ Uploaded to: {gcs_uri}")
+                    self._notify(progress_callback, 'gcs_upload', 'success')
+                except Exception as e:
+                    print(f"⚠️ Background GCS upload failed for {filename}: {e}")
+                    result.setdefault('layers', {})['gcs_upload'] = {'status': 'error', 'error': str(e)}
+                    self._notify(progress_callback, 'gcs_upload', 'error')
+                    gcs_uri = None
             
             # Add GCS metadata to result
             result['gcs_uri'] = gcs_uri
@@ -0,0 +1,355 @@
+import time
+import json
+import asyncio
+import threading
+import contextvars
+from google.genai import types
+from config import config
+from utils.rate_limiter import concurrency_limits, backoff_delay
+from services.gemini_service import GeminiService, GeminiRateLimitError, StreamedGeminiResponse, VALIDATION_STATIC_PROMPT
+from services.gemini_context_cache import context_caches
+
+
+class BackgroundEventLoop:
+    """
+    One asyncio event loop per process, running on a daemon thread
+    
+    Blocking code (Flask handlers, Gmail imports) submits coroutines here instead of
+    calling asyncio.run for every batch, so the SDK's async HTTP connections stay
+    bound to a single long-lived loop. The caller's context variables (e.g., the
+    Gemini usage run) are carried into the submitted coroutine.
+    """
+    
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+    
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='gemini-async-loop', daemon=True).start()
+            return self._loop
+    
+    def run(self, coroutine, timeout=None):
+        """
+        Run a coroutine on the background loop and wait for its result
+        
+        Raises:
+            RuntimeError: Called from inside a running event loop (await the coroutine instead)
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            coroutine.close()
+            raise RuntimeError("BackgroundEventLoop.run() called from a running event loop; await the coroutine instead")
+        
+        context = contextvars.copy_context()
+        
+        async def in_caller_context():
+            return await asyncio.get_running_loop().create_task(coroutine, context=context)
+        
+        return asyncio.run_coroutine_threadsafe(in_caller_context(), self._ensure_loop()).result(timeout)
+
+
+background_loop = BackgroundEventLoop()
+
+
+class AsyncGeminiService:
+    """
+    asyncio variant of GeminiService built on the SDK's async client (client.aio)
+    
+    Wraps a GeminiService and reuses its clients, prompts, parsers, response cache,
+    rate-limit buckets and usage accounting, so every call keeps the blocking path's
+    semantics (route order, 429 rerouting and cool-down, backoff, fail-safe results)
+    while yielding the event loop during network waits. gather_bounded() / run_bounded()
+    keep many calls in flight from one process, at most GEMINI_ASYNC_CONCURRENCY at a time.
+    """
+    
+    def __init__(self, gemini_service=None, concurrency=None):
+        """
+        Args:
+            gemini_service: GeminiService to share clients and state with (created if omitted)
+            concurrency: Default limit for gather_bounded (default: config.GEMINI_ASYNC_CONCURRENCY)
+        """
+        self.gemini = gemini_service or GeminiService()
+        self.concurrency = max(concurrency or config.GEMINI_ASYNC_CONCURRENCY, 1)
+    
+    async def gather_bounded(self, calls, concurrency=None):
+        """
+        Await many calls with at most `concurrency` running at once
+        
+        Args:
+            calls: Coroutines, or zero-argument callables returning one
+            concurrency: Limit for this batch (default: self.concurrency)
+        
+        Returns:
+            Results in input order (the first exception propagates, as with asyncio.gather)
+        """
+        semaphore = asyncio.Semaphore(max(concurrency or self.concurrency, 1))
+        
+        async def bounded(call):
+            async with semaphore:
+                return await (call() if callable(call) else call)
+        
+        return await asyncio.gather(*(bounded(call) for call in calls))
+    
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine from blocking code on the shared background event loop"""
+        return background_loop.run(coroutine, timeout)
+    
+    def run_bounded(self, calls, concurrency=None, timeout=None):
+        """Blocking wrapper around gather_bounded"""
+        return self.run(self.gather_bounded(calls, concurrency), timeout)
+    
+    async def generate_content_with_fallback(self, model, contents, config, use_cache=True, call_site=None, route_overrides=None, on_text=None):
+        """
+        Async GeminiService._generate_content_with_fallback (same arguments and response cache)
+        
+        Returns:
+            Response from Gemini (primary, extra key or fallback), or a CachedGeminiResponse
+        """
+        cache_key = self.gemini._cache_key_for(model, contents, config, use_cache, call_site)
+        cached = self.gemini._cached_response(cache_key, model, call_site)
+        if cached:
+            return cached
+        
+        response = await self._call_with_fallback(model, contents, config, call_site=call_site, route_overrides=route_overrides, on_text=on_text)
+        if cache_key:
+            self.gemini._store_cached_response(cache_key, model, config, response, call_site)
+        return response
+    
+    async def _acquire_route(self, routes, estimated_tokens, exclude, queue_seconds):
+        """GeminiService._acquire_route, sleeping on the event loop while quota refills"""
+        deadline = time.monotonic() + queue_seconds
+        while True:
+            route, wait_seconds = self.gemini._poll_routes(routes, estimated_tokens, exclude, deadline)
+            if wait_seconds is None:
+                return route
+            await asyncio.sleep(wait_seconds)
+    
+    async def _call_with_fallback(self, model, contents, generation_config, call_site=None, route_overrides=None, on_text=None):
+        """Async GeminiService._call_with_fallback: same routing, rerouting on 429 and backoff"""
+        gemini = self.gemini
+        routes = gemini._routes(model)
+        estimated_tokens = gemini._estimate_tokens(contents, generation_config)
+        last_error = None
+        call_start = time.perf_counter()
+        retries = 0
+        
+        for attempt in range(max(config.GEMINI_MAX_RETRIES, 0) + 1):
+            if attempt:
+                delay = backoff_delay(attempt - 1)
+                print(f"⏳ All Gemini routes rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+                await asyncio.sleep(delay)
+            
+            tried = set()
+            route = await self._acquire_route(routes, estimated_tokens, tried, config.GEMINI_MAX_QUEUE_SECONDS)
+            if route is None:
+                last_error = GeminiRateLimitError(f"Local Gemini quota exhausted for {model} on every route")
+                retries += 1
+                continue
+            
+            while route:
+                route_contents, route_config = (route_overrides or {}).get(route.name, (contents, generation_config))
+                # Same per-process Gemini cap as the blocking pipelines (DEPENDENCY_CONCURRENCY_LIMITS)
+                async with concurrency_limits.async_slot('gemini'):
+                    start = time.perf_counter()
+                    try:
+                        if on_text:
+                            response = await self._stream_content(route, route_contents, route_config, on_text)
+                        else:
+                            response = await route.client.aio.models.generate_content(
+                                model=route.model,
+                                contents=route_contents,
+                                config=route_config
+                            )
+                        gemini._route_succeeded(route, response, call_site, estimated_tokens, start, call_start, retries)
+                        return response
+                    except Exception as e:
+                        if not gemini._route_failed(route, e, call_site, start, call_start, retries):
+                            raise e
+                        last_error = e
+                        retries += 1
+                        tried.add(route.name)
+                    
+                        route = await self._acquire_route(routes, estimated_tokens, tried, 0)
+                        if route:
+                            print(f"🔄 Rerouting to {route.name} ({route.model})...")
+        
+        gemini._routes_exhausted(model, routes, call_site, call_start, retries)
+        raise last_error
+    
+    @staticmethod
+    async def _stream_content(route, contents, generation_config, on_text):
+        """Async GeminiService._stream_content"""
+        text = ''
+        usage = None
+        async for chunk in await route.client.aio.models.generate_content_stream(
+            model=route.model,
+            contents=contents,
+            config=generation_config
+        ):
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            chunk_text = getattr(chunk, 'text', None)
+            if not chunk_text:
+                continue
+            text += chunk_text
+            try:
+                on_text(text)
+            except Exception as e:
+                print(f"⚠️ Streaming callback error (non-critical): {e}")
+        return StreamedGeminiResponse(text, usage)
+    
+    async def validate_invoice(self, gcs_uri, raw_text, extracted_entities, rag_context, currency_context=None, extra_prompt=None, on_partial=None):
+        """Async GeminiService.validate_invoice (same prompt, context cache, retries and result)"""
+        gemini = self.gemini
+        delta_prompt = gemini._validation_delta_prompt(gcs_uri, raw_text, extracted_entities, rag_context, currency_context, extra_prompt)
+        prompt = VALIDATION_STATIC_PROMPT + delta_prompt
+        on_text = gemini._partial_fields_reporter(on_partial) if on_partial and config.GEMINI_STREAMING_ENABLED else None
+        
+        max_retries = 2
+        response = None
+        for attempt in range(max_retries):
+            route_overrides = None
+            try:
+                # Creating the context cache is a blocking SDK call (once per TTL)
+                route_overrides = await asyncio.to_thread(gemini._validation_context_overrides, delta_prompt)
+                
+                response = await self.generate_content_with_fallback(
+                    model=gemini.model_name,
+                    contents=prompt,
+                    config=gemini._validation_config(),
+                    use_cache=attempt == 0,
+                    call_site='validate_invoice',
+                    route_overrides=route_overrides,
+                    on_text=on_text
+                )
+                
+                if not response or not response.text:
+                    if attempt < max_retries - 1:
+                        await asyncio.sleep(backoff_delay(attempt))
+                        continue
+                    return gemini._create_error_response("Empty response from Gemini", ["Gemini returned empty response"])
+                
+                return gemini._parse_validation_response(response.text)
+            
+            except json.JSONDecodeError as e:
+                print(f"JSON decode error (attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                
+                response_text = response.text if response and hasattr(response, 'text') else "No response"
+                print(f"Raw response: {response_text}")
+                return gemini._create_error_response(
+                    "Failed to parse Gemini response after retries",
+                    ["JSON parsing failed"],
+                    response_text[:500] if response_text else "No response"
+                )
+            except Exception as e:
+                print(f"Gemini validation error (attempt {attempt + 1}/{max_retries}): {e}")
+                if route_overrides:
+                    # The cached context may have expired server-side; recreate it on the next attempt
+                    context_caches.invalidate(gemini._key_fingerprint, gemini.model_name, gemini.system_instruction, VALIDATION_STATIC_PROMPT)
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                
+                return gemini._create_error_response(str(e), [f"Gemini error: {str(e)}"])
+    
+    async def gatekeeper_email_filter(self, sender_email, email_subject, email_body_snippet, attachment_filename):
+        """Async GeminiService.gatekeeper_email_filter (fails safe to KEEP)"""
+        gemini = self.gemini
+        try:
+            response = await self.generate_content_with_fallback(
+                model='gemini-2.0-flash-exp',
+                contents=gemini._gatekeeper_prompt(sender_email, email_subject, email_body_snippet, attachment_filename),
+                config=gemini._gatekeeper_config(),
+                call_site='gatekeeper'
+            )
+            return gemini._parse_gatekeeper_response(response.text)
+        except Exception as e:
+            return gemini._gatekeeper_error_verdict(e)
+    
+    async def gatekeeper_email_filter_batch(self, emails, batch_size=None, concurrency=None):
+        """
+        Async GeminiService.gatekeeper_email_filter_batch with the chunk requests in flight together
+        
+        Returns:
+            list: One verdict dict per email, in input order
+        """
+        batch_size = max(1, min(batch_size or config.GATEKEEPER_BATCH_SIZE, 50))
+        chunks = [emails[start:start + batch_size] for start in range(0, len(emails), batch_size)]
+        results = await self.gather_bounded([self._gatekeeper_batch_chunk(chunk) for chunk in chunks], concurrency)
+        return [verdict for chunk_verdicts in results for verdict in chunk_verdicts]
+    
+    async def _gatekeeper_batch_chunk(self, emails):
+        """Async GeminiService._gatekeeper_batch_chunk; unanswered emails are classified individually, concurrently (fail-safe KEEP for the chunk if the request fails)"""
+        gemini = self.gemini
+        if len(emails) == 1:
+            return [await self.gatekeeper_email_filter(**emails[0])]
+        
+        try:
+            response = await self.generate_content_with_fallback(
+                model='gemini-2.0-flash-exp',
+                contents=gemini._gatekeeper_batch_prompt(emails),
+                config=gemini._gatekeeper_batch_config(),
+                call_site='gatekeeper_batch'
+            )
+        except Exception as e:
+            verdict = gemini._gatekeeper_error_verdict(e)
+            return [dict(verdict) for _ in emails]
+        
+        try:
+            answered = gemini._parse_gatekeeper_batch_response(response.text, len(emails))
+        except (TypeError, ValueError) as e:
+            print(f"Gatekeeper batch response could not be parsed: {e}")
+            answered = {}
+        
+        missing = [email_id for email_id in range(len(emails)) if email_id not in answered]
+        if missing:
+            print(f"⚠️ Gatekeeper batch left {len(missing)}/{len(emails)} emails unanswered, classifying them individually")
+            verdicts = await self.gather_bounded([self.gatekeeper_email_filter(**emails[email_id]) for email_id in missing])
+            answered.update(zip(missing, verdicts))
+        
+        return [answered[email_id] for email_id in range(len(emails))]
+    
+    async def classify_link_type(self, url, email_context=""):
+        """Async GeminiService.classify_link_type"""
+        gemini = self.gemini
+        try:
+            response = await self.generate_content_with_fallback(
+                gemini.model_name,
+                gemini._link_type_prompt(url, email_context),
+                gemini._link_type_config(),
+                call_site='link_classification'
+            )
+            return gemini._parse_link_type_response(response.text)
+        except Exception as e:
+            return gemini._link_type_error(e)
+    
+    async def generate_text(self, prompt, temperature=0.1, response_mime_type='application/json', use_cache=True, call_site='generate_text'):
+        """Async GeminiService.generate_text"""
+        response = await self.generate_content_with_fallback(
+            model=self.gemini.model_name,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                temperature=temperature,
+                response_mime_type=response_mime_type
+            ),
+            use_cache=use_cache,
+            call_site=call_site
+        )
+        return response.text or "{}"
+    
+    async def resolve_vendor_identity(self, resolver, document_ai_entities, validated_data, rag_context=None):
+        """Layer 3.5 on the async path (see SemanticVendorResolver.resolve_vendor_identity_async)"""
+        return await resolver.resolve_vendor_identity_async(self, document_ai_entities, validated_data, rag_context)
+    
+    async def supreme_judge_decision(self, matcher, invoice_data, candidates, classifier_verdict=None):
+        """Supreme Judge on the async path (see VendorMatcher.supreme_judge_decision_async)"""
+        return await matcher.supreme_judge_decision_async(self, invoice_data, candidates, classifier_verdict)
+
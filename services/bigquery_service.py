@@ -3,6 +3,7 @@ import json
 from google.cloud import bigquery
 from google.oauth2 import service_account
 from config import config
+from utils.metrics import metrics
 
 class BigQueryService:
     """Service for BigQuery vendor database operations"""
@@ -268,6 +269,44 @@ class BigQueryService:
             print(f"❌ Error searching vendors: {e}")
             return []
     
+    def find_known_vendor_keys(self, name_keys, chunk_size=1000):
+        """
+        Which entity names are already in the vendor directory (exact match after normalization)
+        
+        Args:
+            name_keys: Names normalized with entity_verdict_cache.normalize_entity_name
+                       (casefolded, punctuation removed, whitespace collapsed)
+            chunk_size: Names per query
+        
+        Returns:
+            Set of the given keys that match a vendor's global_name or normalized_name
+        """
+        wanted = sorted({key for key in name_keys if key})
+        known = set()
+        
+        query = f"""
+        SELECT DISTINCT name_key
+        FROM `{self.full_table_id}`,
+        UNNEST([global_name, normalized_name]) AS raw_name,
+        UNNEST([TRIM(REGEXP_REPLACE(REGEXP_REPLACE(LOWER(raw_name), r'[^\\p{{L}}\\p{{N}}_\\s]', ' '), r'\\s+', ' '))]) AS name_key
+        WHERE name_key IN UNNEST(@name_keys)
+        """
+        
+        for start in range(0, len(wanted), chunk_size):
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ArrayQueryParameter("name_keys", "STRING", wanted[start:start + chunk_size]),
+                ]
+            )
+            try:
+                for row in self.client.query(query, job_config=job_config).result():
+                    known.add(row.name_key)
+            except Exception as e:
+                print(f"⚠️ Vendor directory lookup error (non-critical): {e}")
+                break
+        
+        return known
+    
     def get_all_vendors(self, limit=20, offset=0, search_term=None):
         """
         Get all vendors with pagination and optional search
@@ -538,7 +577,10 @@ class BigQueryService:
             }
             
             # Insert the row
-            errors = self.client.insert_rows_json(invoices_table_id, [row])
+            with metrics.stage_timer('bigquery_insert') as timer:
+                errors = self.client.insert_rows_json(invoices_table_id, [row])
+                if errors:
+                    timer.outcome = 'error'
             
             if errors:
                 print(f"❌ Error inserting invoice: {errors}")
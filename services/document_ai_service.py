@@ -1,8 +1,10 @@
 import os
 import json
+import uuid
 from google.cloud import documentai_v1 as documentai
 from google.oauth2 import service_account
 from config import config
+from utils.rate_limiter import concurrency_limits
 
 class DocumentAIService:
     """Service for extracting structured data from invoices using Document AI"""
@@ -52,11 +54,132 @@ class DocumentAIService:
                 gcs_document=gcs_document
             )
             
-            result = self.client.process_document(request=request)
+            with concurrency_limits.slot('document_ai'):
+                result = self.client.process_document(request=request)
             return result.document
         except Exception as e:
             raise RuntimeError(f"Document AI processing failed: {str(e)}") from e
     
+    def process_document_bytes(self, content, mime_type='application/pdf'):
+        """
+        Process an invoice sent inline as raw bytes (no GCS round-trip)
+        
+        Args:
+            content: Document bytes
+            mime_type: MIME type of the document
+            
+        Returns:
+            Processed document with extracted entities
+        """
+        if not config.DOCAI_PROCESSOR_NAME:
+            raise ValueError("DOCAI_PROCESSOR_NAME not configured. Check DOCAI_PROCESSOR_ID and DOCAI_LOCATION.")
+        
+        try:
+            raw_document = documentai.RawDocument(
+                content=content,
+                mime_type=mime_type
+            )
+            
+            request = documentai.ProcessRequest(
+                name=config.DOCAI_PROCESSOR_NAME,
+                raw_document=raw_document
+            )
+            
+            with concurrency_limits.slot('document_ai'):
+                result = self.client.process_document(request=request)
+            return result.document
+        except Exception as e:
+            raise RuntimeError(f"Document AI processing failed: {str(e)}") from e
+    
+    def batch_process_documents(self, documents, storage_client, output_uri=None, timeout=None):
+        """
+        Process many invoices in one Document AI batch (long-running operation)
+        
+        Document AI writes one JSON result (possibly sharded) per input document
+        under the output prefix; the shards are read back, merged and deleted.
+        
+        Args:
+            documents: List of (gcs_uri, mime_type) tuples
+            storage_client: google.cloud.storage.Client used to read the output JSON
+            output_uri: GCS prefix for batch output (defaults to DOCAI_BATCH_OUTPUT_URI)
+            timeout: Seconds to wait for the operation (defaults to DOCAI_BATCH_TIMEOUT_SECONDS)
+            
+        Returns:
+            Dictionary mapping input gcs_uri to a Document, or to an Exception if that
+            document failed inside the batch
+        """
+        if not config.DOCAI_PROCESSOR_NAME:
+            raise ValueError("DOCAI_PROCESSOR_NAME not configured. Check DOCAI_PROCESSOR_ID and DOCAI_LOCATION.")
+        
+        output_uri = f"{(output_uri or config.DOCAI_BATCH_OUTPUT_URI).rstrip('/')}/{uuid.uuid4().hex}/"
+        timeout = timeout or config.DOCAI_BATCH_TIMEOUT_SECONDS
+        
+        try:
+            input_config = documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(documents=[
+                    documentai.GcsDocument(gcs_uri=gcs_uri, mime_type=mime_type)
+                    for gcs_uri, mime_type in documents
+                ])
+            )
+            output_config = documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(gcs_uri=output_uri)
+            )
+            request = documentai.BatchProcessRequest(
+                name=config.DOCAI_PROCESSOR_NAME,
+                input_documents=input_config,
+                document_output_config=output_config
+            )
+            
+            operation = self.client.batch_process_documents(request=request)
+            print(f"⏳ Document AI batch started: {operation.operation.name} ({len(documents)} documents)")
+            operation.result(timeout=timeout)
+            metadata = documentai.BatchProcessMetadata(operation.metadata)
+        except Exception as e:
+            raise RuntimeError(f"Document AI batch processing failed: {str(e)}") from e
+        
+        results = {}
+        for status in metadata.individual_process_statuses:
+            input_uri = status.input_gcs_source
+            if status.status.code != 0:
+                results[input_uri] = RuntimeError(f"Document AI processing failed: {status.status.message}")
+                continue
+            try:
+                results[input_uri] = self._read_batch_output(storage_client, status.output_gcs_destination)
+            except Exception as e:
+                results[input_uri] = RuntimeError(f"Document AI output read failed: {str(e)}")
+        
+        for gcs_uri, _ in documents:
+            results.setdefault(gcs_uri, RuntimeError("Document AI batch returned no status for this document"))
+        
+        return results
+    
+    def _read_batch_output(self, storage_client, output_gcs_uri):
+        """Read, merge and delete the JSON shards Document AI wrote for one input document"""
+        bucket_name, _, prefix = output_gcs_uri[len('gs://'):].partition('/')
+        blobs = [
+            blob for blob in storage_client.list_blobs(bucket_name, prefix=prefix)
+            if blob.name.endswith('.json')
+        ]
+        if not blobs:
+            raise RuntimeError(f"No output found at {output_gcs_uri}")
+        
+        shards = []
+        for blob in blobs:
+            shards.append(documentai.Document.from_json(blob.download_as_bytes(), ignore_unknown_fields=True))
+            try:
+                blob.delete()
+            except Exception as e:
+                print(f"⚠️ Could not delete batch output {blob.name} (non-critical): {e}")
+        
+        shards.sort(key=lambda shard: shard.shard_info.shard_index)
+        document = shards[0]
+        for shard in shards[1:]:
+            document.text += shard.text
+            document.pages.extend(shard.pages)
+            document.entities.extend(shard.entities)
+        
+        return document
+    
     def extract_entities(self, document):
         """
         Extract structured entities from Document AI result
@@ -0,0 +1,217 @@
+import os
+import re
+import math
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import config
+from utils.metrics import metrics
+
+KEEP = 'keep'
+KILL = 'kill'
+
+TOKEN_PATTERN = re.compile(r'[^\W\d_]{2,}', re.UNICODE)
+DOMAIN_PATTERN = re.compile(r'@([\w.-]+)')
+
+
+class EmailPrefilter:
+    """
+    Local naive-Bayes pre-filter in front of the AI Gatekeeper
+    
+    Learns from past Gatekeeper verdicts: sender-domain reputation plus a token
+    model over subject, snippet and attachment name. Confident cases are decided
+    locally; only the uncertain band goes to Gemini. Thresholds are asymmetric
+    ("never miss money"): KEEP needs a high keep probability, KILL needs a far
+    stricter one AND a sender domain with a clean junk-only history.
+    Counts live in SQLite so every gunicorn worker learns from every scan; a small
+    audit sample of confident cases still goes to the Gatekeeper so the model
+    keeps learning once it decides most senders itself.
+    """
+    
+    def __init__(self, db_path=None, min_training=None, keep_threshold=None, kill_threshold=None,
+                 kill_min_domain_samples=None, audit_rate=None):
+        self.db_path = db_path or config.EMAIL_PREFILTER_DB_PATH
+        self.min_training = min_training or config.EMAIL_PREFILTER_MIN_TRAINING
+        self.keep_threshold = keep_threshold or config.EMAIL_PREFILTER_KEEP_THRESHOLD
+        self.kill_threshold = kill_threshold or config.EMAIL_PREFILTER_KILL_THRESHOLD
+        self.kill_min_domain_samples = kill_min_domain_samples or config.EMAIL_PREFILTER_KILL_MIN_DOMAIN_SAMPLES
+        self.audit_rate = config.EMAIL_PREFILTER_AUDIT_RATE if audit_rate is None else audit_rate
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS prefilter_features (
+                    feature TEXT PRIMARY KEY,
+                    keep_count INTEGER NOT NULL DEFAULT 0,
+                    kill_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS prefilter_totals (
+                    label TEXT PRIMARY KEY,
+                    documents INTEGER NOT NULL DEFAULT 0,
+                    features INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def sender_domain(sender):
+        match = DOMAIN_PATTERN.search(sender or '')
+        return match.group(1).lower().strip('.') if match else None
+    
+    @classmethod
+    def features(cls, metadata):
+        """
+        Feature set for one email: sender domain, field-prefixed word tokens and attachment type
+        
+        Args:
+            metadata: Email metadata dict with subject, from, snippet, attachments
+        
+        Returns:
+            (domain, set of feature strings)
+        """
+        domain = cls.sender_domain(metadata.get('from', ''))
+        features = {f"d:{domain}" if domain else 'd:?'}
+        
+        for prefix, text in (('s', metadata.get('subject', '')), ('b', metadata.get('snippet', ''))):
+            features.update(f"{prefix}:{token}" for token in TOKEN_PATTERN.findall((text or '').lower()))
+        
+        attachments = metadata.get('attachments', [])
+        if attachments:
+            name = attachments[0].lower()
+            features.update(f"a:{token}" for token in TOKEN_PATTERN.findall(name))
+            features.add(f"ext:{name.rsplit('.', 1)[-1]}" if '.' in name else 'ext:?')
+        else:
+            features.add('ext:none')
+        
+        return domain, features
+    
+    def classify_many(self, metadata_list):
+        """
+        Decide what can be decided locally
+        
+        Args:
+            metadata_list: List of email metadata dicts
+        
+        Returns:
+            List of (decision, keep_probability, reasoning) with decision
+            'keep', 'kill' or None (uncertain → ask the Gatekeeper)
+        """
+        extracted = [self.features(metadata) for metadata in metadata_list]
+        
+        try:
+            with self._connect() as conn:
+                totals = {
+                    label: (documents, features)
+                    for label, documents, features in conn.execute("SELECT label, documents, features FROM prefilter_totals")
+                }
+                vocabulary = conn.execute("SELECT COUNT(*) FROM prefilter_features").fetchone()[0]
+                
+                counts = {}
+                wanted = sorted(set().union(*(features for _, features in extracted))) if extracted else []
+                for start in range(0, len(wanted), 500):
+                    chunk = wanted[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    for feature, keep_count, kill_count in conn.execute(
+                        f"SELECT feature, keep_count, kill_count FROM prefilter_features WHERE feature IN ({placeholders})",
+                        chunk
+                    ):
+                        counts[feature] = (keep_count, kill_count)
+        except Exception as e:
+            print(f"⚠️ Email pre-filter read error (non-critical): {e}")
+            return [(None, None, 'Pre-filter unavailable') for _ in metadata_list]
+        
+        keep_docs, keep_features = totals.get(KEEP, (0, 0))
+        kill_docs, kill_features = totals.get(KILL, (0, 0))
+        if keep_docs + kill_docs < self.min_training:
+            return [(None, None, 'Pre-filter still learning') for _ in metadata_list]
+        
+        decisions = []
+        for domain, features in extracted:
+            # Multinomial naive Bayes with Laplace smoothing, computed as log-odds keep vs kill
+            log_odds = math.log((keep_docs + 1) / (kill_docs + 1))
+            for feature in features:
+                keep_count, kill_count = counts.get(feature, (0, 0))
+                log_odds += math.log((keep_count + 1) / (keep_features + vocabulary + 1))
+                log_odds -= math.log((kill_count + 1) / (kill_features + vocabulary + 1))
+            keep_probability = 1.0 / (1.0 + math.exp(-max(min(log_odds, 50.0), -50.0)))
+            
+            domain_keep, domain_kill = counts.get(f"d:{domain}" if domain else 'd:?', (0, 0))
+            
+            if random.random() < self.audit_rate:
+                decisions.append((None, keep_probability, f"audit sample, p(keep)={keep_probability:.3f}"))
+            elif keep_probability >= self.keep_threshold:
+                decisions.append((KEEP, keep_probability, f"sender {domain or 'unknown'} ({domain_keep} kept / {domain_kill} rejected before), p(keep)={keep_probability:.3f}"))
+            elif (keep_probability <= self.kill_threshold and domain and domain_keep == 0
+                  and domain_kill >= self.kill_min_domain_samples):
+                decisions.append((KILL, keep_probability, f"sender {domain} rejected {domain_kill} times and never kept, p(keep)={keep_probability:.3f}"))
+            else:
+                decisions.append((None, keep_probability, f"uncertain, p(keep)={keep_probability:.3f}"))
+        
+        for decision, _, _ in decisions:
+            metrics.increment('email_prefilter_decisions_total', decision=decision or 'uncertain')
+        
+        return decisions
+    
+    def learn_many(self, labelled):
+        """
+        Update counts from Gatekeeper verdicts
+        
+        Args:
+            labelled: List of (metadata, is_kept) pairs; only AI verdicts should be
+                      passed, never the pre-filter's own decisions
+        
+        Returns:
+            True if stored, False otherwise
+        """
+        if not labelled:
+            return True
+        
+        deltas = {}
+        documents = {KEEP: 0, KILL: 0}
+        feature_totals = {KEEP: 0, KILL: 0}
+        for metadata, is_kept in labelled:
+            label = KEEP if is_kept else KILL
+            _, features = self.features(metadata)
+            documents[label] += 1
+            feature_totals[label] += len(features)
+            for feature in features:
+                keep_delta, kill_delta = deltas.get(feature, (0, 0))
+                deltas[feature] = (keep_delta + 1, kill_delta) if is_kept else (keep_delta, kill_delta + 1)
+        
+        try:
+            with self._lock, self._connect() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO prefilter_features (feature, keep_count, kill_count) VALUES (?, ?, ?)
+                    ON CONFLICT(feature) DO UPDATE SET
+                        keep_count = keep_count + excluded.keep_count,
+                        kill_count = kill_count + excluded.kill_count
+                    """,
+                    [(feature, keep_delta, kill_delta) for feature, (keep_delta, kill_delta) in deltas.items()]
+                )
+                conn.executemany(
+                    """
+                    INSERT INTO prefilter_totals (label, documents, features) VALUES (?, ?, ?)
+                    ON CONFLICT(label) DO UPDATE SET
+                        documents = documents + excluded.documents,
+                        features = features + excluded.features
+                    """,
+                    [(label, documents[label], feature_totals[label]) for label in (KEEP, KILL)]
+                )
+            return True
+        except Exception as e:
+            print(f"⚠️ Email pre-filter write error (non-critical): {e}")
+            return False
@@ -0,0 +1,221 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import config
+
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]', re.UNICODE)
+
+# Where a cached verdict came from
+SOURCE_GEMINI = 'gemini'
+SOURCE_REJECTED_ENTITY = 'rejected_entity'
+SOURCE_VENDOR_DIRECTORY = 'vendor_directory'
+
+
+def normalize_entity_name(name):
+    """Cache key for an entity name: casefolded, punctuation removed, whitespace collapsed"""
+    return ' '.join(PUNCTUATION_PATTERN.sub(' ', (name or '').casefold()).split())
+
+
+class EntityVerdictCache:
+    """
+    Persistent entity classification verdicts keyed by normalized entity name
+    
+    Stores the SemanticEntityClassifier verdicts (Gemini answers, names already in
+    the vendor directory, and rejected entities preloaded from the knowledge base)
+    so recurring names on /upload and CSV imports skip the Gemini call. Entries
+    expire after ENTITY_CACHE_TTL_DAYS. Lives in SQLite so every gunicorn worker
+    shares the same verdicts.
+    """
+    
+    def __init__(self, db_path=None, ttl_days=None):
+        self.db_path = db_path or config.ENTITY_CACHE_DB_PATH
+        self.ttl_seconds = (ttl_days or config.ENTITY_CACHE_TTL_DAYS) * 86400
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entity_verdicts (
+                    name_key TEXT PRIMARY KEY,
+                    entity_name TEXT NOT NULL,
+                    entity_type TEXT NOT NULL,
+                    confidence TEXT NOT NULL,
+                    reasoning TEXT NOT NULL,
+                    is_valid_vendor INTEGER NOT NULL,
+                    source TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entity_cache_meta (
+                    key TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                )
+            """)
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def get_many(self, entity_names):
+        """
+        Look up unexpired verdicts
+        
+        Args:
+            entity_names: Entity names as they appear on the invoice / CSV row
+        
+        Returns:
+            dict of {entity_name: verdict} for the names with a cached verdict
+        """
+        keys = {}
+        for name in entity_names:
+            key = normalize_entity_name(name)
+            if key:
+                keys.setdefault(key, []).append(name)
+        if not keys:
+            return {}
+        
+        cutoff = time.time() - self.ttl_seconds
+        found = {}
+        try:
+            with self._connect() as conn:
+                wanted = sorted(keys)
+                for start in range(0, len(wanted), 500):
+                    chunk = wanted[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = conn.execute(
+                        f"""
+                        SELECT name_key, entity_type, confidence, reasoning, is_valid_vendor, source
+                        FROM entity_verdicts WHERE created_at >= ? AND name_key IN ({placeholders})
+                        """,
+                        [cutoff] + chunk
+                    )
+                    for name_key, entity_type, confidence, reasoning, is_valid_vendor, source in rows:
+                        for name in keys[name_key]:
+                            found[name] = {
+                                'entity_type': entity_type,
+                                'confidence': confidence,
+                                'reasoning': reasoning,
+                                'is_valid_vendor': bool(is_valid_vendor),
+                                'source': source
+                            }
+        except Exception as e:
+            print(f"⚠️ Entity verdict cache read error (non-critical): {e}")
+        return found
+    
+    def get(self, entity_name):
+        """Cached verdict for one name, or None"""
+        return self.get_many([entity_name]).get(entity_name)
+    
+    def put_many(self, verdicts, source=SOURCE_GEMINI):
+        """
+        Store verdicts, replacing older ones for the same normalized name
+        
+        Args:
+            verdicts: List of (entity_name, verdict dict) pairs
+            source: SOURCE_GEMINI or SOURCE_VENDOR_DIRECTORY
+        """
+        now = time.time()
+        rows = [
+            (normalize_entity_name(name), name, verdict['entity_type'], verdict['confidence'],
+             verdict['reasoning'], 1 if verdict['is_valid_vendor'] else 0, source, now)
+            for name, verdict in verdicts
+            if normalize_entity_name(name)
+        ]
+        if not rows:
+            return
+        
+        try:
+            with self._lock, self._connect() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO entity_verdicts
+                        (name_key, entity_name, entity_type, confidence, reasoning, is_valid_vendor, source, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(name_key) DO UPDATE SET
+                        entity_name = excluded.entity_name,
+                        entity_type = excluded.entity_type,
+                        confidence = excluded.confidence,
+                        reasoning = excluded.reasoning,
+                        is_valid_vendor = excluded.is_valid_vendor,
+                        source = excluded.source,
+                        created_at = excluded.created_at
+                    """,
+                    rows
+                )
+                conn.execute("DELETE FROM entity_verdicts WHERE created_at < ?", (now - self.ttl_seconds,))
+        except Exception as e:
+            print(f"⚠️ Entity verdict cache write error (non-critical): {e}")
+    
+    def put(self, entity_name, verdict, source=SOURCE_GEMINI):
+        self.put_many([(entity_name, verdict)], source=source)
+    
+    def preload_due(self, interval_hours=None):
+        """True when the rejected-entity preload has not run within interval_hours"""
+        interval_seconds = (interval_hours or config.ENTITY_CACHE_PRELOAD_INTERVAL_HOURS) * 3600
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT value FROM entity_cache_meta WHERE key = 'rejected_preloaded_at'").fetchone()
+            return row is None or time.time() - row[0] >= interval_seconds
+        except Exception as e:
+            print(f"⚠️ Entity verdict cache read error (non-critical): {e}")
+            return False
+    
+    def preload_rejected(self, rejected_entities):
+        """
+        Seed the cache with entities previously rejected via store_rejected_entity
+        
+        Rejections only replace cached rows that are themselves rejections or have
+        expired, so a newer Gemini verdict for the same name is kept.
+        
+        Args:
+            rejected_entities: List of dicts with entity_name, entity_type, rejection_reason
+        
+        Returns:
+            Number of rejected entities stored
+        """
+        now = time.time()
+        rows = [
+            (normalize_entity_name(entity['entity_name']), entity['entity_name'],
+             entity.get('entity_type') or 'UNKNOWN', 'HIGH',
+             entity.get('rejection_reason') or 'Previously rejected', 0, SOURCE_REJECTED_ENTITY, now)
+            for entity in rejected_entities
+            if normalize_entity_name(entity.get('entity_name'))
+        ]
+        
+        try:
+            with self._lock, self._connect() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO entity_verdicts
+                        (name_key, entity_name, entity_type, confidence, reasoning, is_valid_vendor, source, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(name_key) DO UPDATE SET
+                        entity_name = excluded.entity_name,
+                        entity_type = excluded.entity_type,
+                        confidence = excluded.confidence,
+                        reasoning = excluded.reasoning,
+                        is_valid_vendor = excluded.is_valid_vendor,
+                        source = excluded.source,
+                        created_at = excluded.created_at
+                    WHERE entity_verdicts.source = excluded.source OR entity_verdicts.created_at < ?
+                    """,
+                    [row + (now - self.ttl_seconds,) for row in rows]
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO entity_cache_meta (key, value) VALUES ('rejected_preloaded_at', ?)",
+                    (now,)
+                )
+            return len(rows)
+        except Exception as e:
+            print(f"⚠️ Entity verdict cache preload error (non-critical): {e}")
+            return 0
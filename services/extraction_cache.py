@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from config import config
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of completed invoice extractions
+    
+    Keyed by SHA-256 of the document bytes (GCS objects: their stored MD5/CRC32C)
+    + MIME type + a version key tied to the Gemini prompt/schema, so re-uploads and Gmail re-scans of the same file skip
+    Document AI, Vertex Search and Gemini entirely. Backed by SQLite with
+    age-based expiry and size-based LRU eviction.
+    """
+    
+    def __init__(self, db_path=None, max_age_seconds=None, max_bytes=None):
+        self.db_path = db_path or config.EXTRACTION_CACHE_PATH
+        self.max_age_seconds = max_age_seconds or config.EXTRACTION_CACHE_MAX_AGE_DAYS * 86400
+        self.max_bytes = max_bytes or config.EXTRACTION_CACHE_MAX_MB * 1024 * 1024
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS extraction_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    result_json TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_lru ON extraction_cache (last_accessed)")
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def hash_bytes(data):
+        """Return the SHA-256 hex digest of document bytes"""
+        return hashlib.sha256(data).hexdigest()
+    
+    @staticmethod
+    def hash_file(file_path):
+        """Return the SHA-256 hex digest of a local file (streamed in 1MB chunks)"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def checksum_key(md5_hash, crc32c, size):
+        """
+        Content key for a GCS object from the checksums GCS already stores (no download)
+        
+        Objects carry an MD5 unless they are composite; those fall back to CRC32C plus size.
+        
+        Returns:
+            Key string, or None when the object has no checksum
+        """
+        if md5_hash:
+            return f"gcs-md5:{md5_hash}"
+        if crc32c:
+            return f"gcs-crc32c:{crc32c}:{size}"
+        return None
+    
+    @staticmethod
+    def _cache_key(content_hash, mime_type, version):
+        return f"{content_hash}:{mime_type}:{version}"
+    
+    def get(self, content_hash, mime_type, version):
+        """
+        Look up a cached extraction result
+        
+        Args:
+            content_hash: SHA-256 of the document bytes, or checksum_key() for a GCS object
+            mime_type: MIME type of the document
+            version: Prompt/schema version key
+        
+        Returns:
+            Cached result dictionary, or None on miss/expiry
+        """
+        key = self._cache_key(content_hash, mime_type, version)
+        now = time.time()
+        
+        try:
+            with self._lock, self._connect() as conn:
+                row = conn.execute(
+                    "SELECT result_json, created_at FROM extraction_cache WHERE cache_key = ?",
+                    (key,)
+                ).fetchone()
+                
+                if not row:
+                    return None
+                
+                result_json, created_at = row
+                if now - created_at > self.max_age_seconds:
+                    conn.execute("DELETE FROM extraction_cache WHERE cache_key = ?", (key,))
+                    return None
+                
+                conn.execute(
+                    "UPDATE extraction_cache SET last_accessed = ? WHERE cache_key = ?",
+                    (now, key)
+                )
+            
+            result = json.loads(result_json)
+            result['cache'] = {
+                'hit': True,
+                'content_hash': content_hash,
+                'cached_at': created_at,
+                'version': version
+            }
+            return result
+        except Exception as e:
+            print(f"⚠️ Extraction cache read error (non-critical): {e}")
+            return None
+    
+    def put(self, content_hash, mime_type, version, result):
+        """
+        Store a completed extraction result and apply eviction
+        
+        Args:
+            content_hash: SHA-256 of the document bytes, or checksum_key() for a GCS object
+            mime_type: MIME type of the document
+            version: Prompt/schema version key
+            result: Pipeline result dictionary (must be JSON-serializable)
+        
+        Returns:
+            True if stored, False otherwise
+        """
+        key = self._cache_key(content_hash, mime_type, version)
+        now = time.time()
+        
+        try:
+            result_json = json.dumps(result, default=str)
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO extraction_cache
+                        (cache_key, content_hash, version, result_json, size_bytes, created_at, last_accessed)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, content_hash, version, result_json, len(result_json), now, now)
+                )
+                self._evict(conn, now)
+            return True
+        except Exception as e:
+            print(f"⚠️ Extraction cache write error (non-critical): {e}")
+            return False
+    
+    def _evict(self, conn, now):
+        """Drop expired entries, then least-recently-used entries until under the size cap"""
+        conn.execute(
+            "DELETE FROM extraction_cache WHERE created_at < ?",
+            (now - self.max_age_seconds,)
+        )
+        
+        total_bytes = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM extraction_cache").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        
+        rows = conn.execute(
+            "SELECT cache_key, size_bytes FROM extraction_cache ORDER BY last_accessed ASC"
+        ).fetchall()
+        evicted = []
+        for cache_key, size_bytes in rows:
+            if total_bytes <= self.max_bytes:
+                break
+            evicted.append((cache_key,))
+            total_bytes -= size_bytes
+        
+        conn.executemany("DELETE FROM extraction_cache WHERE cache_key = ?", evicted)
+        if evicted:
+            print(f"🧹 Extraction cache evicted {len(evicted)} entries (size cap)")
@@ -0,0 +1,92 @@
+import time
+import hashlib
+import threading
+from google.genai import types
+from config import config
+
+
+class GeminiContextCache:
+    """
+    Process-wide registry of Gemini cached-content resources
+    
+    A static prompt prefix (plus system instruction) is registered once per API
+    key and model with client.caches.create and referenced by name from later
+    generate_content calls, so only the per-request delta is sent. Entries are
+    recreated shortly before their TTL runs out; when creation fails (model
+    without caching support, prefix under the minimum cacheable size) callers
+    get None and send the prompt inline until GEMINI_CONTEXT_CACHE_RETRY_SECONDS
+    have passed. The create call runs outside the lock and only one caller per
+    prefix makes it; the others keep using the previous cache (still valid for
+    about a minute) or send the prompt inline meanwhile.
+    """
+    
+    def __init__(self, ttl_seconds=None, retry_seconds=None):
+        self.ttl_seconds = ttl_seconds or config.GEMINI_CONTEXT_CACHE_TTL_SECONDS
+        self.retry_seconds = retry_seconds or config.GEMINI_CONTEXT_CACHE_RETRY_SECONDS
+        self._entries = {}
+        self._creating = set()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(key_fingerprint, model, system_instruction, static_prompt):
+        digest = hashlib.sha256(f"{system_instruction}\n{static_prompt}".encode('utf-8')).hexdigest()[:16]
+        return (key_fingerprint, model, digest)
+    
+    def get(self, client, key_fingerprint, model, system_instruction, static_prompt, display_name):
+        """
+        Return the cached-content name for this prefix, creating it if needed
+        
+        Args:
+            client: genai.Client that owns the cache (caches are per API key)
+            key_fingerprint: Fingerprint of that client's API key
+            model: Model the cache is created for
+            system_instruction: System instruction stored with the cache
+            static_prompt: Unchanging prompt prefix
+            display_name: Human-readable cache name
+        
+        Returns:
+            Cached content name, or None to send the prompt inline
+        """
+        key = self._key(key_fingerprint, model, system_instruction, static_prompt)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now < entry['refresh_at']:
+                return entry['name']
+            if key in self._creating:
+                # Another caller is creating it; the previous cache is refreshed early, so it still works
+                return entry['name'] if entry else None
+            self._creating.add(key)
+            
+        entry = None
+        try:
+            cache = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=display_name,
+                    system_instruction=system_instruction,
+                    contents=[static_prompt],
+                    ttl=f"{int(self.ttl_seconds)}s"
+                )
+            )
+            # Refresh a minute early so in-flight requests never reference an expired cache
+            entry = {'name': cache.name, 'refresh_at': now + max(self.ttl_seconds - 60, 1)}
+            print(f"🗄️ Gemini context cache created: {cache.name} ({display_name})")
+        except Exception as e:
+            entry = {'name': None, 'refresh_at': now + self.retry_seconds}
+            print(f"⚠️ Gemini context cache unavailable, sending prompt inline (non-critical): {e}")
+        finally:
+            with self._lock:
+                if entry:
+                    self._entries[key] = entry
+                self._creating.discard(key)
+        return entry['name']
+    
+    def invalidate(self, key_fingerprint, model, system_instruction, static_prompt):
+        """Forget a cache that a request rejected (expired or deleted server-side)"""
+        with self._lock:
+            self._entries.pop(self._key(key_fingerprint, model, system_instruction, static_prompt), None)
+
+
+context_caches = GeminiContextCache()
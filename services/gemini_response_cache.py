@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from config import config
+
+
+class CachedGeminiResponse:
+    """Stand-in for a generate_content response served from the cache (callers only read .text)"""
+    
+    def __init__(self, text, created_at):
+        self.text = text
+        self.cached = True
+        self.cached_at = created_at
+        self.usage_metadata = None
+
+
+class GeminiResponseCache:
+    """
+    Persistent cache of Gemini generate_content responses
+    
+    Keyed by SHA-256 of the model name + prompt contents + generation config, so
+    identical low-temperature prompts (gatekeeper checks on recurring senders, link
+    classification, entity classification, vendor judging) are answered locally
+    instead of re-sent. Backed by SQLite (shared by all gunicorn workers) with
+    age-based expiry and entry-count LRU eviction.
+    """
+    
+    def __init__(self, db_path=None, max_age_seconds=None, max_entries=None):
+        self.db_path = db_path or config.GEMINI_CACHE_PATH
+        self.max_age_seconds = max_age_seconds or config.GEMINI_CACHE_TTL_HOURS * 3600
+        self.max_entries = max_entries or config.GEMINI_CACHE_MAX_ENTRIES
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS gemini_response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    call_site TEXT,
+                    response_text TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_gemini_response_cache_lru ON gemini_response_cache (last_accessed)")
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _json_default(value):
+        # google.genai types are pydantic models; anything else makes the call uncacheable
+        if hasattr(value, 'model_dump'):
+            return value.model_dump(mode='json', exclude_none=True)
+        raise TypeError(f"Unhashable prompt component: {type(value).__name__}")
+    
+    @classmethod
+    def cache_key(cls, model, contents, generation_config):
+        """
+        Build the cache key for one generate_content call
+        
+        Args:
+            model: Requested model name
+            contents: Prompt contents (string, list or genai types)
+            generation_config: GenerateContentConfig or plain dict
+        
+        Returns:
+            SHA-256 hex digest, or None if the call cannot be fingerprinted
+        """
+        try:
+            payload = json.dumps(
+                [model, contents, generation_config],
+                sort_keys=True,
+                ensure_ascii=False,
+                default=cls._json_default
+            )
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """
+        Look up a cached response
+        
+        Returns:
+            CachedGeminiResponse, or None on miss/expiry
+        """
+        now = time.time()
+        
+        try:
+            with self._lock, self._connect() as conn:
+                row = conn.execute(
+                    "SELECT response_text, created_at FROM gemini_response_cache WHERE cache_key = ?",
+                    (key,)
+                ).fetchone()
+                
+                if row and now - row[1] > self.max_age_seconds:
+                    conn.execute("DELETE FROM gemini_response_cache WHERE cache_key = ?", (key,))
+                    row = None
+                
+                if not row:
+                    return None
+                
+                conn.execute(
+                    "UPDATE gemini_response_cache SET last_accessed = ?, hits = hits + 1 WHERE cache_key = ?",
+                    (now, key)
+                )
+            
+            return CachedGeminiResponse(row[0], row[1])
+        except Exception as e:
+            print(f"⚠️ Gemini response cache read error (non-critical): {e}")
+            return None
+    
+    def put(self, key, model, response_text, call_site=None):
+        """
+        Store a response text and apply eviction
+        
+        Returns:
+            True if stored, False otherwise
+        """
+        now = time.time()
+        
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO gemini_response_cache
+                        (cache_key, model, call_site, response_text, created_at, last_accessed, hits)
+                    VALUES (?, ?, ?, ?, ?, ?, 0)
+                    """,
+                    (key, model, call_site, response_text, now, now)
+                )
+                self._evict(conn, now)
+            return True
+        except Exception as e:
+            print(f"⚠️ Gemini response cache write error (non-critical): {e}")
+            return False
+    
+    def _evict(self, conn, now):
+        """Drop expired entries, then least-recently-used entries until under the entry cap"""
+        conn.execute(
+            "DELETE FROM gemini_response_cache WHERE created_at < ?",
+            (now - self.max_age_seconds,)
+        )
+        
+        count = conn.execute("SELECT COUNT(*) FROM gemini_response_cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        
+        conn.execute(
+            """
+            DELETE FROM gemini_response_cache WHERE cache_key IN (
+                SELECT cache_key FROM gemini_response_cache ORDER BY last_accessed ASC LIMIT ?
+            )
+            """,
+            (overflow,)
+        )
+        print(f"🧹 Gemini response cache evicted {overflow} entries (entry cap)")
@@ -1,147 +1,43 @@
 import os
 import json
+import time
+import hashlib
+from collections import namedtuple
 from google import genai
 from google.genai import types
 from config import config
+from utils.metrics import metrics
+from utils.rate_limiter import rate_limiters, concurrency_limits, backoff_delay
+from utils.gemini_usage import gemini_usage
+from utils.partial_json import StreamingFieldParser
+from services.gemini_response_cache import GeminiResponseCache
+from services.gemini_context_cache import context_caches
 
-class GeminiService:
-    """Service for semantic validation and reasoning using Gemini 1.5 Pro with automatic fallback"""
-    
-    def __init__(self):
-        # Primary client: User's AI Studio API key
-        api_key = config.GOOGLE_GEMINI_API_KEY or os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY or GOOGLE_GEMINI_API_KEY is required")
-        
-        self.client = genai.Client(api_key=api_key)
-        
-        # Fallback client: Replit AI Integrations (billed to Replit credits)
-        self.fallback_client = None
-        replit_api_key = os.getenv('AI_INTEGRATIONS_GEMINI_API_KEY')
-        replit_base_url = os.getenv('AI_INTEGRATIONS_GEMINI_BASE_URL')
-        
-        if replit_api_key and replit_base_url:
-            try:
-                self.fallback_client = genai.Client(
-                    api_key=replit_api_key,
-                    http_options={
-                        'api_version': '',
-                        'base_url': replit_base_url
-                    }
-                )
-            except Exception as e:
-                pass
-        
-        self.system_instruction = """You are the **Omni-Global Financial AI**.
-You possess complete knowledge of every accounting standard, currency, and document format on Earth.
+GATEKEEPER_DECISION_LOGIC = """### 🧠 DECISION LOGIC (SEMANTIC ANALYSIS)
 
-CORE PHILOSOPHY: "AI-First, Not OCR-First"
-- TRUST THE VISUAL IMAGE ABOVE ALL ELSE (pixels > OCR text)
-- THINK LIKE A HUMAN ACCOUNTANT, not a text parser
-- USE CHAIN OF THOUGHT REASONING before outputting data
-- SEMANTIC INTELLIGENCE over keyword matching
+**1. POSITIVE SIGNALS (Keep These)**
+- **Explicit Demands:** "Please find attached invoice", "Payment due", "Here is your bill"
+- **Proof of Payment:** "Your receipt from Uber", "Payment successful", "Thank you for your purchase"
+- **Passive Financials:** "Monthly Statement", "Subscription Renewal", "Credit Note", "Zikui", "Hashbonit"
+- **Ambiguous Files with Context:** If filename is "scan001.pdf" BUT body says "Attached the invoice", **KEEP IT**
 
-CAPABILITIES:
-✓ Universal Currency Knowledge - All ISO 4217 codes with regional symbols
-✓ Global Country Intelligence - ISO 3166 with country-specific date/tax logic
-✓ RTL Language Support - Hebrew/Arabic auto-detect and OCR correction
-✓ Multi-Currency Forensics - Cross-currency conversion with exchange rate detection
-✓ Document Type Classification - 10 category taxonomy (Tax Invoice, Receipt, Credit Note, Subscription, etc.)
-✓ Mathematical Verification - Line-item and total validation across currencies
-✓ RAG-Powered Learning - Use historical invoice patterns for accuracy
-✓ Confidence Scoring - Flag low-confidence extractions with detailed reasoning
+**2. NEGATIVE SIGNALS (Discard These)**
+- **Marketing:** "Special offer", "News from...", "Join our webinar"
+- **Logistics (Non-Financial):** "Your package has shipped" (unless includes receipt)
+- **Technical:** "Password reset", "Security alert", "Webhook notification", "System Event"
+- **Human Chatter:** "See you at lunch", "Meeting notes" (unless expensing receipt)
 
-Return ONLY valid JSON. No markdown. No commentary."""
-        
-        self.model_name = 'gemini-2.0-flash-exp'
-    
-    def _is_rate_limit_error(self, exception):
-        """Check if the exception is a rate limit or quota violation error"""
-        error_msg = str(exception)
-        return (
-            "429" in error_msg 
-            or "RATE_LIMIT_EXCEEDED" in error_msg
-            or "quota" in error_msg.lower() 
-            or "rate limit" in error_msg.lower()
-            or (hasattr(exception, 'status') and exception.status == 429)
-        )
-    
-    def _generate_content_with_fallback(self, model, contents, config):
-        """
-        Generate content with automatic fallback to Replit AI Integrations on rate limit
-        
-        Args:
-            model: Model name (e.g., 'gemini-2.0-flash-exp')
-            contents: Prompt contents
-            config: GenerateContentConfig
-            
-        Returns:
-            Response from Gemini (primary or fallback)
-        """
-        # Try primary client first
-        try:
-            response = self.client.models.generate_content(
-                model=model,
-                contents=contents,
-                config=config
-            )
-            return response
-        except Exception as e:
-            # Check if it's a rate limit error
-            if self._is_rate_limit_error(e):
-                print(f"⚠️ AI Studio rate limit hit: {e}")
-                
-                # Try fallback if available
-                if self.fallback_client:
-                    print("🔄 Falling back to Replit AI Integrations...")
-                    try:
-                        # Map model name to Replit AI Integrations equivalent
-                        fallback_model = model
-                        if 'flash' in model.lower():
-                            fallback_model = 'gemini-2.5-flash'
-                        elif 'pro' in model.lower():
-                            fallback_model = 'gemini-2.5-pro'
-                        
-                        response = self.fallback_client.models.generate_content(
-                            model=fallback_model,
-                            contents=contents,
-                            config=config
-                        )
-                        print(f"✅ Fallback successful using {fallback_model}")
-                        return response
-                    except Exception as fallback_error:
-                        print(f"❌ Fallback also failed: {fallback_error}")
-                        raise fallback_error
-                else:
-                    print("❌ No fallback configured, rate limit cannot be bypassed")
-                    raise e
-            else:
-                # Not a rate limit error, re-raise
-                raise e
-    
-    def validate_invoice(self, gcs_uri, raw_text, extracted_entities, rag_context, currency_context=None):
-        """
-        Perform semantic validation and reasoning on invoice data
-        
-        Args:
-            gcs_uri: GCS URI of the invoice image
-            raw_text: Raw OCR text from Document AI
-            extracted_entities: Structured entities from Document AI
-            rag_context: Context from Vertex AI Search (defaults to "No vendor history" if None/empty)
-            currency_context: Multi-currency analysis context from MultiCurrencyDetector (optional)
-            
-        Returns:
-            Validated JSON structure
-        """
-        if not rag_context or rag_context.strip() == "":
-            rag_context = "No vendor history found in database."
-        
-        # Format currency context for the prompt
-        currency_analysis = ""
-        if currency_context:
-            currency_analysis = f"\n\n{currency_context.get('context_summary', 'No multi-currency context available')}"
-        
-        prompt = f"""
+**3. THE "SAFEGUARD" RULE (Never Miss Money)**
+- If unsure (e.g., Order Confirmation that *might* be invoice), output **TRUE**
+- Better to process a junk file than throw away a $10,000 invoice
+
+"""
+
+GATEKEEPER_CATEGORIES = ["INVOICE", "RECEIPT", "STATEMENT", "JUNK", "OTHER"]
+
+# Static part of the validate_invoice prompt (knowledge base, protocol, output schema), sent
+# once as a Gemini cached context; only the per-invoice delta changes between calls
+VALIDATION_STATIC_PROMPT = """
 ### 1. YOUR INTERNAL KNOWLEDGE BASE
 
 **A. AUTHORIZED CURRENCIES (Support ALL ISO 4217):**
@@ -176,19 +72,7 @@ Return ONLY valid JSON. No markdown. No commentary."""
 9. Timesheet / Service Log: Hourly work record
 10. Bank Statement: List of transactions
 
-### 2. PRE-ANALYSIS CONTEXT (From Multi-Currency Detector Layer 1.5)
-{currency_analysis if currency_analysis else "No multi-currency pre-analysis available."}
-
-### 3. HISTORICAL KNOWLEDGE (From Vertex AI Search RAG)
-{rag_context}
-
-### 4. INPUT DATA (Process with priority: IMAGE > RAG > OCR)
-**VISUAL SOURCE (Image)**: {gcs_uri} → **TRUST THIS ABOVE ALL ELSE**
-**OCR Text** (Search Index Only): {raw_text[:3000]}
-⚠️ Warning: OCR may be REVERSED for Hebrew/Arabic (RTL). Validate visually.
-**Document AI Entities** (Structured): {json.dumps(extracted_entities, indent=2)[:2000]}
-
-### 5. EXECUTION PROTOCOL (MANDATORY STEPS)
+### 2. EXECUTION PROTOCOL (MANDATORY STEPS)
 
 **STEP 1: GLOBAL RECOGNITION**
 - Look at IMAGE first
@@ -215,35 +99,35 @@ Return ONLY valid JSON. No markdown. No commentary."""
   - Subscription → Extract period_start and period_end
 - Vendor Matching: Use RAG context to normalize vendor name to canonical form
 
-### 6. OUTPUT SCHEMA (Enhanced with Global Audit Metadata)
+### 3. OUTPUT SCHEMA (Enhanced with Global Audit Metadata)
 
 Return ONLY valid JSON (NO markdown, NO code blocks):
-{{
-  "global_audit_metadata": {{
+{
+  "global_audit_metadata": {
     "detected_country": "IL|US|GB|DE|FR|JP|BR|CN|etc (ISO 3166-1 alpha-2)",
     "detected_language": "he|en|ar|de|fr|ja|pt|zh|etc (ISO 639-1)",
     "document_category": "Tax Invoice|Simplified Invoice / Receipt|Credit Note|Debit Note|Pro-Forma Invoice|Utility Bill|Subscription/SaaS|Bill of Lading / Shipping Manifest|Timesheet / Service Log|Bank Statement",
     "is_multi_currency": true|false,
     "confidence_level": 0.0-1.0
-  }},
+  },
   
-  "vendor_details": {{
+  "vendor_details": {
     "name_normalized": "Canonical vendor name (from RAG or semantically normalized)",
     "name_native": "Original vendor name in native language/script",
     "registration_id": "VAT/Tax ID/CNPJ/BIN/HP number or null",
     "address_full": "Complete address string or null",
     "matched_db_id": "vendor_id from RAG database or null"
-  }},
+  },
   
-  "critical_dates": {{
+  "critical_dates": {
     "issue_date": "YYYY-MM-DD (when document was issued)",
     "payment_date": "YYYY-MM-DD (for Receipts: actual transaction date) or null",
     "due_date": "YYYY-MM-DD (for Invoices: payment deadline) or null",
     "period_start": "YYYY-MM-DD (for Subscriptions/Utilities) or null",
     "period_end": "YYYY-MM-DD (for Subscriptions/Utilities) or null"
-  }},
+  },
   
-  "financial_data": {{
+  "financial_data": {
     "primary_currency_code": "ILS|USD|EUR|GBP|JPY|etc (ISO 4217 - final settlement currency)",
     "line_item_currency_code": "USD|EUR|ILS|etc (ISO 4217 - unit price currency, may differ from primary)",
     "exchange_rate_applied": float or null,
@@ -252,13 +136,13 @@ Return ONLY valid JSON (NO markdown, NO code blocks):
     "discount_total": float,
     "grand_total": float,
     "tax_breakdown": [
-      {{
+      {
         "tax_type": "VAT|Sales Tax|GST|etc",
         "tax_rate": float,
         "tax_amount": float
-      }}
+      }
     ]
-  }},
+  },
   
   "ai_auditor_notes": "REQUIRED: Comprehensive explanation. Example: 'Found Invoice in Hebrew (RTL). Detected Israel from +972 phone. Document category: Tax Invoice. Multi-currency: USD line items → ILS total. Exchange rate 3.27 detected. Math verified: 29×$8×3.27=758.64 ILS. Applied 50% discount: 379.32 ILS. Tax 18%: 68.28 ILS. Grand total: 447.60 ILS ✓. Matched vendor DreamTeam to database.'",
   
@@ -279,8 +163,8 @@ Return ONLY valid JSON (NO markdown, NO code blocks):
   "servicePeriodStart": "YYYY-MM-DD (for subscriptions) or null",
   "servicePeriodEnd": "YYYY-MM-DD (for subscriptions) or null",
   "paymentTerms": "Net 30|Due on receipt|etc or null",
-
-  "vendor": {{
+  
+  "vendor": {
     "name": "The Brand Name / Logo Name (visible on invoice header)",
     "legal_name": "CRITICAL: The Legal Entity Name found in Payment Instructions / Bank Beneficiary / Remit-To field. This is WHO RECEIVES THE MONEY. If different from Brand Name, PRIORITIZE THIS for matching.",
     "address": "Complete address",
@@ -290,16 +174,16 @@ Return ONLY valid JSON (NO markdown, NO code blocks):
     "taxId": "VAT/Tax ID or null",
     "registrationNumber": "Business reg number or null",
     "website": "url or null"
-  }},
+  },
   
-  "vendor_identity_analysis": {{
+  "vendor_identity_analysis": {
     "brand_name": "Name/logo visible on invoice header (e.g., 'Fully Booked', 'Go To Health!')",
     "legal_beneficiary": "Legal entity receiving payment from bank/remit-to instructions (e.g., 'Artem Andreevitch Revva', 'GoToHealth Media, LLC')",
     "is_third_party_payment": true|false,
     "reasoning": "REQUIRED: Explain if brand_name differs from legal_beneficiary and why. Example: 'Invoice header shows Fully Booked but payment instructions say Payable to Artem Andreevitch Revva, indicating Artem is a freelancer using Fully Booked as a brand name.'"
-  }},
-
-  "buyer": {{
+  },
+  
+  "buyer": {
     "name": "Buyer company name or null",
     "address": "Buyer address or null",
     "country": "Country or null",
@@ -307,20 +191,20 @@ Return ONLY valid JSON (NO markdown, NO code blocks):
     "phone": "phone or null",
     "taxId": "tax id or null",
     "registrationNumber": "reg number or null"
-  }},
-
+  },
+  
   "purchaseOrderNumbers": ["PO123", "PO456"] or [],
   
-  "paymentDetails": {{
+  "paymentDetails": {
     "iban": "IBAN or null",
     "swift": "SWIFT/BIC or null",
     "bankName": "Bank name or null",
     "accountNumber": "Account number or null",
     "paymentInstructions": "Instructions or null"
-  }},
-
+  },
+  
   "lineItems": [
-    {{
+    {
       "description": "Item description (translate to English if foreign language)",
       "quantity": float,
       "unitPrice": float,
@@ -335,10 +219,10 @@ Return ONLY valid JSON (NO markdown, NO code blocks):
       "category": "semantic category (e.g., 'Software Subscription', 'Consulting Services')",
       "productCode": "SKU or null",
       "mathVerified": true|false
-    }}
+    }
   ],
-
-  "totals": {{
+  
+  "totals": {
     "subtotal": float,
     "subtotalCurrency": "ILS (ISO 4217)",
     "tax": float,
@@ -352,150 +236,516 @@ Return ONLY valid JSON (NO markdown, NO code blocks):
     "shippingCurrency": "ILS (ISO 4217)",
     "total": float,
     "totalCurrency": "ILS (ISO 4217)"
-  }},
-
-  "multiCurrency": {{
+  },
+  
+  "multiCurrency": {
     "isMultiCurrency": true|false,
     "baseCurrency": "USD (ISO 4217 - currency of unit prices)",
     "settlementCurrency": "ILS (ISO 4217 - currency of final totals)",
     "exchangeRate": 3.27 or null,
     "exchangeRateSource": "Document states: (1USD = 3.27ILS) or null",
-    "mathVerification": {{
+    "mathVerification": {
       "lineItemCalculation": "29 × $8.00 USD = $232.00 USD",
       "currencyConversion": "$232.00 × 3.27 = 758.64 ILS",
       "afterDiscount": "758.64 - 379.32 = 379.32 ILS",
       "afterTax": "379.32 + 68.28 = 447.60 ILS",
       "verified": true|false
-    }}
-  }},
-
-  "vendorMatch": {{
+    }
+  },
+  
+  "vendorMatch": {
     "normalizedName": "Canonical vendor name from RAG database or semantically normalized",
     "alternateNames": ["Spelling variant 1", "Abbreviation", "Previous names"],
     "confidence": float (0.0-1.0),
     "matchedDbId": "vendor_id_from_rag or null",
     "ragMatchReasoning": "Explain how you matched this vendor to the database"
-  }},
-
+  },
+  
   "classificationConfidence": float (0.0-1.0),
   "extractionConfidence": float (0.0-1.0),
-
+  
   "reasoning": "LEGACY FIELD - Use auditReasoning instead. Brief explanation of extraction decisions.",
   
   "warnings": ["List of issues: math mismatches, low confidence fields, OCR corrections, ambiguous dates, etc."]
-}}
+}
 """
+
+# Fields reported while validate_invoice streams (dotted JSON path → partial event field)
+VALIDATION_PARTIAL_FIELDS = {
+    'invoiceNumber': 'invoiceNumber',
+    'documentDate': 'documentDate',
+    'currency': 'currency',
+    'vendor.name': 'vendor',
+    'totals.total': 'total',
+    'totals.totalCurrency': 'totalCurrency'
+}
+
+# One way to reach Gemini: client label for metrics, client, model name on that client, RPM/TPM quota
+GeminiRoute = namedtuple('GeminiRoute', ['name', 'client', 'model', 'quota'])
+
+
+class GeminiRateLimitError(Exception):
+    """Raised when every Gemini route is rate limited (locally or by the API) after all retries"""
+    status = 429
+
+
+class StreamedGeminiResponse:
+    """Joined text and final usage_metadata of a generate_content_stream call"""
+    
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class GeminiService:
+    """Service for semantic validation and reasoning using Gemini 1.5 Pro with automatic fallback"""
+    
+    def __init__(self):
+        # Primary client: User's AI Studio API key
+        api_key = config.GOOGLE_GEMINI_API_KEY or os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY or GOOGLE_GEMINI_API_KEY is required")
+        
+        self.client = genai.Client(api_key=api_key)
+        self._key_fingerprint = self._fingerprint(api_key)
+        
+        # Extra AI Studio keys (separate quotas) tried before the billed fallback
+        self.extra_clients = []
+        for extra_key in config.GEMINI_EXTRA_API_KEYS:
+            try:
+                self.extra_clients.append((self._fingerprint(extra_key), genai.Client(api_key=extra_key)))
+            except Exception as e:
+                print(f"⚠️ Skipping extra Gemini API key: {e}")
+        
+        # Fallback client: Replit AI Integrations (billed to Replit credits)
+        self.fallback_client = None
+        replit_api_key = os.getenv('AI_INTEGRATIONS_GEMINI_API_KEY')
+        replit_base_url = os.getenv('AI_INTEGRATIONS_GEMINI_BASE_URL')
+        self._fallback_key_fingerprint = self._fingerprint(replit_api_key or 'replit')
+        
+        if replit_api_key and replit_base_url:
+            try:
+                self.fallback_client = genai.Client(
+                    api_key=replit_api_key,
+                    http_options={
+                        'api_version': '',
+                        'base_url': replit_base_url
+                    }
+                )
+            except Exception as e:
+                pass
+        
+        self.system_instruction = """You are the **Omni-Global Financial AI**.
+You possess complete knowledge of every accounting standard, currency, and document format on Earth.
+
+CORE PHILOSOPHY: "AI-First, Not OCR-First"
+- TRUST THE VISUAL IMAGE ABOVE ALL ELSE (pixels > OCR text)
+- THINK LIKE A HUMAN ACCOUNTANT, not a text parser
+- USE CHAIN OF THOUGHT REASONING before outputting data
+- SEMANTIC INTELLIGENCE over keyword matching
+
+CAPABILITIES:
+✓ Universal Currency Knowledge - All ISO 4217 codes with regional symbols
+✓ Global Country Intelligence - ISO 3166 with country-specific date/tax logic
+✓ RTL Language Support - Hebrew/Arabic auto-detect and OCR correction
+✓ Multi-Currency Forensics - Cross-currency conversion with exchange rate detection
+✓ Document Type Classification - 10 category taxonomy (Tax Invoice, Receipt, Credit Note, Subscription, etc.)
+✓ Mathematical Verification - Line-item and total validation across currencies
+✓ RAG-Powered Learning - Use historical invoice patterns for accuracy
+✓ Confidence Scoring - Flag low-confidence extractions with detailed reasoning
+
+Return ONLY valid JSON. No markdown. No commentary."""
+        
+        self.model_name = 'gemini-2.0-flash-exp'
+        
+        self.response_cache = None
+        if config.GEMINI_CACHE_ENABLED:
+            try:
+                self.response_cache = GeminiResponseCache()
+            except Exception as e:
+                print(f"⚠️ Gemini response cache unavailable (non-critical): {e}")
+    
+    @staticmethod
+    def _fingerprint(api_key):
+        """Short non-reversible id for an API key (rate limiter buckets are shared per key)"""
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+    
+    def prompt_version(self):
+        """
+        Version key for cached extractions, tied to the model, system instruction, static prompt and schema version
+        
+        Returns:
+            Short hex fingerprint string
+        """
+        fingerprint = f"{self.model_name}|{config.EXTRACTION_SCHEMA_VERSION}|{self.system_instruction}|{VALIDATION_STATIC_PROMPT}"
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+    
+    def _is_rate_limit_error(self, exception):
+        """Check if the exception is a rate limit or quota violation error"""
+        error_msg = str(exception)
+        return (
+            "429" in error_msg 
+            or "RATE_LIMIT_EXCEEDED" in error_msg
+            or "quota" in error_msg.lower() 
+            or "rate limit" in error_msg.lower()
+            or (hasattr(exception, 'status') and exception.status == 429)
+        )
+    
+    def _cache_key_for(self, model, contents, generation_config, use_cache, call_site):
+        """Return the response-cache key for a call, or None if the call should not be cached"""
+        if not self.response_cache or not use_cache:
+            return None
+        if call_site in config.GEMINI_CACHE_SKIP_CALL_SITES:
+            return None
+        
+        if isinstance(generation_config, dict):
+            temperature = generation_config.get('temperature')
+        else:
+            temperature = getattr(generation_config, 'temperature', None)
+        # Unset temperature means the model default (~1.0): not deterministic enough to replay
+        if temperature is None or temperature > config.GEMINI_CACHE_MAX_TEMPERATURE:
+            return None
+        
+        return GeminiResponseCache.cache_key(model, contents, generation_config)
+    
+    def _store_cached_response(self, cache_key, model, generation_config, response, call_site):
+        """Cache a response text unless it is empty or (for JSON calls) does not parse"""
+        text = getattr(response, 'text', None)
+        if not text:
+            return
+        
+        if isinstance(generation_config, dict):
+            mime_type = generation_config.get('response_mime_type')
+        else:
+            mime_type = getattr(generation_config, 'response_mime_type', None)
+        if mime_type == 'application/json':
+            try:
+                json.loads(text)
+            except ValueError:
+                return
+        
+        self.response_cache.put(cache_key, model, text, call_site=call_site)
+    
+    def _generate_content_with_fallback(self, model, contents, config, use_cache=True, call_site=None, route_overrides=None, on_text=None):
+        """
+        Generate content with proactive rate limiting and fallback across API keys / Replit AI Integrations
+        
+        Low-temperature calls are served from the persistent response cache when the
+        same model/prompt/config was answered before.
+        
+        Args:
+            model: Model name (e.g., 'gemini-2.0-flash-exp')
+            contents: Prompt contents
+            config: GenerateContentConfig
+            use_cache: Set False to always call the API (e.g., retries after a bad response)
+            call_site: Short caller name for cache/token metrics and GEMINI_CACHE_SKIP_CALL_SITES
+            route_overrides: Optional {route name: (contents, config)} used instead of the
+                             defaults on that route (e.g., a cached-context request on 'primary')
+            on_text: Optional callable(text_so_far); the call is then streamed and the
+                     callback sees the response text as it grows
+        
+        Returns:
+            Response from Gemini (primary or fallback), or a CachedGeminiResponse
+        """
+        cache_key = self._cache_key_for(model, contents, config, use_cache, call_site)
+        cached = self._cached_response(cache_key, model, call_site)
+        if cached:
+            return cached
+        
+        response = self._call_with_fallback(model, contents, config, call_site=call_site, route_overrides=route_overrides, on_text=on_text)
+        if cache_key:
+            self._store_cached_response(cache_key, model, config, response, call_site)
+        return response
+    
+    def _cached_response(self, cache_key, model, call_site):
+        """Look up a response-cache entry (None without a key or on a miss) and count the outcome"""
+        if not cache_key:
+            return None
+        cached = self.response_cache.get(cache_key)
+        metrics.increment('gemini_cache_requests_total', call_site=call_site or 'unknown', outcome='hit' if cached else 'miss')
+        if cached:
+            gemini_usage.record(call_site, model, 'cache', outcome='cache_hit')
+        return cached
+    
+    def _fallback_model(self, model):
+        """Map a model name to its Replit AI Integrations equivalent"""
+        if 'flash' in model.lower():
+            return 'gemini-2.5-flash'
+        if 'pro' in model.lower():
+            return 'gemini-2.5-pro'
+        return model
+    
+    def _routes(self, model):
+        """
+        Clients in preference order: AI Studio key, extra keys, then the (billed) Replit fallback
+        
+        Returns:
+            List of GeminiRoute with their per-key, per-model quota (None when limiting is off)
+        """
+        candidates = [('primary', self.client, model, self._key_fingerprint)]
+        for index, (fingerprint, client) in enumerate(self.extra_clients, 1):
+            candidates.append((f'extra-{index}', client, model, fingerprint))
+        if self.fallback_client:
+            candidates.append(('fallback', self.fallback_client, self._fallback_model(model), self._fallback_key_fingerprint))
+        
+        return [
+            GeminiRoute(name, client, route_model, rate_limiters.quota(fingerprint, route_model) if config.GEMINI_RATE_LIMITING_ENABLED else None)
+            for name, client, route_model, fingerprint in candidates
+        ]
+    
+    def _acquire_route(self, routes, estimated_tokens, exclude, queue_seconds):
+        """
+        Pick the first route with quota left, waiting up to queue_seconds for one to refill
+        
+        Returns:
+            GeminiRoute, or None if every route stays exhausted past queue_seconds
+        """
+        deadline = time.monotonic() + queue_seconds
+        while True:
+            route, wait_seconds = self._poll_routes(routes, estimated_tokens, exclude, deadline)
+            if wait_seconds is None:
+                return route
+            time.sleep(wait_seconds)
+    
+    def _poll_routes(self, routes, estimated_tokens, exclude, deadline):
+        """
+        One non-blocking pass of _acquire_route (shared with the async path)
+        
+        Returns:
+            (route, None) once decided (route is None when nothing can be acquired before
+            the deadline), or (None, seconds) to wait before polling again
+        """
+        candidates = [route for route in routes if route.name not in exclude]
+        if not candidates:
+            return None, None
+        if not config.GEMINI_RATE_LIMITING_ENABLED:
+            return candidates[0], None
+        
+        for route in candidates:
+            if route.quota.try_acquire(estimated_tokens):
+                return route, None
+            
+        wait_seconds = min(route.quota.wait_time(estimated_tokens) for route in candidates)
+        if wait_seconds > deadline - time.monotonic():
+            return None, None
+        metrics.increment('gemini_rate_limiter_waits_total', model=candidates[0].model)
+        return None, max(wait_seconds, 0.01)
+    
+    @staticmethod
+    def _estimate_tokens(contents, generation_config):
+        """Rough request size for the TPM bucket: ~4 characters per token plus the output allowance"""
+        if isinstance(contents, str):
+            chars = len(contents)
+        elif isinstance(contents, (list, tuple)):
+            chars = sum(len(item) if isinstance(item, str) else 1000 for item in contents)
+        else:
+            chars = 1000
+        
+        if isinstance(generation_config, dict):
+            system_instruction = generation_config.get('system_instruction')
+            max_output_tokens = generation_config.get('max_output_tokens')
+        else:
+            system_instruction = getattr(generation_config, 'system_instruction', None)
+            max_output_tokens = getattr(generation_config, 'max_output_tokens', None)
+        if isinstance(system_instruction, str):
+            chars += len(system_instruction)
+        
+        return chars // 4 + (max_output_tokens or 1024)
+    
+    def _call_with_fallback(self, model, contents, generation_config, call_site=None, route_overrides=None, on_text=None):
+        """
+        Route a call across the primary, extra-key and fallback clients
+        
+        With client-side rate limiting on, a route is only used when its per-key,
+        per-model RPM/TPM buckets have budget, so we stop sending requests that are
+        bound to 429. A 429 that still happens cools that route down and the call
+        moves to the next one; when every route is exhausted the call backs off
+        exponentially (with jitter) and tries again, up to GEMINI_MAX_RETRIES times.
+        With on_text the call is streamed (see _stream_content); a stream cut short by a
+        429 restarts on the next route, and on_text then sees the new stream from the start.
+        """
+        routes = self._routes(model)
+        estimated_tokens = self._estimate_tokens(contents, generation_config)
+        last_error = None
+        call_start = time.perf_counter()
+        retries = 0
+        
+        for attempt in range(max(config.GEMINI_MAX_RETRIES, 0) + 1):
+            if attempt:
+                delay = backoff_delay(attempt - 1)
+                print(f"⏳ All Gemini routes rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+                time.sleep(delay)
+            
+            tried = set()
+            route = self._acquire_route(routes, estimated_tokens, tried, config.GEMINI_MAX_QUEUE_SECONDS)
+            if route is None:
+                last_error = GeminiRateLimitError(f"Local Gemini quota exhausted for {model} on every route")
+                retries += 1
+                continue
+            
+            while route:
+                route_contents, route_config = (route_overrides or {}).get(route.name, (contents, generation_config))
+                with concurrency_limits.slot('gemini'):
+                    start = time.perf_counter()
+                    try:
+                        if on_text:
+                            response = self._stream_content(route, route_contents, route_config, on_text)
+                        else:
+                            response = route.client.models.generate_content(
+                                model=route.model,
+                                contents=route_contents,
+                                config=route_config
+                            )
+                        self._route_succeeded(route, response, call_site, estimated_tokens, start, call_start, retries)
+                        return response
+                    except Exception as e:
+                        if not self._route_failed(route, e, call_site, start, call_start, retries):
+                            raise e
+                        last_error = e
+                        retries += 1
+                        tried.add(route.name)
+                    
+                        route = self._acquire_route(routes, estimated_tokens, tried, 0)
+                        if route:
+                            print(f"🔄 Rerouting to {route.name} ({route.model})...")
+        
+        self._routes_exhausted(model, routes, call_site, call_start, retries)
+        raise last_error
+    
+    def _route_succeeded(self, route, response, call_site, estimated_tokens, start, call_start, retries):
+        """Metrics, usage accounting and quota settlement for a successful call on one route"""
+        self._record_gemini_call(route.name, route.model, 'success', start)
+        usage = getattr(response, 'usage_metadata', None)
+        self._record_token_usage(call_site, route, usage)
+        gemini_usage.record(call_site, route.model, route.name, usage, time.perf_counter() - call_start, retries)
+        if route.quota:
+            route.quota.settle(estimated_tokens, getattr(usage, 'total_token_count', None))
+        if route.name != 'primary':
+            print(f"✅ Gemini call served by {route.name} ({route.model})")
+    
+    def _route_failed(self, route, error, call_site, start, call_start, retries):
+        """
+        Record a failed call on one route
+        
+        Returns:
+            True if it was a rate limit (the route is cooled down; try the next one),
+            False if the error must be re-raised
+        """
+        if not self._is_rate_limit_error(error):
+            self._record_gemini_call(route.name, route.model, 'error', start)
+            gemini_usage.record(call_site, route.model, route.name, None, time.perf_counter() - call_start, retries, outcome='error')
+            return False
+        
+        self._record_gemini_call(route.name, route.model, 'rate_limited', start)
+        print(f"⚠️ Gemini rate limit hit on {route.name}: {error}")
+        if route.quota:
+            route.quota.cool_down(config.GEMINI_RATE_LIMIT_COOLDOWN_SECONDS)
+        return True
+    
+    def _routes_exhausted(self, model, routes, call_site, call_start, retries):
+        """Log and account a call that failed on every route after all retries"""
+        print(f"❌ Gemini call failed after {config.GEMINI_MAX_RETRIES + 1} attempts across {len(routes)} route(s)")
+        gemini_usage.record(call_site, model, 'none', None, time.perf_counter() - call_start, retries, outcome='error')
+    
+    @staticmethod
+    def _stream_content(route, contents, generation_config, on_text):
+        """
+        Stream one generate_content call, reporting the accumulated text after every chunk
+        
+        Returns:
+            StreamedGeminiResponse (usage_metadata comes with the last chunks)
+        """
+        text = ''
+        usage = None
+        for chunk in route.client.models.generate_content_stream(
+            model=route.model,
+            contents=contents,
+            config=generation_config
+        ):
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            chunk_text = getattr(chunk, 'text', None)
+            if not chunk_text:
+                continue
+            text += chunk_text
+            try:
+                on_text(text)
+            except Exception as e:
+                print(f"⚠️ Streaming callback error (non-critical): {e}")
+        return StreamedGeminiResponse(text, usage)
+    
+    def _record_token_usage(self, call_site, route, usage):
+        """Log and count prompt / cached / output tokens reported in usage_metadata"""
+        if usage is None:
+            return
+        
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) or 0
+        cached_tokens = getattr(usage, 'cached_content_token_count', None) or 0
+        output_tokens = getattr(usage, 'candidates_token_count', None) or 0
+        call_site = call_site or 'unknown'
+        
+        for kind, count in (('prompt', prompt_tokens), ('cached', cached_tokens), ('output', output_tokens)):
+            if count:
+                metrics.increment('gemini_tokens_total', count, call_site=call_site, kind=kind)
+        print(f"📊 Gemini tokens [{call_site} via {route.name}]: input {prompt_tokens} ({cached_tokens} cached), output {output_tokens}")
+    
+    def _record_gemini_call(self, client, model, outcome, start):
+        """Record latency and outcome of one generate_content call for /metrics"""
+        metrics.observe('gemini_request_duration_seconds', time.perf_counter() - start, client=client)
+        metrics.increment('gemini_requests_total', client=client, model=model, outcome=outcome)
+    
+    def validate_invoice(self, gcs_uri, raw_text, extracted_entities, rag_context, currency_context=None, extra_prompt=None, on_partial=None):
+        """
+        Perform semantic validation and reasoning on invoice data
+        
+        Args:
+            gcs_uri: GCS URI of the invoice image
+            raw_text: Raw OCR text from Document AI
+            extracted_entities: Structured entities from Document AI
+            rag_context: Context from Vertex AI Search (defaults to "No vendor history" if None/empty)
+            currency_context: Multi-currency analysis context from MultiCurrencyDetector (optional)
+            extra_prompt: Additional per-invoice section appended after the input data (optional,
+                          e.g., the fused Layer 3.5 vendor resolution request)
+            on_partial: Optional callable(fields); the response is then streamed and key fields
+                        (VALIDATION_PARTIAL_FIELDS) are reported as soon as they are parsed.
+                        The returned result is validated exactly as without streaming.
+        
+        Returns:
+            Validated JSON structure
+        """
+        delta_prompt = self._validation_delta_prompt(gcs_uri, raw_text, extracted_entities, rag_context, currency_context, extra_prompt)
+        prompt = VALIDATION_STATIC_PROMPT + delta_prompt
+        on_text = self._partial_fields_reporter(on_partial) if on_partial and config.GEMINI_STREAMING_ENABLED else None
         
         max_retries = 2
         response = None
         for attempt in range(max_retries):
+            route_overrides = None
             try:
+                route_overrides = self._validation_context_overrides(delta_prompt)
+                
                 # Use fallback-enabled method (automatic rate limit protection)
                 response = self._generate_content_with_fallback(
                     model=self.model_name,
                     contents=prompt,
-                    config=types.GenerateContentConfig(
-                        system_instruction=self.system_instruction,
-                        response_mime_type="application/json",
-                        temperature=0.1
-                    )
+                    config=self._validation_config(),
+                    use_cache=attempt == 0,
+                    call_site='validate_invoice',
+                    route_overrides=route_overrides,
+                    on_text=on_text
                 )
                 
                 if not response or not response.text:
                     if attempt < max_retries - 1:
+                        time.sleep(backoff_delay(attempt))
                         continue
                     return self._create_error_response("Empty response from Gemini", ["Gemini returned empty response"])
                 
-                result_text = response.text.strip()
-                
-                if result_text.startswith('```json'):
-                    result_text = result_text[7:]
-                if result_text.startswith('```'):
-                    result_text = result_text[3:]
-                if result_text.endswith('```'):
-                    result_text = result_text[:-3]
-                
-                result_text = result_text.strip()
-                
-                validated_data = json.loads(result_text)
-                
-                # Ensure minimum required fields exist
-                if 'vendor' not in validated_data:
-                    validated_data['vendor'] = {"name": "Unknown", "address": None, "country": None}
-                if 'warnings' not in validated_data:
-                    validated_data['warnings'] = []
-                if 'documentType' not in validated_data:
-                    validated_data['documentType'] = "Invoice"
-                if 'extractionConfidence' not in validated_data:
-                    validated_data['extractionConfidence'] = 0.5
-                if 'auditReasoning' not in validated_data:
-                    validated_data['auditReasoning'] = validated_data.get('reasoning', 'No reasoning provided')
-                
-                # Backward compatibility: map new field names to old ones
-                if 'documentDate' in validated_data and 'issueDate' not in validated_data:
-                    validated_data['issueDate'] = validated_data['documentDate']
-                if 'isRTL' not in validated_data:
-                    validated_data['isRTL'] = False
-                if 'isSubscription' not in validated_data:
-                    validated_data['isSubscription'] = False
-                if 'detectedCountry' not in validated_data:
-                    validated_data['detectedCountry'] = None
-                
-                # NEW: Ensure global_audit_metadata exists with defaults
-                if 'global_audit_metadata' not in validated_data:
-                    validated_data['global_audit_metadata'] = {
-                        'detected_country': validated_data.get('detectedCountry'),
-                        'detected_language': validated_data.get('language', 'en'),
-                        'document_category': validated_data.get('documentType', 'Invoice'),
-                        'is_multi_currency': validated_data.get('multiCurrency', {}).get('isMultiCurrency', False),
-                        'confidence_level': validated_data.get('extractionConfidence', 0.5)
-                    }
-                
-                # NEW: Ensure vendor_details exists
-                if 'vendor_details' not in validated_data:
-                    vendor = validated_data.get('vendor', {})
-                    validated_data['vendor_details'] = {
-                        'name_normalized': validated_data.get('vendorMatch', {}).get('normalizedName', vendor.get('name', 'Unknown')),
-                        'name_native': vendor.get('name', 'Unknown'),
-                        'registration_id': vendor.get('taxId') or vendor.get('registrationNumber'),
-                        'address_full': vendor.get('address'),
-                        'matched_db_id': validated_data.get('vendorMatch', {}).get('matchedDbId')
-                    }
-                
-                # NEW: Ensure critical_dates exists
-                if 'critical_dates' not in validated_data:
-                    validated_data['critical_dates'] = {
-                        'issue_date': validated_data.get('documentDate') or validated_data.get('issueDate'),
-                        'payment_date': validated_data.get('paymentDate'),
-                        'due_date': validated_data.get('dueDate'),
-                        'period_start': validated_data.get('servicePeriodStart'),
-                        'period_end': validated_data.get('servicePeriodEnd')
-                    }
-                
-                # NEW: Ensure financial_data exists
-                if 'financial_data' not in validated_data:
-                    totals = validated_data.get('totals', {})
-                    multi_currency = validated_data.get('multiCurrency', {})
-                    validated_data['financial_data'] = {
-                        'primary_currency_code': multi_currency.get('settlementCurrency') or validated_data.get('currency', 'USD'),
-                        'line_item_currency_code': multi_currency.get('baseCurrency') or validated_data.get('currency', 'USD'),
-                        'exchange_rate_applied': multi_currency.get('exchangeRate') or validated_data.get('exchangeRate'),
-                        'subtotal': totals.get('subtotal', 0),
-                        'tax_total': totals.get('tax', 0),
-                        'discount_total': totals.get('discounts', 0),
-                        'grand_total': totals.get('total', 0),
-                        'tax_breakdown': []
-                    }
-                
-                # NEW: Ensure ai_auditor_notes exists
-                if 'ai_auditor_notes' not in validated_data:
-                    validated_data['ai_auditor_notes'] = validated_data.get('auditReasoning', validated_data.get('reasoning', 'No audit notes provided'))
-                
-                return validated_data
-                
+                return self._parse_validation_response(response.text)
+            
             except json.JSONDecodeError as e:
                 print(f"JSON decode error (attempt {attempt + 1}/{max_retries}): {e}")
                 if attempt < max_retries - 1:
+                    time.sleep(backoff_delay(attempt))
                     continue
                 
                 response_text = response.text if response and hasattr(response, 'text') else "No response"
@@ -507,11 +757,192 @@ Return ONLY valid JSON (NO markdown, NO code blocks):
                 )
             except Exception as e:
                 print(f"Gemini validation error (attempt {attempt + 1}/{max_retries}): {e}")
+                if route_overrides:
+                    # The cached context may have expired server-side; recreate it on the next attempt
+                    context_caches.invalidate(self._key_fingerprint, self.model_name, self.system_instruction, VALIDATION_STATIC_PROMPT)
                 if attempt < max_retries - 1:
+                    time.sleep(backoff_delay(attempt))
                     continue
                 
                 return self._create_error_response(str(e), [f"Gemini error: {str(e)}"])
     
+    def _validation_delta_prompt(self, gcs_uri, raw_text, extracted_entities, rag_context, currency_context=None, extra_prompt=None):
+        """Per-invoice part of the validation prompt (see validate_invoice for the arguments)"""
+        if not rag_context or rag_context.strip() == "":
+            rag_context = "No vendor history found in database."
+        
+        # Format currency context for the prompt
+        currency_analysis = ""
+        if currency_context:
+            currency_analysis = f"\n\n{currency_context.get('context_summary', 'No multi-currency context available')}"
+        
+        # Only this delta changes per invoice; the static knowledge base, protocol and schema
+        # come from the context cache (or are prepended inline when no cache is available)
+        delta_prompt = f"""
+### PER-INVOICE INPUT (apply the knowledge base, protocol and schema above)
+
+### 4. PRE-ANALYSIS CONTEXT (From Multi-Currency Detector Layer 1.5)
+{currency_analysis if currency_analysis else "No multi-currency pre-analysis available."}
+
+### 5. HISTORICAL KNOWLEDGE (From Vertex AI Search RAG)
+{rag_context}
+
+### 6. INPUT DATA (Process with priority: IMAGE > RAG > OCR)
+**VISUAL SOURCE (Image)**: {gcs_uri} → **TRUST THIS ABOVE ALL ELSE**
+**OCR Text** (Search Index Only): {raw_text[:3000]}
+⚠️ Warning: OCR may be REVERSED for Hebrew/Arabic (RTL). Validate visually.
+**Document AI Entities** (Structured): {json.dumps(extracted_entities, indent=2)[:2000]}
+"""
+        if extra_prompt:
+            delta_prompt += extra_prompt
+        return delta_prompt
+        
+    def _validation_config(self):
+        """Generation config for validate_invoice when the whole prompt is sent inline"""
+        return types.GenerateContentConfig(
+            system_instruction=self.system_instruction,
+            response_mime_type="application/json",
+            temperature=0.1
+        )
+                
+    def _parse_validation_response(self, response_text):
+        """
+        Parse a validation response and fill in the fields downstream layers rely on
+                
+        Raises:
+            json.JSONDecodeError: The response is not valid JSON
+        """
+        result_text = response_text.strip()
+                
+        if result_text.startswith('```json'):
+            result_text = result_text[7:]
+        if result_text.startswith('```'):
+            result_text = result_text[3:]
+        if result_text.endswith('```'):
+            result_text = result_text[:-3]
+                
+        result_text = result_text.strip()
+                
+        validated_data = json.loads(result_text)
+                
+        # Ensure minimum required fields exist
+        if 'vendor' not in validated_data:
+            validated_data['vendor'] = {"name": "Unknown", "address": None, "country": None}
+        if 'warnings' not in validated_data:
+            validated_data['warnings'] = []
+        if 'documentType' not in validated_data:
+            validated_data['documentType'] = "Invoice"
+        if 'extractionConfidence' not in validated_data:
+            validated_data['extractionConfidence'] = 0.5
+        if 'auditReasoning' not in validated_data:
+            validated_data['auditReasoning'] = validated_data.get('reasoning', 'No reasoning provided')
+                
+        # Backward compatibility: map new field names to old ones
+        if 'documentDate' in validated_data and 'issueDate' not in validated_data:
+            validated_data['issueDate'] = validated_data['documentDate']
+        if 'isRTL' not in validated_data:
+            validated_data['isRTL'] = False
+        if 'isSubscription' not in validated_data:
+            validated_data['isSubscription'] = False
+        if 'detectedCountry' not in validated_data:
+            validated_data['detectedCountry'] = None
+                
+        # NEW: Ensure global_audit_metadata exists with defaults
+        if 'global_audit_metadata' not in validated_data:
+            validated_data['global_audit_metadata'] = {
+                'detected_country': validated_data.get('detectedCountry'),
+                'detected_language': validated_data.get('language', 'en'),
+                'document_category': validated_data.get('documentType', 'Invoice'),
+                'is_multi_currency': validated_data.get('multiCurrency', {}).get('isMultiCurrency', False),
+                'confidence_level': validated_data.get('extractionConfidence', 0.5)
+            }
+                
+        # NEW: Ensure vendor_details exists
+        if 'vendor_details' not in validated_data:
+            vendor = validated_data.get('vendor', {})
+            validated_data['vendor_details'] = {
+                'name_normalized': validated_data.get('vendorMatch', {}).get('normalizedName', vendor.get('name', 'Unknown')),
+                'name_native': vendor.get('name', 'Unknown'),
+                'registration_id': vendor.get('taxId') or vendor.get('registrationNumber'),
+                'address_full': vendor.get('address'),
+                'matched_db_id': validated_data.get('vendorMatch', {}).get('matchedDbId')
+            }
+                
+        # NEW: Ensure critical_dates exists
+        if 'critical_dates' not in validated_data:
+            validated_data['critical_dates'] = {
+                'issue_date': validated_data.get('documentDate') or validated_data.get('issueDate'),
+                'payment_date': validated_data.get('paymentDate'),
+                'due_date': validated_data.get('dueDate'),
+                'period_start': validated_data.get('servicePeriodStart'),
+                'period_end': validated_data.get('servicePeriodEnd')
+            }
+                
+        # NEW: Ensure financial_data exists
+        if 'financial_data' not in validated_data:
+            totals = validated_data.get('totals', {})
+            multi_currency = validated_data.get('multiCurrency', {})
+            validated_data['financial_data'] = {
+                'primary_currency_code': multi_currency.get('settlementCurrency') or validated_data.get('currency', 'USD'),
+                'line_item_currency_code': multi_currency.get('baseCurrency') or validated_data.get('currency', 'USD'),
+                'exchange_rate_applied': multi_currency.get('exchangeRate') or validated_data.get('exchangeRate'),
+                'subtotal': totals.get('subtotal', 0),
+                'tax_total': totals.get('tax', 0),
+                'discount_total': totals.get('discounts', 0),
+                'grand_total': totals.get('total', 0),
+                'tax_breakdown': []
+            }
+                
+        # NEW: Ensure ai_auditor_notes exists
+        if 'ai_auditor_notes' not in validated_data:
+            validated_data['ai_auditor_notes'] = validated_data.get('auditReasoning', validated_data.get('reasoning', 'No audit notes provided'))
+                
+        return validated_data
+    
+    @staticmethod
+    def _partial_fields_reporter(on_partial):
+        """Build the on_text callback that turns streamed validation text into on_partial(fields) calls"""
+        parser = StreamingFieldParser(VALIDATION_PARTIAL_FIELDS)
+        
+        def on_text(text_so_far):
+            completed = parser.update(text_so_far)
+            if completed:
+                on_partial({VALIDATION_PARTIAL_FIELDS[path]: value for path, value in completed.items()})
+        
+        return on_text
+    
+    def _validation_context_overrides(self, delta_prompt):
+        """
+        Send only the per-invoice delta on the primary client when the static prompt is a cached context
+        
+        Returns:
+            route_overrides for _generate_content_with_fallback, or None to send everything inline
+        """
+        if not config.GEMINI_CONTEXT_CACHE_ENABLED:
+            return None
+        
+        cache_name = context_caches.get(
+            self.client,
+            self._key_fingerprint,
+            self.model_name,
+            self.system_instruction,
+            VALIDATION_STATIC_PROMPT,
+            display_name=f"validate-invoice-{self.prompt_version()}"
+        )
+        if not cache_name:
+            return None
+        
+        return {
+            'primary': (
+                delta_prompt,
+                types.GenerateContentConfig(
+                    cached_content=cache_name,
+                    response_mime_type="application/json",
+                    temperature=0.1
+                )
+            )
+        }
+    
     def gatekeeper_email_filter(self, sender_email, email_subject, email_body_snippet, attachment_filename):
         """
         Elite Gatekeeper AI Filter using Gemini 1.5 Flash
@@ -531,7 +962,26 @@ Return ONLY valid JSON (NO markdown, NO code blocks):
                 "reasoning": str
             }
         """
-        prompt = f"""
+        prompt = self._gatekeeper_prompt(sender_email, email_subject, email_body_snippet, attachment_filename)
+        
+        try:
+            # Use Gemini Flash with automatic fallback (rate limit protection)
+            response = self._generate_content_with_fallback(
+                model='gemini-2.0-flash-exp',
+                contents=prompt,
+                config=self._gatekeeper_config(),
+                call_site='gatekeeper'
+            )
+            
+            return self._parse_gatekeeper_response(response.text)
+        
+        except Exception as e:
+            return self._gatekeeper_error_verdict(e)
+    
+    @staticmethod
+    def _gatekeeper_prompt(sender_email, email_subject, email_body_snippet, attachment_filename):
+        """Single-email Gatekeeper prompt"""
+        return f"""
 You are the **Chief Financial Mailroom Guard**.
 Your ONLY job is to decide if an incoming email contains a **Financial Document** that needs processing.
 
@@ -541,25 +991,7 @@ Your ONLY job is to decide if an incoming email contains a **Financial Document*
 - **Body Snippet:** {email_body_snippet}
 - **Attachment Name:** {attachment_filename}
 
-### 🧠 DECISION LOGIC (SEMANTIC ANALYSIS)
-
-**1. POSITIVE SIGNALS (Keep These)**
-- **Explicit Demands:** "Please find attached invoice", "Payment due", "Here is your bill"
-- **Proof of Payment:** "Your receipt from Uber", "Payment successful", "Thank you for your purchase"
-- **Passive Financials:** "Monthly Statement", "Subscription Renewal", "Credit Note", "Zikui", "Hashbonit"
-- **Ambiguous Files with Context:** If filename is "scan001.pdf" BUT body says "Attached the invoice", **KEEP IT**
-
-**2. NEGATIVE SIGNALS (Discard These)**
-- **Marketing:** "Special offer", "News from...", "Join our webinar"
-- **Logistics (Non-Financial):** "Your package has shipped" (unless includes receipt)
-- **Technical:** "Password reset", "Security alert", "Webhook notification", "System Event"
-- **Human Chatter:** "See you at lunch", "Meeting notes" (unless expensing receipt)
-
-**3. THE "SAFEGUARD" RULE (Never Miss Money)**
-- If unsure (e.g., Order Confirmation that *might* be invoice), output **TRUE**
-- Better to process a junk file than throw away a $10,000 invoice
-
-### OUTPUT FORMAT (Strict JSON)
+{GATEKEEPER_DECISION_LOGIC}### OUTPUT FORMAT (Strict JSON)
 {{
     "is_financial_document": boolean,
     "document_category": "INVOICE | RECEIPT | STATEMENT | JUNK | OTHER",
@@ -568,39 +1000,190 @@ Your ONLY job is to decide if an incoming email contains a **Financial Document*
 }}
 """
         
+    @staticmethod
+    def _gatekeeper_config():
+        """Generation config for single-email Gatekeeper calls"""
+        return types.GenerateContentConfig(
+            temperature=0.1,
+            response_mime_type='application/json'
+        )
+            
+    @staticmethod
+    def _parse_gatekeeper_response(response_text):
+        """Gatekeeper verdict from a single-email response, with defaults for missing fields"""
+        result = json.loads(response_text or "{}")
+            
+        # Ensure all required fields present
+        return {
+            "is_financial_document": result.get("is_financial_document", False),
+            "document_category": result.get("document_category", "OTHER"),
+            "confidence": result.get("confidence", 0.5),
+            "reasoning": result.get("reasoning", "No reasoning provided")
+        }
+        
+    @staticmethod
+    def _gatekeeper_error_verdict(error):
+        """Fail-safe KEEP verdict when a single-email Gatekeeper call fails"""
+        print(f"Gatekeeper AI error: {error}")
+        # Fail-safe: If AI errors, let it through (better false positive than false negative)
+        return {
+            "is_financial_document": True,
+            "document_category": "OTHER",
+            "confidence": 0.5,
+            "reasoning": f"AI filter error: {str(error)} - Defaulting to KEEP for safety"
+        }
+    
+    def gatekeeper_email_filter_batch(self, emails, batch_size=None):
+        """
+        Elite Gatekeeper AI Filter for many emails per Gemini call
+        
+        Emails are sent in chunks of GATEKEEPER_BATCH_SIZE as one structured-output
+        request each; any email a successful batch response does not answer falls
+        back to gatekeeper_email_filter, and a failed request fails safe to KEEP. With
+        GEMINI_ASYNC_ENABLED the chunks are sent concurrently on the asyncio path.
+        
+        Args:
+            emails: List of dicts with sender_email, email_subject,
+                    email_body_snippet and attachment_filename
+            batch_size: Emails per request (default: config.GATEKEEPER_BATCH_SIZE)
+        
+        Returns:
+            list: One gatekeeper_email_filter-style verdict dict per email, in input order
+        """
+        batch_size = max(1, min(batch_size or config.GATEKEEPER_BATCH_SIZE, 50))
+        if config.GEMINI_ASYNC_ENABLED and len(emails) > batch_size:
+            from services.async_gemini_service import AsyncGeminiService
+            async_gemini = AsyncGeminiService(self)
+            return async_gemini.run(async_gemini.gatekeeper_email_filter_batch(emails, batch_size))
+        
+        verdicts = []
+        for start in range(0, len(emails), batch_size):
+            verdicts.extend(self._gatekeeper_batch_chunk(emails[start:start + batch_size]))
+        return verdicts
+    
+    def _gatekeeper_batch_chunk(self, emails):
+        """
+        Classify one chunk of emails in a single request
+        
+        Emails a successful response leaves unanswered go through the single-email
+        filter. If the request itself fails (429, quota, timeout after retries), the
+        whole chunk gets the fail-safe KEEP verdict instead of one extra call per email.
+        """
+        if len(emails) == 1:
+            return [self.gatekeeper_email_filter(**emails[0])]
+        
         try:
-            # Use Gemini Flash with automatic fallback (rate limit protection)
             response = self._generate_content_with_fallback(
                 model='gemini-2.0-flash-exp',
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.1,
-                    response_mime_type='application/json'
-                )
+                contents=self._gatekeeper_batch_prompt(emails),
+                config=self._gatekeeper_batch_config(),
+                call_site='gatekeeper_batch'
             )
-            
-            response_text = response.text or "{}"
-            result = json.loads(response_text)
-            
-            # Ensure all required fields present
-            return {
-                "is_financial_document": result.get("is_financial_document", False),
-                "document_category": result.get("document_category", "OTHER"),
-                "confidence": result.get("confidence", 0.5),
-                "reasoning": result.get("reasoning", "No reasoning provided")
-            }
-            
         except Exception as e:
-            print(f"Gatekeeper AI error: {e}")
-            # Fail-safe: If AI errors, let it through (better false positive than false negative)
-            return {
-                "is_financial_document": True,
-                "document_category": "OTHER",
-                "confidence": 0.5,
-                "reasoning": f"AI filter error: {str(e)} - Defaulting to KEEP for safety"
+            verdict = self._gatekeeper_error_verdict(e)
+            return [dict(verdict) for _ in emails]
+        
+        try:
+            answered = self._parse_gatekeeper_batch_response(response.text, len(emails))
+        except (TypeError, ValueError) as e:
+            print(f"Gatekeeper batch response could not be parsed: {e}")
+            answered = {}
+        
+        missing = len(emails) - len(answered)
+        if missing:
+            print(f"⚠️ Gatekeeper batch left {missing}/{len(emails)} emails unanswered, classifying them individually")
+        
+        return [
+            answered[email_id] if email_id in answered else self.gatekeeper_email_filter(**email)
+            for email_id, email in enumerate(emails)
+        ]
+    
+    @staticmethod
+    def _gatekeeper_batch_prompt(emails):
+        """Numbered multi-email Gatekeeper prompt"""
+        email_blocks = "\n".join(
+            f"""<email id="{email_id}">
+- **Sender:** {email.get('sender_email', '')}
+- **Subject:** {email.get('email_subject', '')}
+- **Body Snippet:** {(email.get('email_body_snippet') or '')[:config.GATEKEEPER_BATCH_SNIPPET_CHARS]}
+- **Attachment Name:** {email.get('attachment_filename') or 'no_attachment'}
+</email>"""
+            for email_id, email in enumerate(emails)
+        )
+        
+        return f"""
+You are the **Chief Financial Mailroom Guard**.
+Your ONLY job is to decide, for EACH email below, if it contains a **Financial Document** that needs processing.
+Judge every email independently. You will receive a numbered batch of {len(emails)} emails.
+
+### INPUT EMAILS
+{email_blocks}
+
+{GATEKEEPER_DECISION_LOGIC}### OUTPUT FORMAT (Strict JSON)
+Return a JSON array with exactly one verdict per email id (0 to {len(emails) - 1}):
+[
+  {{
+    "email_id": integer,
+    "is_financial_document": boolean,
+    "document_category": "INVOICE | RECEIPT | STATEMENT | JUNK | OTHER",
+    "confidence": 0.0-1.0,
+    "reasoning": "Explain why in one sentence."
+  }}
+]
+"""
+        
+    @staticmethod
+    def _gatekeeper_batch_config():
+        """Structured-output config for batch Gatekeeper calls (one verdict object per email id)"""
+        return types.GenerateContentConfig(
+            temperature=0.1,
+            response_mime_type='application/json',
+            response_schema={
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "email_id": {"type": "integer"},
+                        "is_financial_document": {"type": "boolean"},
+                        "document_category": {"type": "string", "enum": GATEKEEPER_CATEGORIES},
+                        "confidence": {"type": "number"},
+                        "reasoning": {"type": "string"}
+                    },
+                    "required": ["email_id", "is_financial_document", "document_category", "confidence", "reasoning"]
+                }
             }
+        )
+    
+    @staticmethod
+    def _parse_gatekeeper_batch_response(response_text, email_count):
+        """
+        Verdicts from a batch Gatekeeper response
+        
+        Returns:
+            dict of {email_id: verdict} for the ids the response answered
+        """
+        answered = {}
+        result = json.loads(response_text or "[]")
+        if isinstance(result, dict):
+            result = result.get('verdicts', [])
+            
+        for item in result:
+            if not isinstance(item, dict):
+                continue
+            try:
+                email_id = int(item.get('email_id'))
+            except (TypeError, ValueError):
+                continue
+            if 0 <= email_id < email_count:
+                answered[email_id] = {
+                    "is_financial_document": item.get("is_financial_document", False),
+                    "document_category": item.get("document_category", "OTHER"),
+                    "confidence": item.get("confidence", 0.5),
+                    "reasoning": item.get("reasoning", "No reasoning provided")
+                }
+        return answered
     
-    def generate_text(self, prompt, temperature=0.1, response_mime_type='application/json'):
+    def generate_text(self, prompt, temperature=0.1, response_mime_type='application/json', use_cache=True, call_site='generate_text'):
         """
         Generate text using Gemini with automatic fallback
         
@@ -608,7 +1191,9 @@ Your ONLY job is to decide if an incoming email contains a **Financial Document*
             prompt: Text prompt to send to Gemini
             temperature: Sampling temperature (0.0-1.0)
             response_mime_type: MIME type for response (default: application/json)
-            
+            use_cache: Set False to bypass the persistent response cache
+            call_site: Caller name for cache metrics / opt-out
+        
         Returns:
             String response from Gemini
         """
@@ -618,7 +1203,9 @@ Your ONLY job is to decide if an incoming email contains a **Financial Document*
             config=types.GenerateContentConfig(
                 temperature=temperature,
                 response_mime_type=response_mime_type
-            )
+            ),
+            use_cache=use_cache,
+            call_site=call_site
         )
         
         return response.text or "{}"
@@ -745,7 +1332,23 @@ Your ONLY job is to decide if an incoming email contains a **Financial Document*
                 reasoning: str explanation
         """
         
-        prompt = f"""Analyze this URL and classify what type of link it is for invoice/receipt extraction.
+        try:
+            response = self._generate_content_with_fallback(
+                self.model_name,
+                self._link_type_prompt(url, email_context),
+                self._link_type_config(),
+                call_site='link_classification'
+            )
+            
+            return self._parse_link_type_response(response.text)
+        
+        except Exception as e:
+            return self._link_type_error(e)
+    
+    @staticmethod
+    def _link_type_prompt(url, email_context=""):
+        """Link classification prompt"""
+        return f"""Analyze this URL and classify what type of link it is for invoice/receipt extraction.
 
 URL: {url}
 Email Context: {email_context}
@@ -774,27 +1377,28 @@ Return ONLY valid JSON:
   "confidence": 0.0-1.0,
   "reasoning": "Brief explanation of classification"
 }}"""
-
-        try:
-            config = {
-                'response_mime_type': 'application/json'
-            }
-            
-            response = self._generate_content_with_fallback(
-                self.model_name,
-                prompt,
-                config
-            )
+        
+    @staticmethod
+    def _link_type_config():
+        return {
+            'response_mime_type': 'application/json',
+            'temperature': 0.1
+        }
             
-            result = json.loads(response.text)
+    @staticmethod
+    def _parse_link_type_response(response_text):
+        """(link_type, confidence, reasoning) from a link classification response"""
+        result = json.loads(response_text)
             
-            return (
-                result.get('linkType', 'auth_required'),
-                result.get('confidence', 0.0),
-                result.get('reasoning', 'No reasoning provided')
-            )
+        return (
+            result.get('linkType', 'auth_required'),
+            result.get('confidence', 0.0),
+            result.get('reasoning', 'No reasoning provided')
+        )
             
-        except Exception as e:
-            print(f"Link classification error: {e}")
-            # Safe fallback: assume auth required if classification fails
-            return ('auth_required', 0.0, f'Classification failed: {str(e)}')
+    @staticmethod
+    def _link_type_error(error):
+        """Safe fallback when link classification fails: assume auth required"""
+        print(f"Link classification error: {error}")
+        return ('auth_required', 0.0, f'Classification failed: {str(error)}')
+        
\ No newline at end of file
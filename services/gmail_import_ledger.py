@@ -0,0 +1,231 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import config
+
+# Message extraction outcomes
+STATUS_EXTRACTED = 'extracted'
+STATUS_NO_DOCUMENTS = 'no_documents'
+STATUS_FAILED = 'failed'
+
+# Attachment / downloaded document outcomes
+DOCUMENT_EXTRACTED = 'extracted'
+DOCUMENT_INCOMPLETE = 'incomplete'
+DOCUMENT_FAILED = 'failed'
+DOCUMENT_SKIPPED = 'skipped'
+
+
+class GmailImportLedger:
+    """
+    Persistent record of what Gmail imports already did, per account
+    
+    Messages are keyed by (account, message id) with their Gatekeeper verdict and
+    extraction outcome; documents are keyed by (account, SHA-256 of the attachment
+    or downloaded file), so the same invoice arriving in several emails is
+    extracted (and inserted into BigQuery) once. Imports look every message up
+    before fetching or classifying it and skip the settled ones. Failed
+    extractions stay unsettled and are retried by the next import; incremental
+    imports add them back (get_unsettled_messages), since the Gmail history
+    does not list them again. Rows older
+    than GMAIL_IMPORT_LEDGER_RETENTION_DAYS are pruned. Lives in SQLite so every
+    gunicorn worker shares the same ledger.
+    """
+    
+    def __init__(self, db_path=None, retention_days=None):
+        self.db_path = db_path or config.GMAIL_IMPORT_LEDGER_DB_PATH
+        self.retention_seconds = (retention_days or config.GMAIL_IMPORT_LEDGER_RETENTION_DAYS) * 86400
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS gmail_messages (
+                    account TEXT NOT NULL,
+                    message_id TEXT NOT NULL,
+                    verdict TEXT,
+                    confidence REAL,
+                    reasoning TEXT,
+                    extraction_status TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (account, message_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS gmail_documents (
+                    account TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    message_id TEXT NOT NULL,
+                    filename TEXT,
+                    status TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (account, content_hash)
+                )
+            """)
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def is_settled(entry):
+        """True when an import needs to do nothing more for this message (rejected, or extracted)"""
+        return bool(entry) and (
+            entry.get('verdict') == 'kill'
+            or entry.get('extraction_status') in (STATUS_EXTRACTED, STATUS_NO_DOCUMENTS)
+        )
+    
+    @staticmethod
+    def extraction_status(document_outcomes):
+        """
+        Message-level outcome from its documents' outcomes
+        
+        Any failure keeps the message unsettled (retried next import; its extracted
+        documents are skipped by hash). No documents at all means nothing to extract.
+        """
+        if DOCUMENT_FAILED in document_outcomes:
+            return STATUS_FAILED
+        return STATUS_EXTRACTED if document_outcomes else STATUS_NO_DOCUMENTS
+    
+    def get_messages(self, account, message_ids):
+        """
+        Ledger entries for many messages
+        
+        Returns:
+            dict of {message_id: {'verdict', 'confidence', 'reasoning', 'extraction_status'}}
+            for the messages seen before
+        """
+        message_ids = list(dict.fromkeys(message_ids))
+        found = {}
+        try:
+            with self._connect() as conn:
+                for start in range(0, len(message_ids), 500):
+                    chunk = message_ids[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = conn.execute(
+                        f"""
+                        SELECT message_id, verdict, confidence, reasoning, extraction_status
+                        FROM gmail_messages WHERE account = ? AND message_id IN ({placeholders})
+                        """,
+                        [account.casefold()] + chunk
+                    )
+                    for message_id, verdict, confidence, reasoning, extraction_status in rows:
+                        found[message_id] = {
+                            'verdict': verdict,
+                            'confidence': confidence,
+                            'reasoning': reasoning,
+                            'extraction_status': extraction_status
+                        }
+        except Exception as e:
+            print(f"⚠️ Gmail import ledger read error (non-critical): {e}")
+        return found
+    
+    def get_unsettled_messages(self, account, limit=500):
+        """
+        Messages kept by the Gatekeeper whose extraction failed or never finished
+        
+        Returns:
+            List of message IDs, most recently touched first
+        """
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT message_id FROM gmail_messages
+                    WHERE account = ? AND verdict = 'keep'
+                        AND (extraction_status IS NULL OR extraction_status NOT IN (?, ?))
+                    ORDER BY updated_at DESC LIMIT ?
+                    """,
+                    (account.casefold(), STATUS_EXTRACTED, STATUS_NO_DOCUMENTS, limit)
+                ).fetchall()
+        except Exception as e:
+            print(f"⚠️ Gmail import ledger read error (non-critical): {e}")
+            return []
+        return [row[0] for row in rows]
+    
+    def record_verdicts(self, account, verdicts):
+        """
+        Store Gatekeeper verdicts (keeps any extraction outcome already recorded)
+        
+        Args:
+            account: Mailbox address
+            verdicts: List of (message_id, is_kept, confidence, reasoning)
+        """
+        now = time.time()
+        rows = [
+            (account.casefold(), message_id, 'keep' if is_kept else 'kill', confidence, reasoning, now)
+            for message_id, is_kept, confidence, reasoning in verdicts
+        ]
+        if not rows:
+            return
+        
+        try:
+            with self._lock, self._connect() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO gmail_messages (account, message_id, verdict, confidence, reasoning, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(account, message_id) DO UPDATE SET
+                        verdict = excluded.verdict,
+                        confidence = excluded.confidence,
+                        reasoning = excluded.reasoning,
+                        updated_at = excluded.updated_at
+                    """,
+                    rows
+                )
+                cutoff = now - self.retention_seconds
+                conn.execute("DELETE FROM gmail_messages WHERE updated_at < ?", (cutoff,))
+                conn.execute("DELETE FROM gmail_documents WHERE updated_at < ?", (cutoff,))
+        except Exception as e:
+            print(f"⚠️ Gmail import ledger write error (non-critical): {e}")
+    
+    def record_extraction(self, account, message_id, status):
+        """Store a message's extraction outcome (STATUS_*); the message counts as kept"""
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO gmail_messages (account, message_id, verdict, extraction_status, updated_at)
+                    VALUES (?, ?, 'keep', ?, ?)
+                    ON CONFLICT(account, message_id) DO UPDATE SET
+                        extraction_status = excluded.extraction_status,
+                        updated_at = excluded.updated_at
+                    """,
+                    (account.casefold(), message_id, status, time.time())
+                )
+        except Exception as e:
+            print(f"⚠️ Gmail import ledger write error (non-critical): {e}")
+    
+    def document_handled(self, account, content_hash):
+        """True when this document was already extracted (completely or not) for the account"""
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT status FROM gmail_documents WHERE account = ? AND content_hash = ?",
+                    (account.casefold(), content_hash)
+                ).fetchone()
+        except Exception as e:
+            print(f"⚠️ Gmail import ledger read error (non-critical): {e}")
+            return False
+        return bool(row) and row[0] in (DOCUMENT_EXTRACTED, DOCUMENT_INCOMPLETE)
+    
+    def record_document(self, account, content_hash, message_id, filename, status):
+        """Store the outcome (DOCUMENT_*) of extracting one attachment or downloaded file"""
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO gmail_documents (account, content_hash, message_id, filename, status, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (account.casefold(), content_hash, message_id, filename, status, time.time())
+                )
+        except Exception as e:
+            print(f"⚠️ Gmail import ledger write error (non-critical): {e}")
@@ -2,12 +2,20 @@ import os
 import json
 import base64
 import re
+import math
 import requests
 from datetime import datetime, timedelta
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from config import config
+from utils.metrics import metrics
+
+
+class GmailHistoryExpiredError(Exception):
+    """The sync checkpoint's startHistoryId is too old for users.history.list (HTTP 404)"""
+    pass
+
 
 class GmailService:
     """Service for Gmail OAuth and invoice email extraction"""
@@ -19,6 +27,18 @@ class GmailService:
         'openid'
     ]
     
+    # Stage 1 Broad Net: multi-language subject keywords and excluded subjects
+    BROAD_NET_SUBJECT_TERMS = (
+        'invoice', 'bill', 'receipt', 'statement', 'payment', 'order', 'subscription',
+        'חשבונית', 'קבלה', 'תשלום',
+        'facture', 'rechnung', 'recibo'
+    )
+    BROAD_NET_EXCLUDED_SUBJECTS = ('invitation', 'newsletter', 'webinar', 'verify')
+    
+    # Gatekeeper view of a message: headers, snippet and attachment filenames, no bodies
+    GATEKEEPER_HEADERS = ('date', 'from', 'subject')
+    GATEKEEPER_FIELDS = 'id,threadId,snippet,payload(filename,headers(name,value),parts(filename,parts(filename,parts(filename))))'
+    
     def __init__(self):
         self.client_id = os.getenv('GMAIL_CLIENT_ID')
         self.client_secret = os.getenv('GMAIL_CLIENT_SECRET')
@@ -133,13 +153,8 @@ class GmailService:
         # AI Gatekeeper will filter out junk emails in Stage 2
         query = (
             f'after:{after_date} '
-            '('
-            'subject:invoice OR subject:bill OR subject:receipt OR subject:statement OR '
-            'subject:payment OR subject:order OR subject:subscription OR '
-            'subject:חשבונית OR subject:קבלה OR subject:תשלום OR '
-            'subject:facture OR subject:rechnung OR subject:recibo'
-            ') '
-            '-subject:"invitation" -subject:"newsletter" -subject:"webinar" -subject:"verify"'
+            '(' + ' OR '.join(f'subject:{term}' for term in self.BROAD_NET_SUBJECT_TERMS) + ') '
+            + ' '.join(f'-subject:"{term}"' for term in self.BROAD_NET_EXCLUDED_SUBJECTS)
         )
         
         try:
@@ -151,11 +166,101 @@ class GmailService:
             
             messages = results.get('messages', [])
             return messages
-            
+        
         except Exception as e:
             print(f"Error searching Gmail: {e}")
             return []
     
+    def estimate_message_count(self, service, days):
+        """
+        Approximate number of emails in the last `days` days, in a single API call
+        
+        Uses the mailbox messagesTotal for "all time" (days >= 9999) and the
+        messages.list resultSizeEstimate otherwise; both are estimates, not exact counts.
+        """
+        if days >= 9999:
+            return int(self.get_profile(service).get('messagesTotal', 0))
+        
+        after_date = (datetime.now() - timedelta(days=days)).strftime('%Y/%m/%d')
+        response = service.users().messages().list(
+            userId='me',
+            q=f'after:{after_date}',
+            maxResults=1,
+            fields='resultSizeEstimate'
+        ).execute()
+        return int(response.get('resultSizeEstimate', 0))
+    
+    def matches_broad_net(self, metadata):
+        """
+        Local equivalent of the Stage 1 query for messages found without a search (incremental sync)
+        
+        Args:
+            metadata: Email metadata dict from get_email_metadata
+        
+        Returns: True if the subject has a broad-net keyword and no excluded term
+        """
+        subject = (metadata.get('subject') or '').casefold()
+        words = set(re.findall(r'\w+', subject))
+        if any(term in words for term in self.BROAD_NET_EXCLUDED_SUBJECTS):
+            return False
+        return any(term in words for term in self.BROAD_NET_SUBJECT_TERMS)
+    
+    def get_profile(self, service):
+        """Mailbox profile: emailAddress, messagesTotal, threadsTotal and the current historyId"""
+        return service.users().getProfile(userId='me').execute()
+    
+    def list_new_messages(self, service, start_history_id):
+        """
+        Messages added to the mailbox since a sync checkpoint (users.history.list)
+        
+        Spam and trash are skipped, as in messages.list. Every history page is read
+        and nothing is truncated: the next checkpoint moves past all of this mail, so
+        a message left out here would never be listed again. Cost scales with the
+        new mail, not the mailbox size.
+        
+        Args:
+            service: Gmail API service
+            start_history_id: historyId saved by the previous import
+        
+        Returns list of {'id', 'threadId'} message references, like search_invoice_emails
+        
+        Raises:
+            GmailHistoryExpiredError: Gmail no longer has history that far back
+        """
+        added = {}
+        page_token = None
+        
+        while True:
+            params = {
+                'userId': 'me',
+                'startHistoryId': start_history_id,
+                'historyTypes': ['messageAdded'],
+                'maxResults': 500
+            }
+            if page_token:
+                params['pageToken'] = page_token
+            
+            try:
+                response = service.users().history().list(**params).execute()
+            except Exception as e:
+                if getattr(getattr(e, 'resp', None), 'status', None) == 404:
+                    raise GmailHistoryExpiredError(str(e))
+                raise
+            
+            for record in response.get('history', []):
+                for item in record.get('messagesAdded', []):
+                    message = item.get('message', {})
+                    labels = set(message.get('labelIds', []))
+                    if message.get('id') and not labels & {'SPAM', 'TRASH'}:
+                        added[message['id']] = {'id': message['id'], 'threadId': message.get('threadId')}
+            
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        
+        # History is oldest first; search results are newest first
+        return list(reversed(list(added.values())))
+    
     def get_message_details(self, service, message_id):
         """Get full details of a Gmail message"""
         try:
@@ -170,6 +275,73 @@ class GmailService:
             print(f"Error getting message {message_id}: {e}")
             return None
     
+    def get_messages_metadata(self, service, message_ids, batch_size=None):
+        """
+        Fetch the Gatekeeper view of many messages through the Gmail batch endpoint
+        
+        One HTTP round-trip per GMAIL_BATCH_SIZE messages (max 100). Only the
+        Date/From/Subject headers, the snippet and the attachment filenames are
+        returned; the full message is fetched later with get_message_details for
+        the emails the Gatekeeper keeps. Messages that fail inside a batch (e.g.,
+        a per-request 429) are retried once individually.
+        
+        Args:
+            service: Gmail API service
+            message_ids: Message IDs to fetch
+            batch_size: Requests per batch (default: config.GMAIL_BATCH_SIZE)
+        
+        Returns:
+            dict of {message_id: message or None}; get_email_metadata accepts the messages
+        """
+        batch_size = max(1, min(batch_size or config.GMAIL_BATCH_SIZE, 100))
+        message_ids = list(dict.fromkeys(message_ids))
+        messages = {}
+        failed = []
+        
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                failed.append(request_id)
+            else:
+                messages[request_id] = self._trim_headers(response)
+        
+        for start in range(0, len(message_ids), batch_size):
+            chunk = message_ids[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=on_response)
+            for message_id in chunk:
+                batch.add(self._metadata_request(service, message_id), request_id=message_id)
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f"⚠️ Gmail batch metadata fetch failed, retrying {len(chunk)} messages individually: {e}")
+                failed.extend(message_id for message_id in chunk if message_id not in messages and message_id not in failed)
+        
+        for message_id in failed:
+            try:
+                messages[message_id] = self._trim_headers(self._metadata_request(service, message_id).execute())
+            except Exception as e:
+                print(f"Error getting message {message_id}: {e}")
+                messages[message_id] = None
+        
+        return messages
+    
+    def _metadata_request(self, service, message_id):
+        # format='metadata' omits the MIME parts (and with them the attachment filenames),
+        # so ask for the full message through a fields mask that drops every body
+        return service.users().messages().get(
+            userId='me',
+            id=message_id,
+            format='full',
+            fields=self.GATEKEEPER_FIELDS
+        )
+    
+    def _trim_headers(self, message):
+        payload = message.get('payload', {})
+        payload['headers'] = [
+            header for header in payload.get('headers', [])
+            if header.get('name', '').lower() in self.GATEKEEPER_HEADERS
+        ]
+        return message
+    
     def extract_attachments(self, service, message):
         """
         Extract PDF attachments from a Gmail message
@@ -197,7 +369,7 @@ class GmailService:
                         
                         file_data = base64.urlsafe_b64decode(attachment['data'])
                         attachments.append((part['filename'], file_data))
-                        
+                    
                     except Exception as e:
                         print(f"Error downloading attachment: {e}")
             
@@ -309,7 +481,7 @@ class GmailService:
                 url_lower = url.lower()
                 if any(keyword in url_lower for keyword in ['invoice', 'receipt', 'bill', 'download', 'pdf', 'document']):
                     links.append(url)
-            
+        
         except Exception as e:
             print(f"Error extracting links from body: {e}")
         
@@ -360,32 +532,85 @@ class GmailService:
         
         Returns: (is_invoice: bool, confidence: float, reasoning: str)
         """
-        subject = metadata.get('subject', '')
-        sender = metadata.get('from', '')
-        snippet = metadata.get('snippet', '')
-        attachments = metadata.get('attachments', [])
-        
-        # Get first attachment filename (or "no_attachment" if none)
-        attachment_filename = attachments[0] if attachments else "no_attachment"
-        
         # Use AI Gatekeeper if available
         if gemini_service:
-            result = gemini_service.gatekeeper_email_filter(
-                sender_email=sender,
-                email_subject=subject,
-                email_body_snippet=snippet,
-                attachment_filename=attachment_filename
-            )
-            
-            is_invoice = result["is_financial_document"]
-            confidence = result["confidence"]
-            reasoning = f"[AI Gatekeeper] {result['document_category']} - {result['reasoning']}"
-            
-            return is_invoice, confidence, reasoning
+            result = gemini_service.gatekeeper_email_filter(**self._gatekeeper_input(metadata))
+            return self._gatekeeper_verdict(result)
+        
+        return self._classify_by_heuristics(metadata)
+    
+    def classify_invoice_emails(self, metadata_list, gemini_service=None, prefilter=None):
+        """
+        Batched classify_invoice_email: one Gemini gatekeeper request per GATEKEEPER_BATCH_SIZE emails
+        
+        With a prefilter (EmailPrefilter), confident cases are decided locally and
+        only the uncertain band is sent to the Gatekeeper, whose verdicts are then
+        fed back to the prefilter.
         
-        # Fallback to basic heuristics if Gemini unavailable (should rarely happen)
-        subject_lower = subject.lower()
-        snippet_lower = snippet.lower()
+        Args:
+            metadata_list: List of email metadata dicts
+            gemini_service: GeminiService instance for AI filtering
+            prefilter: Optional EmailPrefilter instance
+        
+        Returns: List of (is_invoice, confidence, reasoning) tuples, in input order
+        """
+        if not gemini_service:
+            return [self._classify_by_heuristics(metadata) for metadata in metadata_list]
+        
+        verdicts = [None] * len(metadata_list)
+        if prefilter:
+            for position, (decision, keep_probability, reasoning) in enumerate(prefilter.classify_many(metadata_list)):
+                if decision:
+                    verdicts[position] = (
+                        decision == 'keep',
+                        keep_probability if decision == 'keep' else 1.0 - keep_probability,
+                        f"[Local Pre-filter] {decision.upper()} - {reasoning}"
+                    )
+        
+        pending = [position for position, verdict in enumerate(verdicts) if verdict is None]
+        if prefilter:
+            batch_size = max(1, min(config.GATEKEEPER_BATCH_SIZE, 50))
+            avoided = math.ceil(len(metadata_list) / batch_size) - math.ceil(len(pending) / batch_size)
+            if avoided:
+                metrics.increment('gemini_calls_avoided_total', avoided, call_site='gatekeeper_batch')
+        
+        if pending:
+            results = gemini_service.gatekeeper_email_filter_batch(
+                [self._gatekeeper_input(metadata_list[position]) for position in pending]
+            )
+            labelled = []
+            for position, result in zip(pending, results):
+                verdicts[position] = self._gatekeeper_verdict(result)
+                # Fail-safe KEEPs after an AI error are not real verdicts; don't learn from them
+                if not str(result.get('reasoning', '')).startswith('AI filter error'):
+                    is_invoice, confidence, _ = verdicts[position]
+                    labelled.append((metadata_list[position], bool(is_invoice and confidence >= 0.3)))
+            if prefilter:
+                prefilter.learn_many(labelled)
+        
+        return verdicts
+    
+    def _gatekeeper_input(self, metadata):
+        """Map email metadata to gatekeeper_email_filter keyword arguments"""
+        attachments = metadata.get('attachments', [])
+        return {
+            'sender_email': metadata.get('from', ''),
+            'email_subject': metadata.get('subject', ''),
+            'email_body_snippet': metadata.get('snippet', ''),
+            # First attachment filename (or "no_attachment" if none)
+            'attachment_filename': attachments[0] if attachments else "no_attachment"
+        }
+    
+    def _gatekeeper_verdict(self, result):
+        is_invoice = result["is_financial_document"]
+        confidence = result["confidence"]
+        reasoning = f"[AI Gatekeeper] {result['document_category']} - {result['reasoning']}"
+        return is_invoice, confidence, reasoning
+    
+    def _classify_by_heuristics(self, metadata):
+        """Fallback to basic heuristics if Gemini unavailable (should rarely happen)"""
+        subject_lower = metadata.get('subject', '').lower()
+        snippet_lower = metadata.get('snippet', '').lower()
         
         invoice_keywords = ['invoice', 'receipt', 'bill', 'payment', 'statement', 'order', 
                            'חשבונית', 'קבלה', 'תשלום']
@@ -433,7 +658,7 @@ class GmailService:
             print(f"   Body preview: {body[:100]}...")
             
             return True
-            
+        
         except Exception as e:
             print(f"❌ Error sending email: {e}")
             return False
@@ -573,7 +798,7 @@ class GmailService:
                 'link_classification': link_type,
                 'reasoning': f'Unknown link type: {link_type}'
             }
-            
+        
         except Exception as e:
             print(f"❌ Intelligent link processing error: {e}")
             return {
@@ -0,0 +1,83 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import config
+
+
+class GmailSyncCheckpoints:
+    """
+    Per-account Gmail sync checkpoints (the mailbox historyId at the start of the last completed import)
+    
+    The next import of the same account lists only the messages added since that
+    historyId (users.history.list) instead of re-scanning the whole `days` window.
+    Checkpoints older than GMAIL_SYNC_CHECKPOINT_MAX_AGE_DAYS are treated as expired,
+    since Gmail only keeps history records for a limited time. Lives in SQLite so
+    every gunicorn worker sees the same checkpoints.
+    """
+    
+    def __init__(self, db_path=None, max_age_days=None):
+        self.db_path = db_path or config.GMAIL_SYNC_DB_PATH
+        self.max_age_seconds = (max_age_days or config.GMAIL_SYNC_CHECKPOINT_MAX_AGE_DAYS) * 86400
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS gmail_sync_checkpoints (
+                    account TEXT PRIMARY KEY,
+                    history_id TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def get(self, account):
+        """
+        Last checkpoint for an account
+        
+        Returns:
+            historyId string, or None when there is no unexpired checkpoint
+        """
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT history_id, updated_at FROM gmail_sync_checkpoints WHERE account = ?",
+                    (account.casefold(),)
+                ).fetchone()
+        except Exception as e:
+            print(f"⚠️ Gmail sync checkpoint read error (non-critical): {e}")
+            return None
+        
+        if not row or time.time() - row[1] > self.max_age_seconds:
+            return None
+        return row[0]
+    
+    def save(self, account, history_id):
+        """Record the historyId a completed import started from"""
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO gmail_sync_checkpoints (account, history_id, updated_at) VALUES (?, ?, ?)",
+                    (account.casefold(), str(history_id), time.time())
+                )
+        except Exception as e:
+            print(f"⚠️ Gmail sync checkpoint write error (non-critical): {e}")
+    
+    def clear(self, account):
+        """Drop an account's checkpoint (e.g., after Gmail reports it expired)"""
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute("DELETE FROM gmail_sync_checkpoints WHERE account = ?", (account.casefold(),))
+        except Exception as e:
+            print(f"⚠️ Gmail sync checkpoint write error (non-critical): {e}")
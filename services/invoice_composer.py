@@ -225,7 +225,8 @@ class InvoiceComposer:
                     max_output_tokens=2048,
                     response_mime_type="application/json",
                     system_instruction="You are an expert invoice parser. Return only valid JSON."
-                )
+                ),
+                call_site='magic_fill'
             )
             
             # Parse the response
@@ -407,7 +408,8 @@ class InvoiceComposer:
                     max_output_tokens=2048,
                     response_mime_type="application/json",
                     system_instruction="You are an expert invoice auditor. Return only valid JSON."
-                )
+                ),
+                call_site='invoice_composer_validate'
             )
             
             # Parse the response
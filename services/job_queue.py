@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from config import config
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when the job queue already holds the maximum number of pending jobs"""
+
+
+class JobQueue:
+    """
+    Bounded background job queue for long-running invoice pipelines
+    
+    Jobs run on a fixed-size worker pool inside the accepting gunicorn worker.
+    Job state (status, per-layer progress, final result) is persisted in SQLite
+    so that GET /jobs/<id> works no matter which worker serves the poll.
+    """
+    
+    def __init__(self, db_path=None, max_workers=None, max_pending=None, ttl_seconds=None):
+        self.db_path = db_path or config.JOB_QUEUE_DB_PATH
+        self.max_workers = max_workers or config.JOB_QUEUE_WORKERS
+        self.max_pending = max_pending or config.JOB_QUEUE_MAX_PENDING
+        self.ttl_seconds = ttl_seconds or config.JOB_QUEUE_TTL_SECONDS
+        
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='invoice-job')
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    job_type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    layers_json TEXT NOT NULL,
+                    result_json TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def submit(self, job_type, func, *args, **kwargs):
+        """
+        Enqueue a job
+        
+        The callable receives an extra ``progress_callback(layer, status, **details)``
+        keyword argument that records per-layer progress on the job.
+        
+        Args:
+            job_type: Short label (e.g., 'upload', 'process')
+            func: Callable returning a JSON-serializable result dictionary
+            *args, **kwargs: Arguments forwarded to func
+        
+        Returns:
+            job_id string
+        
+        Raises:
+            JobQueueFullError: If max_pending jobs are already queued or running
+        """
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+            self._pending += 1
+        
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO jobs (job_id, job_type, status, layers_json, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, job_type, 'queued', '{}', now)
+                )
+                conn.execute(
+                    "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                    (now - self.ttl_seconds,)
+                )
+            self.executor.submit(self._run, job_id, func, args, kwargs)
+        except Exception:
+            with self._pending_lock:
+                self._pending -= 1
+            raise
+        
+        print(f"📥 Job {job_id} queued ({job_type})")
+        return job_id
+    
+    def _run(self, job_id, func, args, kwargs):
+        """Worker body: mark running, execute, store result or error"""
+        layers = {}
+        
+        def progress_callback(layer, status, **details):
+            layers[layer] = dict(details, status=status) if details else status
+            self._update(job_id, layers_json=json.dumps(layers, default=str))
+        
+        try:
+            self._update(job_id, status='running', started_at=time.time())
+            result = func(*args, progress_callback=progress_callback, **kwargs)
+            
+            status = 'failed' if isinstance(result, dict) and result.get('status') == 'error' else 'completed'
+            self._update(
+                job_id,
+                status=status,
+                result_json=json.dumps(result, default=str),
+                error=result.get('error') if isinstance(result, dict) else None,
+                finished_at=time.time()
+            )
+            print(f"✓ Job {job_id} {status}")
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            traceback.print_exc()
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+    
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+                (*fields.values(), job_id)
+            )
+    
+    def get(self, job_id):
+        """
+        Get a job snapshot
+        
+        Returns:
+            dict with job_id, type, status, layers, result, error and timings, or None if unknown
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                SELECT job_id, job_type, status, layers_json, result_json, error,
+                       created_at, started_at, finished_at
+                FROM jobs WHERE job_id = ?
+                """,
+                (job_id,)
+            ).fetchone()
+        
+        if not row:
+            return None
+        
+        job_id, job_type, status, layers_json, result_json, error, created_at, started_at, finished_at = row
+        return {
+            'job_id': job_id,
+            'type': job_type,
+            'status': status,
+            'layers': json.loads(layers_json or '{}'),
+            'result': json.loads(result_json) if result_json else None,
+            'error': error,
+            'created_at': created_at,
+            'started_at': started_at,
+            'finished_at': finished_at,
+            'queue_seconds': round(started_at - created_at, 3) if started_at else None,
+            'run_seconds': round(finished_at - started_at, 3) if finished_at and started_at else None
+        }
@@ -0,0 +1,220 @@
+import os
+import time
+import uuid
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+from google.cloud import discoveryengine_v1 as discoveryengine
+from config import config
+from utils.metrics import metrics
+
+
+class KnowledgeBaseWriteQueue:
+    """
+    Write-behind queue for Vertex AI Search knowledge-base documents
+    
+    Feedback-loop writes (invoice extractions, rejected entities) are persisted to
+    SQLite and return immediately. A background flusher imports them in batches via
+    the Discovery Engine ``import_documents`` API (inline source) when KB_WRITE_BATCH_SIZE
+    documents are pending or every KB_WRITE_FLUSH_SECONDS. Failed batches are retried
+    with exponential backoff; rows are claimed with a lease so several gunicorn
+    workers can share one queue, and pending rows survive restarts.
+    """
+    
+    def __init__(self, document_client, parent, db_path=None):
+        self.document_client = document_client
+        self.parent = parent
+        self.db_path = db_path or config.KB_WRITE_QUEUE_PATH
+        self.batch_size = min(config.KB_WRITE_BATCH_SIZE, 100)  # inline import limit is 100 documents
+        self.flush_seconds = config.KB_WRITE_FLUSH_SECONDS
+        self.max_attempts = config.KB_WRITE_MAX_ATTEMPTS
+        self.lease_seconds = config.KB_WRITE_IMPORT_TIMEOUT_SECONDS * 2
+        
+        self._wake = threading.Event()
+        self._worker_id = uuid.uuid4().hex
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS kb_write_queue (
+                    doc_id TEXT PRIMARY KEY,
+                    document_json TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    claimed_by TEXT,
+                    claimed_until REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_kb_write_queue_due ON kb_write_queue (status, next_attempt_at)")
+        
+        self._flusher = threading.Thread(target=self._flush_loop, name='kb-write-behind', daemon=True)
+        self._flusher.start()
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def enqueue(self, document):
+        """
+        Persist a document for the next bulk import
+        
+        Re-enqueueing the same document ID replaces the pending copy (latest write wins).
+        
+        Args:
+            document: discoveryengine.Document with id set
+        
+        Returns:
+            True if queued, False otherwise
+        """
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO kb_write_queue
+                        (doc_id, document_json, status, attempts, next_attempt_at, created_at)
+                    VALUES (?, ?, 'pending', 0, ?, ?)
+                    """,
+                    (document.id, discoveryengine.Document.to_json(document), now, now)
+                )
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM kb_write_queue WHERE status = 'pending'"
+                ).fetchone()[0]
+            
+            if pending >= self.batch_size:
+                self._wake.set()
+            return True
+        except Exception as e:
+            print(f"⚠ Error queueing knowledge base write: {e}")
+            return False
+    
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(timeout=self.flush_seconds)
+            self._wake.clear()
+            try:
+                while self.flush() == self.batch_size:
+                    pass  # Full batch imported; more may be waiting
+            except Exception as e:
+                print(f"⚠ Knowledge base flush error (will retry): {e}")
+    
+    def _claim_batch(self):
+        """Atomically lease up to batch_size due rows to this worker"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE kb_write_queue SET claimed_by = ?, claimed_until = ?
+                WHERE doc_id IN (
+                    SELECT doc_id FROM kb_write_queue
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                      AND (claimed_until IS NULL OR claimed_until < ?)
+                    ORDER BY created_at
+                    LIMIT ?
+                )
+                """,
+                (self._worker_id, now + self.lease_seconds, now, now, self.batch_size)
+            )
+            return conn.execute(
+                "SELECT doc_id, document_json, attempts FROM kb_write_queue WHERE claimed_by = ? AND status = 'pending'",
+                (self._worker_id,)
+            ).fetchall()
+    
+    def flush(self):
+        """
+        Import one batch of due documents
+        
+        Returns:
+            Number of documents in the batch that was attempted (0 if nothing was due)
+        """
+        rows = self._claim_batch()
+        if not rows:
+            return 0
+        
+        doc_ids = [doc_id for doc_id, _, _ in rows]
+        start = time.perf_counter()
+        try:
+            request = discoveryengine.ImportDocumentsRequest(
+                parent=self.parent,
+                inline_source=discoveryengine.ImportDocumentsRequest.InlineSource(
+                    documents=[discoveryengine.Document.from_json(document_json) for _, document_json, _ in rows]
+                ),
+                reconciliation_mode=discoveryengine.ImportDocumentsRequest.ReconciliationMode.INCREMENTAL
+            )
+            operation = self.document_client.import_documents(request=request)
+            response = operation.result(timeout=config.KB_WRITE_IMPORT_TIMEOUT_SECONDS)
+            
+            for error in response.error_samples:
+                print(f"⚠ Knowledge base import error sample: {error.message}")
+            
+            with self._connect() as conn:
+                conn.executemany("DELETE FROM kb_write_queue WHERE doc_id = ? AND claimed_by = ?", [
+                    (doc_id, self._worker_id) for doc_id in doc_ids
+                ])
+            
+            metrics.record_stage('vertex_kb_import', time.perf_counter() - start, 'success')
+            metrics.increment('kb_write_queue_documents_total', len(rows), outcome='imported')
+            print(f"✓ Imported {len(rows)} documents to knowledge base (write-behind)")
+        except Exception as e:
+            metrics.record_stage('vertex_kb_import', time.perf_counter() - start, 'error')
+            print(f"⚠ Knowledge base import failed for {len(rows)} documents: {e}")
+            self._release_failed(rows, e)
+        
+        return len(rows)
+    
+    def _release_failed(self, rows, error):
+        """Schedule a retry with exponential backoff + jitter, or park rows after max attempts"""
+        now = time.time()
+        updates = []
+        dead = 0
+        for doc_id, _, attempts in rows:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                status = 'failed'
+                dead += 1
+            else:
+                status = 'pending'
+            delay = min(self.flush_seconds * (2 ** attempts), 3600) * random.uniform(0.8, 1.2)
+            updates.append((status, attempts, now + delay, str(error)[:500], doc_id, self._worker_id))
+        
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                UPDATE kb_write_queue
+                SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL, claimed_until = NULL
+                WHERE doc_id = ? AND claimed_by = ?
+                """,
+                updates
+            )
+        
+        if dead:
+            metrics.increment('kb_write_queue_documents_total', dead, outcome='failed')
+            print(f"❌ {dead} knowledge base documents exceeded {self.max_attempts} attempts (kept with status='failed')")
+    
+    def stats(self):
+        """Return pending/failed counts for health reporting"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM kb_write_queue GROUP BY status").fetchall()
+        return dict(rows)
+
+
+_write_queues = {}
+_write_queues_lock = threading.Lock()
+
+
+def get_write_queue(document_client, parent):
+    """Return the process-wide write-behind queue for a data store branch (one flusher per process)"""
+    with _write_queues_lock:
+        if parent not in _write_queues:
+            _write_queues[parent] = KnowledgeBaseWriteQueue(document_client, parent)
+        return _write_queues[parent]
@@ -1,20 +1,30 @@
 import json
+from utils.metrics import metrics
+from services.entity_verdict_cache import normalize_entity_name, SOURCE_GEMINI, SOURCE_VENDOR_DIRECTORY
 
 
 class SemanticEntityClassifier:
     """
     AI-first semantic entity classifier using Gemini 1.5
     Classifies entities as VENDOR, BANK, PAYMENT_PROCESSOR, GOVERNMENT_ENTITY, or INDIVIDUAL_PERSON
+    
+    Names with a cached verdict (EntityVerdictCache) or already present in the vendor
+    directory are answered without calling Gemini.
     """
     
-    def __init__(self, gemini_service):
+    def __init__(self, gemini_service, verdict_cache=None, vendor_directory=None):
         """
         Initialize SemanticEntityClassifier
         
         Args:
             gemini_service: GeminiService instance for AI classification
+            verdict_cache: Optional EntityVerdictCache for previously classified names
+            vendor_directory: Optional callable(name_keys) -> set of the normalized names
+                              already in the vendor directory (BigQueryService.find_known_vendor_keys)
         """
         self.gemini = gemini_service
+        self.verdict_cache = verdict_cache
+        self.vendor_directory = vendor_directory
         
     def classify_entity(self, entity_name, entity_context=""):
         """
@@ -29,17 +39,101 @@ class SemanticEntityClassifier:
                 'entity_type': 'VENDOR' | 'BANK' | 'PAYMENT_PROCESSOR' | 'GOVERNMENT_ENTITY' | 'INDIVIDUAL_PERSON',
                 'confidence': 'HIGH' | 'MEDIUM' | 'LOW',
                 'reasoning': 'Explanation of classification',
-                'is_valid_vendor': True/False
+                'is_valid_vendor': True/False,
+                'source': 'gemini' | 'rejected_entity' | 'vendor_directory' | 'fallback',
+                'cached': True when answered from the verdict cache (already stored, no Gemini call)
             }
         """
-        if not entity_name or entity_name == "Unknown":
-            return {
-                'entity_type': 'VENDOR',
-                'confidence': 'LOW',
-                'reasoning': 'No entity name provided, defaulting to VENDOR',
-                'is_valid_vendor': True
-            }
+        return self.classify_entities([(entity_name, entity_context)])[0]
+        
+    def classify_entities(self, entities):
+        """
+        Classify a batch of entities (CSV import rows) with one cache read and one directory query
+        
+        Args:
+            entities: List of (entity_name, entity_context) pairs
+        
+        Returns:
+            List of classification dicts (see classify_entity), in input order
+        """
+        results = [None] * len(entities)
+        pending = []
+        for index, (entity_name, _) in enumerate(entities):
+            if not entity_name or entity_name == "Unknown":
+                results[index] = {
+                    'entity_type': 'VENDOR',
+                    'confidence': 'LOW',
+                    'reasoning': 'No entity name provided, defaulting to VENDOR',
+                    'is_valid_vendor': True,
+                    'source': 'fallback'
+                }
+            else:
+                pending.append(index)
+        
+        known = self._known_verdicts([entities[index][0] for index in pending])
+        batch_verdicts = {}
+        new_verdicts = []
+        for index in pending:
+            entity_name, entity_context = entities[index]
+            name_key = normalize_entity_name(entity_name)
+            if entity_name in known or name_key in batch_verdicts:
+                results[index] = known.get(entity_name) or batch_verdicts[name_key]
+                metrics.increment('gemini_calls_avoided_total', call_site='entity_classification')
+                continue
+            
+            result = self._classify_with_gemini(entity_name, entity_context)
+            results[index] = result
+            if result['source'] == SOURCE_GEMINI:
+                new_verdicts.append((entity_name, result))
+                # Later rows with the same normalized name reuse this verdict
+                batch_verdicts[name_key] = dict(result, cached=True)
+        
+        if self.verdict_cache and new_verdicts:
+            self.verdict_cache.put_many(new_verdicts, source=SOURCE_GEMINI)
         
+        return results
+    
+    def _known_verdicts(self, entity_names):
+        """
+        Verdicts that need no Gemini call: cached ones first, then vendor directory matches
+        
+        Returns:
+            dict of {entity_name: classification}
+        """
+        if not entity_names:
+            return {}
+        
+        known = {}
+        if self.verdict_cache:
+            for name, verdict in self.verdict_cache.get_many(entity_names).items():
+                known[name] = dict(verdict, cached=True)
+        
+        missing = [name for name in entity_names if name not in known]
+        if self.vendor_directory and missing:
+            try:
+                directory_keys = self.vendor_directory({normalize_entity_name(name) for name in missing})
+            except Exception as e:
+                print(f"⚠️ Vendor directory lookup failed (non-critical): {e}")
+                directory_keys = set()
+            
+            directory_verdicts = []
+            for name in missing:
+                if normalize_entity_name(name) in directory_keys:
+                    known[name] = {
+                        'entity_type': 'VENDOR',
+                        'confidence': 'HIGH',
+                        'reasoning': 'Already present in the vendor directory',
+                        'is_valid_vendor': True,
+                        'source': SOURCE_VENDOR_DIRECTORY
+                    }
+                    directory_verdicts.append((name, known[name]))
+            
+            if self.verdict_cache and directory_verdicts:
+                self.verdict_cache.put_many(directory_verdicts, source=SOURCE_VENDOR_DIRECTORY)
+        
+        return known
+    
+    def _classify_with_gemini(self, entity_name, entity_context):
         prompt = f"""You are an expert semantic entity classifier for invoice processing systems.
 
 ENTITY TO ANALYZE:
@@ -88,7 +182,8 @@ CRITICAL: If someone is sending an invoice for goods/services, they are a VENDOR
 DO NOT use keyword matching. Rely on semantic understanding of the entity's business purpose."""
 
         try:
-            response = self.gemini.generate_text(prompt, temperature=0.1, response_mime_type='application/json')
+            with metrics.stage_timer('entity_classification'):
+                response = self.gemini.generate_text(prompt, temperature=0.1, response_mime_type='application/json', call_site='entity_classification')
             
             # Parse JSON response
             result = json.loads(response)
@@ -106,6 +201,7 @@ DO NOT use keyword matching. Rely on semantic understanding of the entity's busi
                 print(f"⚠️ Invalid entity_type: {result['entity_type']}")
                 result['entity_type'] = 'VENDOR'
             
+            result['source'] = SOURCE_GEMINI
             return result
             
         except json.JSONDecodeError as e:
@@ -130,5 +226,6 @@ DO NOT use keyword matching. Rely on semantic understanding of the entity's busi
             'entity_type': 'VENDOR',
             'confidence': 'LOW',
             'reasoning': f'Classification failed: {error_message}. Defaulting to VENDOR for safety.',
-            'is_valid_vendor': True
+            'is_valid_vendor': True,
+            'source': 'fallback'
         }
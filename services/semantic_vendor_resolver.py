@@ -15,6 +15,102 @@ from google import genai
 from google.genai import types
 
 
+# Top-level key of the resolution block when Layer 3 and Layer 3.5 share one Gemini response
+FUSED_RESOLUTION_KEY = 'vendor_resolution_result'
+
+VENDOR_RESOLUTION_RULES = """**YOUR REASONING PROCESS:**
+
+1. **Identify all names mentioned:**
+   - Invoice header/letterhead supplier name
+   - Payment recipient (remit_to_name)
+   - Names in payment instructions
+   - Bank account holder (if extractable)
+   - Email domain owner
+
+2. **Semantic Analysis:**
+   - Who is RECEIVING the money? (Follow the payment flow)
+   - Is supplier_name the same as payment_recipient?
+   - If different: Is supplier a BRAND/AGENCY invoicing on behalf of individual?
+   - Is this a freelancer using a business name?
+   - Is this an intermediary/marketplace scenario?
+
+3. **Determine TRUE VENDOR:**
+   - **Priority Rule**: The economic beneficiary (person/entity receiving funds) is the TRUE vendor
+   - If invoice says "Company X" but payment goes to "Person Y" → Person Y is TRUE vendor
+   - If all names match → That entity is TRUE vendor
+   - Consider email domains: generic (@gmail.com) vs corporate
+   - Use semantic reasoning (NOT keyword matching)
+
+4. **Confidence Scoring:**
+   - 0.95-1.0: All signals agree, clear identity
+   - 0.75-0.90: Minor conflicts but clear payment recipient
+   - 0.50-0.70: Significant conflicts or ambiguity
+   - 0.0-0.45: Cannot determine true vendor
+
+5. **Type Classification:**
+   - INDIVIDUAL: Person (freelancer, contractor)
+   - COMPANY: Registered business entity
+   - BRAND: Business name used by individual
+   - INTERMEDIARY: Agency/platform invoicing on behalf of someone
+
+**CRITICAL RULES:**
+- Always follow the money flow
+- Payment recipient > Invoice letterhead
+- Explain conflicts clearly
+- Be explicit about intermediary scenarios
+- Return structured JSON only
+"""
+
+VENDOR_RESOLUTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "true_vendor": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "confidence": {"type": "number"},
+                "type": {
+                    "type": "string",
+                    "enum": ["INDIVIDUAL", "COMPANY", "BRAND", "INTERMEDIARY"]
+                }
+            },
+            "required": ["name", "confidence", "type"]
+        },
+        "reasoning": {"type": "string"},
+        "is_intermediary_scenario": {"type": "boolean"},
+        "supplier_relationship": {"type": "string"},
+        "alternate_names": {
+            "type": "array",
+            "items": {"type": "string"}
+        },
+        "conflicts_detected": {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+    },
+    "required": [
+        "true_vendor",
+        "reasoning",
+        "is_intermediary_scenario",
+        "alternate_names",
+        "conflicts_detected"
+    ]
+}
+
+VENDOR_RESOLUTION_OUTPUT_FORMAT = """{
+  "true_vendor": {
+    "name": "Actual person/entity receiving payment",
+    "confidence": 0.0-1.0,
+    "type": "INDIVIDUAL|COMPANY|BRAND|INTERMEDIARY"
+  },
+  "reasoning": "Clear explanation of your decision process and why you chose this vendor",
+  "is_intermediary_scenario": true/false,
+  "supplier_relationship": "If intermediary: explain relationship (e.g., 'Fully Booked is brand name used by Artem for invoicing')",
+  "alternate_names": ["All other names found"],
+  "conflicts_detected": ["List any conflicts between different identity signals"]
+}"""
+
+
 class SemanticVendorResolver:
     """
     Semantic Vendor Identity Resolver
@@ -81,78 +177,148 @@ class SemanticVendorResolver:
             response = self.gemini._generate_content_with_fallback(
                 model=self.gemini.model_name,
                 contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.1,
-                    response_mime_type='application/json',
-                    response_schema={
-                        "type": "object",
-                        "properties": {
-                            "true_vendor": {
-                                "type": "object",
-                                "properties": {
-                                    "name": {"type": "string"},
-                                    "confidence": {"type": "number"},
-                                    "type": {
-                                        "type": "string",
-                                        "enum": ["INDIVIDUAL", "COMPANY", "BRAND", "INTERMEDIARY"]
-                                    }
-                                },
-                                "required": ["name", "confidence", "type"]
-                            },
-                            "reasoning": {"type": "string"},
-                            "is_intermediary_scenario": {"type": "boolean"},
-                            "supplier_relationship": {"type": "string"},
-                            "alternate_names": {
-                                "type": "array",
-                                "items": {"type": "string"}
-                            },
-                            "conflicts_detected": {
-                                "type": "array",
-                                "items": {"type": "string"}
-                            }
-                        },
-                        "required": [
-                            "true_vendor",
-                            "reasoning",
-                            "is_intermediary_scenario",
-                            "alternate_names",
-                            "conflicts_detected"
-                        ]
-                    }
-                )
+                config=self._resolution_config(),
+                call_site='vendor_resolution'
             )
             
-            result = json.loads(response.text or "{}")
+            return self._finish_resolution(response.text, signals)
             
-            # Add identity signals to result for transparency
-            result["identity_signals"] = signals
-            
-            print(f"🧠 Semantic Vendor Resolution:")
-            print(f"   TRUE Vendor: {result.get('true_vendor', {}).get('name', 'Unknown')}")
-            print(f"   Confidence: {result.get('true_vendor', {}).get('confidence', 0.0):.2f}")
-            print(f"   Type: {result.get('true_vendor', {}).get('type', 'Unknown')}")
-            if result.get('is_intermediary_scenario'):
-                print(f"   ⚠️  Intermediary detected: {result.get('supplier_relationship', 'Unknown')}")
-            print(f"   Reasoning: {result.get('reasoning', 'No reasoning provided')}")
-            
-            return result
+        except Exception as e:
+            return self._fallback_resolution(signals, e)
+    
+    async def resolve_vendor_identity_async(
+        self,
+        async_gemini,
+        document_ai_entities: Dict[str, Any],
+        validated_data: Dict[str, Any],
+        rag_context: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        resolve_vendor_identity on the async Gemini path (same prompt, result shape and fallback)
+        
+        Args:
+            async_gemini: AsyncGeminiService wrapping this resolver's GeminiService
+        """
+        signals = self._extract_identity_signals(document_ai_entities, validated_data)
+        prompt = self._build_reasoning_prompt(signals, rag_context)
+        
+        try:
+            response = await async_gemini.generate_content_with_fallback(
+                model=self.gemini.model_name,
+                contents=prompt,
+                config=self._resolution_config(),
+                call_site='vendor_resolution'
+            )
             
+            return self._finish_resolution(response.text, signals)
+        
         except Exception as e:
-            print(f"❌ Semantic vendor resolution failed: {e}")
-            # Fallback: return supplier_name with low confidence
-            return {
-                "true_vendor": {
-                    "name": signals.get("supplier_name", "Unknown"),
-                    "confidence": 0.5,
-                    "type": "UNKNOWN"
-                },
-                "reasoning": f"Fallback to supplier_name due to error: {str(e)}",
-                "identity_signals": signals,
-                "is_intermediary_scenario": False,
-                "supplier_relationship": None,
-                "alternate_names": [],
-                "conflicts_detected": [f"Resolution failed: {str(e)}"]
-            }
+            return self._fallback_resolution(signals, e)
+    
+    @staticmethod
+    def _resolution_config():
+        """Structured-output config for the separate resolver call"""
+        return types.GenerateContentConfig(
+            temperature=0.1,
+            response_mime_type='application/json',
+            response_schema=VENDOR_RESOLUTION_SCHEMA
+        )
+    
+    def _finish_resolution(self, response_text: str, signals: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse the resolver response and attach the identity signals for transparency"""
+        result = json.loads(response_text or "{}")
+        
+        # Add identity signals to result for transparency
+        result["identity_signals"] = signals
+        
+        self._log_resolution(result)
+        
+        return result
+    
+    @staticmethod
+    def _fallback_resolution(signals: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        """Fallback when resolution fails: the supplier_name with low confidence"""
+        print(f"❌ Semantic vendor resolution failed: {error}")
+        return {
+            "true_vendor": {
+                "name": signals.get("supplier_name", "Unknown"),
+                "confidence": 0.5,
+                "type": "UNKNOWN"
+            },
+            "reasoning": f"Fallback to supplier_name due to error: {str(error)}",
+            "identity_signals": signals,
+            "is_intermediary_scenario": False,
+            "supplier_relationship": None,
+            "alternate_names": [],
+            "conflicts_detected": [f"Resolution failed: {str(error)}"]
+        }
+    
+    def fused_prompt_section(self) -> str:
+        """
+        Prompt section that asks Layer 3 validation to resolve the vendor in the same response
+        
+        Appended to the validate_invoice per-invoice delta; the model sees the OCR text,
+        Document AI entities and RAG vendor history there, so no separate signal summary is sent.
+        """
+        return f"""
+### 7. VENDOR IDENTITY RESOLUTION (answer in the same JSON response)
+Also act as the semantic vendor identity resolver: determine the TRUE VENDOR (economic beneficiary who receives payment) from ALL identity signals in the input above (letterhead supplier name, remit-to name, payment instructions, bank account holder, email domain) and the vendor history.
+
+{VENDOR_RESOLUTION_RULES}
+Add the result as a top-level "{FUSED_RESOLUTION_KEY}" object in your JSON output, next to the invoice fields:
+{VENDOR_RESOLUTION_OUTPUT_FORMAT}
+"""
+    
+    def parse_fused_resolution(
+        self,
+        payload: Any,
+        document_ai_entities: Dict[str, Any],
+        validated_data: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Turn the resolution block of a fused validation response into a resolve_vendor_identity result
+        
+        Returns:
+            Same shape as resolve_vendor_identity, or None when the block is missing or
+            malformed (the caller then falls back to the separate resolver call)
+        """
+        true_vendor = payload.get("true_vendor") if isinstance(payload, dict) else None
+        if not isinstance(true_vendor, dict) or not isinstance(true_vendor.get("name"), str):
+            print("⚠️ Fused vendor resolution missing or malformed, falling back to separate call")
+            return None
+        
+        try:
+            confidence = float(true_vendor.get("confidence", 0.0))
+        except (TypeError, ValueError):
+            confidence = 0.0
+        
+        result = {
+            "true_vendor": {
+                "name": true_vendor["name"],
+                "confidence": confidence,
+                "type": true_vendor.get("type", "UNKNOWN")
+            },
+            "reasoning": payload.get("reasoning", "No reasoning provided"),
+            "is_intermediary_scenario": bool(payload.get("is_intermediary_scenario", False)),
+            "supplier_relationship": payload.get("supplier_relationship"),
+            "alternate_names": payload.get("alternate_names") or [],
+            "conflicts_detected": payload.get("conflicts_detected") or [],
+            "identity_signals": self._extract_identity_signals(document_ai_entities, validated_data)
+        }
+        
+        self._log_resolution(result)
+        
+        return result
+    
+    @staticmethod
+    def _log_resolution(result: Dict[str, Any]) -> None:
+        print(f"🧠 Semantic Vendor Resolution:")
+        print(f"   TRUE Vendor: {result.get('true_vendor', {}).get('name', 'Unknown')}")
+        print(f"   Confidence: {result.get('true_vendor', {}).get('confidence', 0.0):.2f}")
+        print(f"   Type: {result.get('true_vendor', {}).get('type', 'Unknown')}")
+        if result.get('is_intermediary_scenario'):
+            print(f"   ⚠️  Intermediary detected: {result.get('supplier_relationship', 'Unknown')}")
+        print(f"   Reasoning: {result.get('reasoning', 'No reasoning provided')}")
     
     def _extract_identity_signals(
         self,
@@ -258,61 +424,9 @@ Your task is to determine the TRUE VENDOR (economic beneficiary who receives pay
 **IDENTITY SIGNALS EXTRACTED FROM INVOICE:**
 {signals_text}{rag_text}
 
-**YOUR REASONING PROCESS:**
-
-1. **Identify all names mentioned:**
-   - Invoice header/letterhead supplier name
-   - Payment recipient (remit_to_name)
-   - Names in payment instructions
-   - Bank account holder (if extractable)
-   - Email domain owner
-
-2. **Semantic Analysis:**
-   - Who is RECEIVING the money? (Follow the payment flow)
-   - Is supplier_name the same as payment_recipient?
-   - If different: Is supplier a BRAND/AGENCY invoicing on behalf of individual?
-   - Is this a freelancer using a business name?
-   - Is this an intermediary/marketplace scenario?
-
-3. **Determine TRUE VENDOR:**
-   - **Priority Rule**: The economic beneficiary (person/entity receiving funds) is the TRUE vendor
-   - If invoice says "Company X" but payment goes to "Person Y" → Person Y is TRUE vendor
-   - If all names match → That entity is TRUE vendor
-   - Consider email domains: generic (@gmail.com) vs corporate
-   - Use semantic reasoning (NOT keyword matching)
-
-4. **Confidence Scoring:**
-   - 0.95-1.0: All signals agree, clear identity
-   - 0.75-0.90: Minor conflicts but clear payment recipient
-   - 0.50-0.70: Significant conflicts or ambiguity
-   - 0.0-0.45: Cannot determine true vendor
-
-5. **Type Classification:**
-   - INDIVIDUAL: Person (freelancer, contractor)
-   - COMPANY: Registered business entity
-   - BRAND: Business name used by individual
-   - INTERMEDIARY: Agency/platform invoicing on behalf of someone
-
-**CRITICAL RULES:**
-- Always follow the money flow
-- Payment recipient > Invoice letterhead
-- Explain conflicts clearly
-- Be explicit about intermediary scenarios
-- Return structured JSON only
-
+{VENDOR_RESOLUTION_RULES}
 **OUTPUT FORMAT:**
-{{
-  "true_vendor": {{
-    "name": "Actual person/entity receiving payment",
-    "confidence": 0.0-1.0,
-    "type": "INDIVIDUAL|COMPANY|BRAND|INTERMEDIARY"
-  }},
-  "reasoning": "Clear explanation of your decision process and why you chose this vendor",
-  "is_intermediary_scenario": true/false,
-  "supplier_relationship": "If intermediary: explain relationship (e.g., 'Fully Booked is brand name used by Artem for invoicing')",
-  "alternate_names": ["All other names found"],
-  "conflicts_detected": ["List any conflicts between different identity signals"]
-}}
+{VENDOR_RESOLUTION_OUTPUT_FORMAT}
 
 Now analyze the identity signals and determine the TRUE vendor."""
         
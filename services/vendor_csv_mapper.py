@@ -2,9 +2,11 @@ import os
 import json
 import csv
 import io
+import time
 from google import genai
 from google.genai import types
 from config import config
+from utils.gemini_usage import gemini_usage
 
 try:
     from services.vertex_vendor_mapping_search import VertexVendorMappingSearch
@@ -226,16 +228,22 @@ Rate your confidence for each mapping:
 }}
 """
         
+        start = time.perf_counter()
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    system_instruction=self.system_instruction,
-                    response_mime_type="application/json",
-                    temperature=0.1
+            try:
+                response = self.client.models.generate_content(
+                    model=self.model_name,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(
+                        system_instruction=self.system_instruction,
+                        response_mime_type="application/json",
+                        temperature=0.1
+                    )
                 )
-            )
+            except Exception:
+                gemini_usage.record('csv_mapping', self.model_name, 'primary', None, time.perf_counter() - start, outcome='error')
+                raise
+            gemini_usage.record('csv_mapping', self.model_name, 'primary', getattr(response, 'usage_metadata', None), time.perf_counter() - start)
             
             if not response or not response.text:
                 return {
@@ -1,5 +1,6 @@
 import json
 from google.genai import types
+from utils.metrics import metrics
 
 
 class VendorMatcher:
@@ -586,6 +587,56 @@ class VendorMatcher:
         Returns:
             dict with verdict, vendor_id, confidence, reasoning, database_updates
         """
+        prompt = self._supreme_judge_prompt(invoice_data, candidates, classifier_verdict)
+        
+        response_text = ""
+        try:
+            # Call Gemini with automatic fallback (rate limit protection)
+            # Use the gemini service's configured model (gemini-2.0-flash-exp)
+            with metrics.stage_timer('supreme_judge'):
+                response = self.gemini._generate_content_with_fallback(
+                    model=self.gemini.model_name,
+                    contents=prompt,
+                    config=self._supreme_judge_config(),
+                    call_site='supreme_judge'
+                )
+            
+            response_text = response.text or ""
+            return self._parse_judge_response(response_text)
+        
+        except Exception as e:
+            return self._judge_error_result(e, response_text)
+    
+    async def supreme_judge_decision_async(self, async_gemini, invoice_data, candidates, classifier_verdict=None):
+        """
+        _supreme_judge_decision on the async Gemini path (same prompt, parsing and fallbacks)
+        
+        Args:
+            async_gemini: AsyncGeminiService wrapping this matcher's GeminiService
+            invoice_data: Invoice vendor information
+            candidates: List of semantic candidate vendors from Vertex Search
+            classifier_verdict: Optional pre-classification from semantic entity classifier
+        """
+        prompt = self._supreme_judge_prompt(invoice_data, candidates, classifier_verdict)
+        
+        response_text = ""
+        try:
+            with metrics.stage_timer('supreme_judge'):
+                response = await async_gemini.generate_content_with_fallback(
+                    model=self.gemini.model_name,
+                    contents=prompt,
+                    config=self._supreme_judge_config(),
+                    call_site='supreme_judge'
+                )
+            
+            response_text = response.text or ""
+            return self._parse_judge_response(response_text)
+        
+        except Exception as e:
+            return self._judge_error_result(e, response_text)
+    
+    def _supreme_judge_prompt(self, invoice_data, candidates, classifier_verdict=None):
+        """Supreme Judge prompt: invoice vendor evidence, database candidates and the evidence hierarchy"""
         # Extract invoice vendor details
         vendor_name = invoice_data.get("vendor_name", "Unknown")
         resolved_legal_name = invoice_data.get("resolved_legal_name", "")
@@ -830,77 +881,83 @@ Use these principles to think like a human accountant:
 5. Return ONLY valid JSON, no markdown, no commentary
 """
         
-        try:
-            # Call Gemini with automatic fallback (rate limit protection)
-            # Use the gemini service's configured model (gemini-2.0-flash-exp)
-            response = self.gemini._generate_content_with_fallback(
-                model=self.gemini.model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.1,
-                    response_mime_type='application/json'
-                )
-            )
-            
-            # Parse JSON response
-            result = json.loads(response.text or "{}")
-            
-            # Get verdict and normalize if needed (AMBIGUOUS → NEW_VENDOR for method mapping)
-            raw_verdict = result.get("verdict", "NEW_VENDOR")
-            # Ensure verdict is one of the three allowed values
-            if raw_verdict not in ["MATCH", "NEW_VENDOR", "AMBIGUOUS"]:
-                raw_verdict = "NEW_VENDOR"
+        return prompt
             
-            # Extract structured evidence breakdown (AI-First semantic classification)
-            match_details = result.get("match_details", {})
-            evidence_breakdown = match_details.get("evidence_breakdown")
+    @staticmethod
+    def _supreme_judge_config():
+        """Generation config for the Supreme Judge call"""
+        return types.GenerateContentConfig(
+            temperature=0.1,
+            response_mime_type='application/json'
+        )
             
-            judge_result = {
-                "verdict": raw_verdict,
-                "vendor_id": match_details.get("selected_vendor_id"),
-                "confidence": match_details.get("confidence_score", 0.0),
-                "reasoning": match_details.get("match_reasoning", "No reasoning provided"),
-                "risk_analysis": match_details.get("risk_analysis", "UNKNOWN"),
-                "database_updates": result.get("database_updates", {}),
-                "parent_child_logic": result.get("parent_child_logic", {
-                    "is_subsidiary": False,
-                    "parent_company_detected": None
-                })
-            }
-            
-            # Include structured evidence if AI provided it
-            if evidence_breakdown:
-                judge_result["evidence_breakdown"] = evidence_breakdown
-                print("✅ Gemini returned structured evidence breakdown (AI-First semantic classification)")
-            else:
-                print("⚠️ Gemini did not return structured evidence - will use reasoning fallback")
-            
-            return judge_result
-            
-        except Exception as e:
-            print(f"❌ Supreme Judge error: {e}")
-            print(f"📝 Response text: {response.text[:500] if 'response' in locals() and hasattr(response, 'text') else 'No response'}")
-            
-            # Try regex fallback to extract verdict and reasoning
-            fallback_result = self._fallback_parse_judge_response(response.text if 'response' in locals() and hasattr(response, 'text') else "")
+    def _parse_judge_response(self, response_text):
+        """
+        Normalize a Supreme Judge JSON response into the judge result dict
             
-            if fallback_result:
-                print(f"✅ Fallback parsing succeeded: {fallback_result.get('verdict')}")
-                return fallback_result
+        Raises:
+            ValueError: The response is not valid JSON (handled by _judge_error_result)
+        """
+        # Parse JSON response
+        result = json.loads(response_text or "{}")
             
-            # Final fallback: return NEW_VENDOR (safer than AMBIGUOUS for method mapping)
-            return {
-                "verdict": "NEW_VENDOR",
-                "vendor_id": None,
-                "confidence": 0.0,
-                "reasoning": f"Error during Supreme Judge decision: {str(e)}. Unable to parse response.",
-                "risk_analysis": "HIGH",
-                "database_updates": {},
-                "parent_child_logic": {
-                    "is_subsidiary": False,
-                    "parent_company_detected": None
-                }
+        # Get verdict and normalize if needed (AMBIGUOUS → NEW_VENDOR for method mapping)
+        raw_verdict = result.get("verdict", "NEW_VENDOR")
+        # Ensure verdict is one of the three allowed values
+        if raw_verdict not in ["MATCH", "NEW_VENDOR", "AMBIGUOUS"]:
+            raw_verdict = "NEW_VENDOR"
+        
+        # Extract structured evidence breakdown (AI-First semantic classification)
+        match_details = result.get("match_details", {})
+        evidence_breakdown = match_details.get("evidence_breakdown")
+        
+        judge_result = {
+            "verdict": raw_verdict,
+            "vendor_id": match_details.get("selected_vendor_id"),
+            "confidence": match_details.get("confidence_score", 0.0),
+            "reasoning": match_details.get("match_reasoning", "No reasoning provided"),
+            "risk_analysis": match_details.get("risk_analysis", "UNKNOWN"),
+            "database_updates": result.get("database_updates", {}),
+            "parent_child_logic": result.get("parent_child_logic", {
+                "is_subsidiary": False,
+                "parent_company_detected": None
+            })
+        }
+        
+        # Include structured evidence if AI provided it
+        if evidence_breakdown:
+            judge_result["evidence_breakdown"] = evidence_breakdown
+            print("✅ Gemini returned structured evidence breakdown (AI-First semantic classification)")
+        else:
+            print("⚠️ Gemini did not return structured evidence - will use reasoning fallback")
+        
+        return judge_result
+    
+    def _judge_error_result(self, error, response_text):
+        """Regex fallback over the raw response, then a NEW_VENDOR verdict, when the judge call or parsing fails"""
+        print(f"❌ Supreme Judge error: {error}")
+        print(f"📝 Response text: {response_text[:500] if response_text else 'No response'}")
+        
+        # Try regex fallback to extract verdict and reasoning
+        fallback_result = self._fallback_parse_judge_response(response_text)
+        
+        if fallback_result:
+            print(f"✅ Fallback parsing succeeded: {fallback_result.get('verdict')}")
+            return fallback_result
+        
+        # Final fallback: return NEW_VENDOR (safer than AMBIGUOUS for method mapping)
+        return {
+            "verdict": "NEW_VENDOR",
+            "vendor_id": None,
+            "confidence": 0.0,
+            "reasoning": f"Error during Supreme Judge decision: {str(error)}. Unable to parse response.",
+            "risk_analysis": "HIGH",
+            "database_updates": {},
+            "parent_child_logic": {
+                "is_subsidiary": False,
+                "parent_company_detected": None
             }
+        }
     
     def _fallback_parse_judge_response(self, response_text):
         """
@@ -0,0 +1,399 @@
+import os
+import re
+import copy
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+from config import config
+from utils.date_normalizer import normalize_date
+
+# validated_data fields learned as Document AI entity mappings (path → value kind)
+TEMPLATE_FIELDS = {
+    'invoiceNumber': 'text',
+    'documentDate': 'date',
+    'dueDate': 'date',
+    'totals.subtotal': 'amount',
+    'totals.tax': 'amount',
+    'totals.total': 'amount'
+}
+REQUIRED_FIELDS = ('invoiceNumber', 'documentDate', 'totals.total')
+
+# Vendor-level fields copied from learned extractions (stable across a vendor's recurring invoices)
+STATIC_FIELDS = (
+    'vendor', 'vendor_details', 'vendor_identity_analysis', 'vendor_resolution', 'vendorMatch',
+    'buyer', 'paymentDetails', 'paymentTerms', 'documentType', 'language', 'isRTL',
+    'isSubscription', 'detectedCountry', 'currency', 'originalCurrency'
+)
+
+CURRENCY_SYMBOLS = {'$': 'USD', '€': 'EUR', '£': 'GBP', '₪': 'ILS', '¥': 'JPY', '₹': 'INR'}
+
+
+class VendorTemplateStore:
+    """
+    Per-vendor extraction templates learned from high-confidence Gemini extractions
+    
+    A template records which Document AI entity type carries each key field for a
+    vendor's layout, plus the vendor-level data (resolved vendor, buyer, currency,
+    document type). Once a layout has been seen VENDOR_TEMPLATE_MIN_SAMPLES times in a
+    row, recurring invoices are built locally from Layer 1 output and local math
+    checks instead of calling Gemini. Any failed check falls back to the full pipeline.
+    """
+    
+    def __init__(self, db_path=None):
+        self.db_path = db_path or config.VENDOR_TEMPLATE_DB_PATH
+        self.min_samples = config.VENDOR_TEMPLATE_MIN_SAMPLES
+        self.min_confidence = config.VENDOR_TEMPLATE_MIN_CONFIDENCE
+        self.min_entity_confidence = config.VENDOR_TEMPLATE_MIN_ENTITY_CONFIDENCE
+        
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS vendor_templates (
+                    vendor_key TEXT PRIMARY KEY,
+                    template_json TEXT NOT NULL,
+                    samples INTEGER NOT NULL,
+                    fast_path_hits INTEGER NOT NULL DEFAULT 0,
+                    fallbacks INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL
+                )
+            """)
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def vendor_key(vendor_name):
+        """Normalize a Layer 1 vendor name into a template key (case/punctuation-insensitive)"""
+        if not vendor_name:
+            return None
+        key = re.sub(r'[\W_]+', ' ', str(vendor_name).casefold()).strip()
+        return key or None
+    
+    @staticmethod
+    def parse_amount(text):
+        """Parse '1,234.56' / '1.234,56' / '$ 99' style amounts into a float"""
+        if text is None:
+            return None
+        if isinstance(text, (int, float)):
+            return float(text)
+        
+        cleaned = re.sub(r'[^\d,.\-]', '', str(text))
+        if not re.search(r'\d', cleaned):
+            return None
+        
+        if ',' in cleaned and '.' in cleaned:
+            if cleaned.rfind(',') > cleaned.rfind('.'):
+                cleaned = cleaned.replace('.', '').replace(',', '.')
+            else:
+                cleaned = cleaned.replace(',', '')
+        elif ',' in cleaned:
+            decimals = cleaned.rsplit(',', 1)[1]
+            cleaned = cleaned.replace(',', '.') if len(decimals) == 2 and cleaned.count(',') == 1 else cleaned.replace(',', '')
+        
+        try:
+            return float(cleaned)
+        except ValueError:
+            return None
+    
+    def _entity_value(self, kind, entry, country=None):
+        """Read a typed value from one Document AI entity entry"""
+        raw = entry.get('normalized_value') or entry.get('value')
+        if kind == 'amount':
+            return self.parse_amount(raw)
+        if kind == 'date':
+            return normalize_date(raw, country or 'US') if raw else None
+        return str(entry.get('value') or '').strip() or None
+    
+    @staticmethod
+    def _get_path(data, path):
+        for part in path.split('.'):
+            if not isinstance(data, dict):
+                return None
+            data = data.get(part)
+        return data
+    
+    def _matches(self, kind, entry, target, country):
+        value = self._entity_value(kind, entry, country)
+        if value is None:
+            return False
+        if kind == 'amount':
+            target_amount = self.parse_amount(target)
+            return target_amount is not None and abs(value - target_amount) < 0.01
+        if kind == 'text':
+            return self.vendor_key(value) == self.vendor_key(target)
+        return value == target
+    
+    def _load(self, vendor_key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT template_json, samples FROM vendor_templates WHERE vendor_key = ?",
+                (vendor_key,)
+            ).fetchone()
+        if not row:
+            return None
+        template = json.loads(row[0])
+        template['samples'] = row[1]
+        return template
+    
+    def learn(self, vendor_name, extracted_entities, validated_data):
+        """
+        Learn or reinforce a vendor template from a completed Gemini extraction
+        
+        Only high-confidence, single-currency extractions without validation flags are
+        used. A sample whose field mapping differs from the stored template restarts
+        the sample count, so a layout change disables the fast path until re-learned.
+        
+        Returns:
+            Number of consistent samples for the vendor, or 0 if the extraction was not usable
+        """
+        try:
+            key = self.vendor_key(vendor_name)
+            if not key or 'error' in validated_data:
+                return 0
+            if (validated_data.get('extractionConfidence') or 0) < self.min_confidence:
+                return 0
+            if validated_data.get('validation_flags') or (validated_data.get('multiCurrency') or {}).get('isMultiCurrency'):
+                return 0
+            
+            country = validated_data.get('detectedCountry')
+            field_map = {}
+            for path, kind in TEMPLATE_FIELDS.items():
+                target = self._get_path(validated_data, path)
+                if target in (None, '', 0):
+                    continue
+                for entity_type, entries in extracted_entities.items():
+                    if entries and self._matches(kind, entries[0], target, country):
+                        field_map[path] = entity_type
+                        break
+            
+            if any(field not in field_map for field in REQUIRED_FIELDS):
+                return 0
+            
+            totals = validated_data.get('totals') or {}
+            subtotal = self.parse_amount(totals.get('subtotal'))
+            tax = self.parse_amount(totals.get('tax'))
+            
+            template = {
+                'vendor_key': key,
+                'field_map': field_map,
+                'currency': validated_data.get('currency'),
+                'document_type': validated_data.get('documentType'),
+                'tax_percent': round(tax / subtotal * 100, 2) if subtotal and tax else None,
+                'vendor_tax_id': (validated_data.get('vendor') or {}).get('taxId'),
+                'static': {field: copy.deepcopy(validated_data[field]) for field in STATIC_FIELDS if field in validated_data}
+            }
+            
+            existing = self._load(key)
+            consistent = (
+                existing
+                and existing.get('field_map') == field_map
+                and existing.get('currency') == template['currency']
+                and existing.get('tax_percent') == template['tax_percent']
+            )
+            samples = existing['samples'] + 1 if consistent else 1
+            
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO vendor_templates (vendor_key, template_json, samples, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(vendor_key) DO UPDATE SET
+                        template_json = excluded.template_json,
+                        samples = excluded.samples,
+                        updated_at = excluded.updated_at
+                    """,
+                    (key, json.dumps(template, default=str), samples, time.time())
+                )
+            
+            print(f"📐 Vendor template for '{vendor_name}': {samples} consistent sample(s)")
+            return samples
+        except Exception as e:
+            print(f"⚠️ Vendor template learning error (non-critical): {e}")
+            return 0
+    
+    def apply(self, vendor_name, extracted_entities):
+        """
+        Build validated_data locally from Layer 1 output using the vendor's template
+        
+        Args:
+            vendor_name: Vendor name extracted by Layer 1
+            extracted_entities: Structured entities from Document AI
+        
+        Returns:
+            Tuple (validated_data or None, details dict with 'used', 'reason'/'checks')
+        """
+        key = self.vendor_key(vendor_name)
+        template = self._load(key) if key else None
+        if not template:
+            return None, {'used': False, 'reason': 'No template learned for this vendor'}
+        if template['samples'] < self.min_samples:
+            return None, {'used': False, 'reason': f"Template has {template['samples']}/{self.min_samples} samples"}
+        
+        validated_data, details = self._build(template, extracted_entities)
+        
+        counter = 'fast_path_hits' if validated_data else 'fallbacks'
+        with self._connect() as conn:
+            conn.execute(f"UPDATE vendor_templates SET {counter} = {counter} + 1 WHERE vendor_key = ?", (key,))
+        
+        return validated_data, details
+    
+    def _build(self, template, extracted_entities):
+        """Read fields via the template's entity mapping and run the local checks"""
+        static = template.get('static') or {}
+        country = static.get('detectedCountry')
+        currency = template.get('currency') or 'USD'
+        details = {'used': False, 'vendor_key': template['vendor_key'], 'template_samples': template['samples']}
+        checks = []
+        values = {}
+        confidences = []
+        
+        def fail(reason):
+            details['reason'] = reason
+            details['checks'] = checks
+            return None, details
+        
+        for path, entity_type in template['field_map'].items():
+            kind = TEMPLATE_FIELDS[path]
+            required = path in REQUIRED_FIELDS
+            entries = extracted_entities.get(entity_type) or []
+            if not entries:
+                if required:
+                    return fail(f"Missing {path} ({entity_type})")
+                continue
+            
+            parsed = [self._entity_value(kind, entry, country) for entry in entries]
+            if required and len(set(v for v in parsed if v is not None)) > 1:
+                return fail(f"Ambiguous {path}: {len(entries)} different {entity_type} values")
+            if parsed[0] is None:
+                if required:
+                    return fail(f"Unparseable {path} ({entries[0].get('value')!r})")
+                continue
+            
+            confidence = entries[0].get('confidence', 1.0) or 0.0
+            if required:
+                if confidence < self.min_entity_confidence:
+                    return fail(f"Low Document AI confidence for {path} ({confidence:.2f})")
+                confidences.append(confidence)
+            values[path] = parsed[0]
+        checks.append('required fields present')
+        
+        total = values['totals.total']
+        subtotal = values.get('totals.subtotal')
+        tax = values.get('totals.tax')
+        tolerance = max(0.02, abs(total) * 0.001)
+        
+        if total <= 0:
+            return fail(f"Non-positive total ({total})")
+        if subtotal is not None and tax is not None:
+            if abs(subtotal + tax - total) > tolerance:
+                return fail(f"Math check failed: {subtotal} + {tax} != {total}")
+            checks.append(f"subtotal + tax = total ({subtotal} + {tax} = {total})")
+        elif subtotal is not None and abs(subtotal - total) > tolerance:
+            return fail(f"Math check failed: subtotal {subtotal} != total {total} with no tax")
+        
+        if template.get('tax_percent') and subtotal and tax is not None:
+            tax_percent = tax / subtotal * 100
+            if abs(tax_percent - template['tax_percent']) > 0.5:
+                return fail(f"Tax rate {tax_percent:.2f}% differs from learned {template['tax_percent']}%")
+            checks.append(f"tax rate matches learned {template['tax_percent']}%")
+        
+        currency_entries = extracted_entities.get('currency') or []
+        if currency_entries:
+            raw_currency = str(currency_entries[0].get('normalized_value') or currency_entries[0].get('value') or '').strip()
+            detected = CURRENCY_SYMBOLS.get(raw_currency, raw_currency.upper())
+            if re.fullmatch(r'[A-Z]{3}', detected) and detected != currency:
+                return fail(f"Currency {detected} differs from learned {currency}")
+            checks.append(f"currency {currency}")
+        
+        tax_id_entries = extracted_entities.get('supplier_tax_id') or []
+        if tax_id_entries and template.get('vendor_tax_id'):
+            normalize_id = lambda value: re.sub(r'[\W_]+', '', str(value or '')).upper()
+            if normalize_id(tax_id_entries[0].get('value')) != normalize_id(template['vendor_tax_id']):
+                return fail("Supplier tax ID differs from learned vendor")
+            checks.append('supplier tax ID matches')
+        
+        if subtotal is None:
+            subtotal = total - (tax or 0)
+        tax = tax or 0
+        tax_percent = round(tax / subtotal * 100, 2) if subtotal else 0
+        confidence = round(min(confidences), 2) if confidences else 0.0
+        document_date = values['documentDate']
+        notes = (
+            f"Built from learned vendor template ({template['samples']} consistent past extractions) "
+            f"without Gemini. Checks passed: {'; '.join(checks)}."
+        )
+        
+        validated_data = copy.deepcopy(static)
+        validated_data.update({
+            'invoiceNumber': values['invoiceNumber'],
+            'documentDate': document_date,
+            'issueDate': document_date,
+            'dueDate': values.get('dueDate'),
+            'paymentDate': None,
+            'servicePeriodStart': None,
+            'servicePeriodEnd': None,
+            'currency': currency,
+            'exchangeRate': None,
+            'purchaseOrderNumbers': [],
+            'lineItems': [],
+            'totals': {
+                'subtotal': subtotal,
+                'subtotalCurrency': currency,
+                'tax': tax,
+                'taxCurrency': currency,
+                'taxPercent': tax_percent,
+                'discounts': 0,
+                'fees': 0,
+                'shipping': 0,
+                'total': total,
+                'totalCurrency': currency
+            },
+            'multiCurrency': {
+                'isMultiCurrency': False,
+                'baseCurrency': currency,
+                'settlementCurrency': currency,
+                'exchangeRate': None
+            },
+            'financial_data': {
+                'primary_currency_code': currency,
+                'line_item_currency_code': currency,
+                'exchange_rate_applied': None,
+                'subtotal': subtotal,
+                'tax_total': tax,
+                'discount_total': 0,
+                'grand_total': total,
+                'tax_breakdown': []
+            },
+            'critical_dates': {
+                'issue_date': document_date,
+                'payment_date': None,
+                'due_date': values.get('dueDate'),
+                'period_start': None,
+                'period_end': None
+            },
+            'global_audit_metadata': {
+                'detected_country': static.get('detectedCountry'),
+                'detected_language': static.get('language', 'en'),
+                'document_category': template.get('document_type') or static.get('documentType', 'Invoice'),
+                'is_multi_currency': False,
+                'confidence_level': confidence
+            },
+            'classificationConfidence': confidence,
+            'extractionConfidence': confidence,
+            'ai_auditor_notes': notes,
+            'auditReasoning': notes,
+            'reasoning': notes,
+            'validation_flags': [],
+            'warnings': ['Line items not extracted (vendor template fast path)']
+        })
+        
+        details.update({'used': True, 'checks': checks})
+        return validated_data, details
@@ -5,6 +5,7 @@ import base64
 from datetime import datetime
 from google.cloud import discoveryengine_v1 as discoveryengine
 from google.oauth2 import service_account
+from services.knowledge_base_writer import get_write_queue
 from config import config
 
 class VertexSearchService:
@@ -38,6 +39,9 @@ class VertexSearchService:
             f"collections/{config.VERTEX_SEARCH_COLLECTION}/dataStores/{config.VERTEX_SEARCH_DATA_STORE_ID}/"
             f"branches/default_branch"
         )
+        
+        # Feedback writes are batched off the request path unless write-behind is disabled
+        self.write_queue = get_write_queue(self.document_client, self.parent) if config.KB_WRITE_BEHIND_ENABLED else None
     
     def search_vendor(self, vendor_query, max_results=5):
         """
@@ -55,6 +59,29 @@ class VertexSearchService:
             return []
         
         # CRITICAL FIX 4: First check if this entity was previously rejected
+        rejected_results = self.check_rejected_entity(vendor_query)
+        if rejected_results:
+            return rejected_results
+        
+        # Continue with normal vendor search
+        return self.search_vendor_documents(vendor_query, max_results=max_results)
+    
+    def check_rejected_entity(self, vendor_query, timeout=None, raise_errors=False):
+        """
+        Check whether an entity was previously rejected (bank, payment processor, etc.)
+        
+        Args:
+            vendor_query: Vendor name to check
+            timeout: Optional per-call timeout in seconds
+            raise_errors: Re-raise search errors instead of returning [] (pipeline fan-out, so
+                          metrics and the caller see the failure)
+            
+        Returns:
+            List with a single rejection warning result, or empty list if not rejected
+        """
+        if not vendor_query:
+            return []
+        
         rejected_query = f"rejected entity {vendor_query}"
         rejected_request = discoveryengine.SearchRequest(
             serving_config=config.VERTEX_SEARCH_SERVING_CONFIG,
@@ -63,7 +90,7 @@ class VertexSearchService:
         )
         
         try:
-            rejected_response = self.client.search(rejected_request)
+            rejected_response = self.client.search(rejected_request, **self._call_options(timeout))
             
             for result in rejected_response.results:
                 document_data = {}
@@ -96,9 +123,28 @@ class VertexSearchService:
                         }
                     }]
         except Exception as e:
+            if raise_errors:
+                raise
             print(f"⚠️ Error checking rejected entities: {e}")
         
-        # Continue with normal vendor search
+        return []
+    
+    def search_vendor_documents(self, vendor_query, max_results=5, timeout=None, raise_errors=False):
+        """
+        Search vendor documents in the RAG datastore (without the rejected-entity check)
+        
+        Args:
+            vendor_query: Vendor name to search for
+            max_results: Maximum number of results to return
+            timeout: Optional per-call timeout in seconds
+            raise_errors: Re-raise search errors instead of returning []
+            
+        Returns:
+            List of search results with vendor context
+        """
+        if not vendor_query:
+            return []
+        
         request = discoveryengine.SearchRequest(
             serving_config=config.VERTEX_SEARCH_SERVING_CONFIG,
             query=vendor_query,
@@ -106,7 +152,7 @@ class VertexSearchService:
         )
         
         try:
-            response = self.client.search(request)
+            response = self.client.search(request, **self._call_options(timeout))
             results = []
             
             for result in response.results:
@@ -127,9 +173,15 @@ class VertexSearchService:
             
             return results
         except Exception as e:
+            if raise_errors:
+                raise
             print(f"Error searching vendor: {e}")
             return []
     
+    def _call_options(self, timeout):
+        """Build GAPIC call kwargs (only pass timeout when explicitly set)"""
+        return {'timeout': timeout} if timeout else {}
+    
     def format_context(self, search_results):
         """
         Format search results into context string for Gemini
@@ -156,7 +208,7 @@ class VertexSearchService:
         
         return " ".join(context_parts)
     
-    def search_similar_invoices(self, document_text, vendor_name=None, limit=3):
+    def search_similar_invoices(self, document_text, vendor_name=None, limit=3, timeout=None, raise_errors=False):
         """
         Search for similar past invoice extractions in the RAG datastore
         
@@ -164,6 +216,8 @@ class VertexSearchService:
             document_text: Raw OCR text from the invoice
             vendor_name: Optional vendor name to narrow search
             limit: Maximum number of similar invoices to return
+            timeout: Optional per-call timeout in seconds
+            raise_errors: Re-raise search errors instead of returning []
             
         Returns:
             List of similar invoice extraction results with metadata
@@ -192,7 +246,7 @@ class VertexSearchService:
         )
         
         try:
-            response = self.client.search(request)
+            response = self.client.search(request, **self._call_options(timeout))
             results = []
             
             for result in response.results:
@@ -215,6 +269,8 @@ class VertexSearchService:
             
             return results
         except Exception as e:
+            if raise_errors:
+                raise
             print(f"Error searching similar invoices: {e}")
             return []
     
@@ -372,22 +428,37 @@ class VertexSearchService:
                 )
             )
             
-            # Store in Vertex AI Search
-            request = discoveryengine.CreateDocumentRequest(
-                parent=self.parent,
-                document=document,
-                document_id=doc_id
-            )
-            
-            self.document_client.create_document(request=request)
-            print(f"✓ Stored invoice extraction to knowledge base: {vendor_name} - Invoice #{invoice_num}")
-            return True
+            if self._write_document(document):
+                print(f"✓ Stored invoice extraction to knowledge base: {vendor_name} - Invoice #{invoice_num}")
+                return True
+            return False
             
         except Exception as e:
             print(f"⚠ Error storing invoice extraction: {e}")
             # Don't fail the extraction if storage fails
             return False
     
+    def _write_document(self, document):
+        """
+        Store a knowledge-base document
+        
+        With write-behind enabled the document is queued locally and bulk-imported in the
+        background (no network call on the request path); otherwise it is created synchronously.
+        
+        Returns:
+            True if queued/stored
+        """
+        if self.write_queue:
+            return self.write_queue.enqueue(document)
+        
+        request = discoveryengine.CreateDocumentRequest(
+            parent=self.parent,
+            document=document,
+            document_id=document.id
+        )
+        self.document_client.create_document(request=request)
+        return True
+    
     def store_rejected_entity(self, entity_name, entity_type, reasoning):
         """
         Store rejected entities (banks, payment processors, government entities) for RAG learning
@@ -439,18 +510,48 @@ class VertexSearchService:
                 )
             )
             
-            # Store in Vertex AI Search
-            request = discoveryengine.CreateDocumentRequest(
-                parent=self.parent,
-                document=document,
-                document_id=doc_id
-            )
-            
-            self.document_client.create_document(request=request)
-            print(f"✓ Stored rejected entity to knowledge base: {entity_name} ({entity_type})")
-            return True
+            if self._write_document(document):
+                print(f"✓ Stored rejected entity to knowledge base: {entity_name} ({entity_type})")
+                return True
+            return False
             
         except Exception as e:
             print(f"⚠ Error storing rejected entity: {e}")
             # Don't fail the rejection if storage fails
             return False
+
+    def list_rejected_entities(self, page_size=1000):
+        """
+        List every entity stored via store_rejected_entity (used to preload the entity verdict cache)
+        
+        Args:
+            page_size: Documents per list_documents page
+        
+        Returns:
+            List of dicts with entity_name, entity_type, rejection_reason
+        """
+        rejected = []
+        try:
+            request = discoveryengine.ListDocumentsRequest(parent=self.parent, page_size=page_size)
+            for doc in self.document_client.list_documents(request=request):
+                if not doc.id.startswith('rejected_entity_'):
+                    continue
+                
+                document_data = dict(doc.derived_struct_data or doc.struct_data or {})
+                if not document_data.get('entity_name') and doc.content.raw_bytes:
+                    # Older stores only round-trip the text content
+                    for line in doc.content.raw_bytes.decode('utf-8', errors='ignore').splitlines():
+                        label, _, value = line.strip().partition(': ')
+                        if label in ('Entity Name', 'Entity Type', 'Rejection Reason') and value:
+                            document_data[label.lower().replace(' ', '_')] = value
+                
+                if document_data.get('entity_name'):
+                    rejected.append({
+                        'entity_name': document_data['entity_name'],
+                        'entity_type': document_data.get('entity_type', 'UNKNOWN'),
+                        'rejection_reason': document_data.get('rejection_reason', 'Previously rejected')
+                    })
+        except Exception as e:
+            print(f"⚠️ Error listing rejected entities (non-critical): {e}")
+        
+        return rejected
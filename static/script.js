@@ -828,6 +828,32 @@ function initializeInvoiceUpload() {
         submitBtn.disabled = false;
     }
 
+    async function pollUploadJob(statusUrl, progressDiv) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1500));
+            
+            const jobResponse = await fetch(statusUrl);
+            const job = await jobResponse.json();
+            
+            if (!jobResponse.ok) {
+                throw new Error(job.error || `Job status failed: ${jobResponse.status}`);
+            }
+            
+            if (job.status === 'completed') {
+                return job.result;
+            }
+            if (job.status === 'failed') {
+                return job.result || { status: 'error', error: job.error || 'Processing failed' };
+            }
+            
+            const layers = Object.entries(job.layers || {})
+                .map(([layer, state]) => `${layer}: ${typeof state === 'object' ? state.status : state}`)
+                .join('<br>');
+            const label = job.status === 'queued' ? 'Waiting in queue...' : 'Processing invoice...';
+            progressDiv.innerHTML = `<div class="loading"><div class="spinner"></div><p>${label}</p><p style="font-size: 0.85em;">${layers}</p></div>`;
+        }
+    }
+
     uploadForm.addEventListener('submit', async (e) => {
         e.preventDefault();
         console.log('🚀 Form submitted!');
@@ -865,9 +891,14 @@ function initializeInvoiceUpload() {
             
             console.log('📥 Response received:', uploadResponse.status);
             
-            const data = await uploadResponse.json();
+            let data = await uploadResponse.json();
             console.log('📊 Response data:', data);
             
+            // 202 = queued as a background job; poll until it finishes
+            if (uploadResponse.status === 202 && data.status_url) {
+                data = await pollUploadJob(data.status_url, uploadProgressDiv);
+            }
+            
             uploadProgressDiv.classList.add('hidden');
             submitBtn.disabled = false;
             
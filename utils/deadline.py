@@ -0,0 +1,41 @@
+import time
+
+
+class PipelineDeadline:
+    """
+    End-to-end latency budget shared by the layers of one pipeline run
+    
+    Optional layers call allows() before starting and are skipped (degraded) when
+    less than their budget remains. A deadline of None or 0 never expires.
+    """
+    
+    def __init__(self, seconds=None):
+        self.seconds = seconds if seconds and seconds > 0 else None
+        self.started = time.monotonic()
+    
+    def elapsed(self):
+        return time.monotonic() - self.started
+    
+    def remaining(self):
+        """Seconds left before the deadline (infinite when unbounded)"""
+        if self.seconds is None:
+            return float('inf')
+        return max(self.seconds - self.elapsed(), 0.0)
+    
+    def allows(self, budget_seconds, reserve_seconds=0.0):
+        """
+        Check whether a layer still fits
+        
+        Args:
+            budget_seconds: Time the layer is expected to need
+            reserve_seconds: Time to keep for required layers that run after it
+        """
+        return self.remaining() >= budget_seconds + reserve_seconds
+    
+    def summary(self):
+        """JSON-friendly snapshot for result dictionaries"""
+        return {
+            'budget_seconds': self.seconds,
+            'elapsed_seconds': round(self.elapsed(), 3),
+            'remaining_seconds': round(self.remaining(), 3) if self.seconds is not None else None
+        }
@@ -0,0 +1,268 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from config import config
+
+# Import run (Gmail import, /process/batch) the current Gemini calls are attributed to
+current_run = contextvars.ContextVar('gemini_usage_run', default=None)
+
+
+def parse_pricing(spec):
+    """Parse "model=input_usd/output_usd,..." (USD per 1M tokens) into {model: (input, output)}"""
+    pricing = {}
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            model, values = entry.split('=', 1)
+            input_price, output_price = values.split('/', 1)
+            pricing[model.strip()] = (float(input_price), float(output_price))
+        except ValueError:
+            print(f"⚠️ Ignoring malformed Gemini pricing entry: {entry}")
+    return pricing
+
+
+class GeminiUsageTracker:
+    """
+    Token, latency and cost accounting for every Gemini call, per call site and per import run
+    
+    Rows are aggregated in SQLite keyed by (run, call site, model, client) so the
+    /api/gemini/usage endpoint sees the same totals whichever gunicorn worker
+    made the calls. Calls outside an import run are stored under run_id ''.
+    """
+    
+    def __init__(self, db_path=None, retention_days=None):
+        self.db_path = db_path or config.GEMINI_USAGE_DB_PATH
+        self.retention_seconds = (retention_days or config.GEMINI_USAGE_RETENTION_DAYS) * 86400
+        self.pricing = parse_pricing(config.GEMINI_PRICING)
+        self._lock = threading.Lock()
+        self._initialized = False
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def _ensure_schema(self):
+        if self._initialized:
+            return
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS gemini_usage (
+                    run_id TEXT NOT NULL,
+                    call_site TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    client TEXT NOT NULL,
+                    calls INTEGER NOT NULL DEFAULT 0,
+                    errors INTEGER NOT NULL DEFAULT 0,
+                    retries INTEGER NOT NULL DEFAULT 0,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0,
+                    latency_seconds REAL NOT NULL DEFAULT 0,
+                    cost_usd REAL NOT NULL DEFAULT 0,
+                    last_seen REAL NOT NULL,
+                    PRIMARY KEY (run_id, call_site, model, client)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS gemini_usage_runs (
+                    run_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            """)
+        self._initialized = True
+    
+    def cost(self, model, prompt_tokens, cached_tokens, output_tokens):
+        """Estimated USD cost; cached input tokens are billed at GEMINI_CACHED_INPUT_PRICE_RATIO"""
+        input_price, output_price = self.pricing.get(model, (0.0, 0.0))
+        billable_input = max(prompt_tokens - cached_tokens, 0) + cached_tokens * config.GEMINI_CACHED_INPUT_PRICE_RATIO
+        return (billable_input * input_price + output_tokens * output_price) / 1_000_000
+    
+    @contextmanager
+    def run(self, kind):
+        """
+        Attribute every Gemini call made inside the block (same thread / greenlet) to a new run
+        
+        Yields:
+            run_id
+        """
+        run_id = f"{kind}-{uuid.uuid4().hex[:12]}"
+        now = time.time()
+        try:
+            with self._lock:
+                self._ensure_schema()
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT INTO gemini_usage_runs (run_id, kind, started_at) VALUES (?, ?, ?)",
+                        (run_id, kind, now)
+                    )
+                    self._prune(conn, now)
+        except Exception as e:
+            print(f"⚠️ Gemini usage run start error (non-critical): {e}")
+        
+        token = current_run.set(run_id)
+        try:
+            yield run_id
+        finally:
+            try:
+                current_run.reset(token)
+            except ValueError:
+                # Streaming generators can be closed from another context
+                current_run.set(None)
+            try:
+                with self._lock, self._connect() as conn:
+                    conn.execute(
+                        "UPDATE gemini_usage_runs SET finished_at = ? WHERE run_id = ?",
+                        (time.time(), run_id)
+                    )
+            except Exception as e:
+                print(f"⚠️ Gemini usage run finish error (non-critical): {e}")
+    
+    def record(self, call_site, model, client, usage=None, latency_seconds=0.0, retries=0, outcome='success'):
+        """
+        Add one Gemini call to the aggregates
+        
+        Args:
+            call_site: Caller name (e.g., 'validate_invoice', 'gatekeeper_batch')
+            model: Model that answered (or was attempted)
+            client: 'primary', 'extra-N', 'fallback' or 'cache'
+            usage: usage_metadata from the response (None on errors / cache hits)
+            latency_seconds: Wall time of the call including waits and retries
+            retries: Rate-limited attempts before the final outcome
+            outcome: 'success', 'error' or 'cache_hit'
+        """
+        prompt_tokens = (getattr(usage, 'prompt_token_count', None) or 0) if usage is not None else 0
+        cached_tokens = (getattr(usage, 'cached_content_token_count', None) or 0) if usage is not None else 0
+        output_tokens = (getattr(usage, 'candidates_token_count', None) or 0) if usage is not None else 0
+        cost = self.cost(model, prompt_tokens, cached_tokens, output_tokens)
+        
+        try:
+            with self._lock:
+                self._ensure_schema()
+                with self._connect() as conn:
+                    conn.execute(
+                        """
+                        INSERT INTO gemini_usage
+                            (run_id, call_site, model, client, calls, errors, retries, prompt_tokens,
+                             cached_tokens, output_tokens, latency_seconds, cost_usd, last_seen)
+                        VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(run_id, call_site, model, client) DO UPDATE SET
+                            calls = calls + 1,
+                            errors = errors + excluded.errors,
+                            retries = retries + excluded.retries,
+                            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                            cached_tokens = cached_tokens + excluded.cached_tokens,
+                            output_tokens = output_tokens + excluded.output_tokens,
+                            latency_seconds = latency_seconds + excluded.latency_seconds,
+                            cost_usd = cost_usd + excluded.cost_usd,
+                            last_seen = excluded.last_seen
+                        """,
+                        (
+                            current_run.get() or '', call_site or 'unknown', model, client,
+                            1 if outcome == 'error' else 0, retries, prompt_tokens, cached_tokens,
+                            output_tokens, latency_seconds, cost, time.time()
+                        )
+                    )
+        except Exception as e:
+            print(f"⚠️ Gemini usage write error (non-critical): {e}")
+    
+    def _prune(self, conn, now):
+        """Drop per-run rows and run records past the retention window"""
+        cutoff = now - self.retention_seconds
+        conn.execute(
+            "DELETE FROM gemini_usage WHERE run_id IN (SELECT run_id FROM gemini_usage_runs WHERE started_at < ?)",
+            (cutoff,)
+        )
+        conn.execute("DELETE FROM gemini_usage_runs WHERE started_at < ?", (cutoff,))
+    
+    def summary(self, run_id=None, run_limit=20):
+        """
+        Aggregated usage for the endpoint
+        
+        Args:
+            run_id: Restrict call-site totals to one run (default: all calls)
+            run_limit: Number of recent runs to list
+        
+        Returns:
+            dict with per-call-site totals, grand totals and recent runs
+        """
+        self._ensure_schema()
+        where, params = ("WHERE run_id = ?", (run_id,)) if run_id else ("", ())
+        
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT call_site, model, client, SUM(calls), SUM(errors), SUM(retries), SUM(prompt_tokens),
+                       SUM(cached_tokens), SUM(output_tokens), SUM(latency_seconds), SUM(cost_usd)
+                FROM gemini_usage {where}
+                GROUP BY call_site, model, client
+                """,
+                params
+            ).fetchall()
+            runs = conn.execute(
+                """
+                SELECT r.run_id, r.kind, r.started_at, r.finished_at,
+                       COALESCE(SUM(u.calls), 0), COALESCE(SUM(u.prompt_tokens), 0),
+                       COALESCE(SUM(u.output_tokens), 0), COALESCE(SUM(u.cost_usd), 0)
+                FROM gemini_usage_runs r LEFT JOIN gemini_usage u ON u.run_id = r.run_id
+                GROUP BY r.run_id ORDER BY r.started_at DESC LIMIT ?
+                """,
+                (run_limit,)
+            ).fetchall()
+        
+        call_sites = {}
+        for call_site, model, client, calls, errors, retries, prompt_tokens, cached_tokens, output_tokens, latency, cost in rows:
+            site = call_sites.setdefault(call_site, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'prompt_tokens': 0, 'cached_tokens': 0,
+                'output_tokens': 0, 'latency_seconds': 0.0, 'cost_usd': 0.0, 'by_model': []
+            })
+            site['calls'] += calls
+            site['errors'] += errors
+            site['retries'] += retries
+            site['prompt_tokens'] += prompt_tokens
+            site['cached_tokens'] += cached_tokens
+            site['output_tokens'] += output_tokens
+            site['latency_seconds'] += latency
+            site['cost_usd'] += cost
+            site['by_model'].append({'model': model, 'client': client, 'calls': calls, 'errors': errors,
+                                     'prompt_tokens': prompt_tokens, 'output_tokens': output_tokens})
+        
+        for site in call_sites.values():
+            site['avg_latency_seconds'] = round(site['latency_seconds'] / site['calls'], 3) if site['calls'] else None
+            site['latency_seconds'] = round(site['latency_seconds'], 3)
+            site['cost_usd'] = round(site['cost_usd'], 6)
+        
+        ordered = dict(sorted(call_sites.items(), key=lambda item: item[1]['prompt_tokens'] + item[1]['output_tokens'], reverse=True))
+        return {
+            'run_id': run_id,
+            'call_sites': ordered,
+            'totals': {
+                key: (round(sum(site[key] for site in ordered.values()), 6) if key == 'cost_usd' else sum(site[key] for site in ordered.values()))
+                for key in ('calls', 'errors', 'retries', 'prompt_tokens', 'cached_tokens', 'output_tokens', 'cost_usd')
+            },
+            'recent_runs': [
+                {
+                    'run_id': rid, 'kind': kind, 'started_at': started, 'finished_at': finished,
+                    'calls': calls, 'prompt_tokens': prompt_tokens, 'output_tokens': output_tokens,
+                    'cost_usd': round(cost, 6)
+                }
+                for rid, kind, started, finished, calls, prompt_tokens, output_tokens, cost in runs
+            ]
+        }
+
+
+gemini_usage = GeminiUsageTracker()
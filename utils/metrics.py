@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import config
+
+# Latency buckets (seconds) sized for this pipeline: sub-second lookups up to multi-minute Gemini retries
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+METRIC_HELP = {
+    'invoice_stage_duration_seconds': ('histogram', 'Latency of each invoice pipeline stage'),
+    'invoice_stage_total': ('counter', 'Invoice pipeline stage executions by outcome'),
+    'gemini_requests_total': ('counter', 'Gemini generate_content calls by client (primary/extra-N/fallback) and outcome'),
+    'gemini_request_duration_seconds': ('histogram', 'Latency of Gemini generate_content calls by client'),
+    'kb_write_queue_documents_total': ('counter', 'Knowledge-base documents flushed by the write-behind queue by outcome'),
+    'invoice_degraded_layers_total': ('counter', 'Optional pipeline layers skipped because the latency budget was spent'),
+    'gemini_cache_requests_total': ('counter', 'Gemini response cache lookups by call site and outcome (hit/miss)'),
+    'email_prefilter_decisions_total': ('counter', 'Local email pre-filter decisions (keep/kill decided locally, uncertain sent to the Gatekeeper)'),
+    'gemini_calls_avoided_total': ('counter', 'Gemini requests not sent because a local model or cached verdict decided, by call site'),
+    'gemini_rate_limiter_waits_total': ('counter', 'Gemini calls that waited for client-side quota to refill, by model'),
+    'gemini_tokens_total': ('counter', 'Gemini tokens by call site and kind (prompt includes cached; cached = served from a context cache; output)'),
+    'dependency_concurrency_waits_total': ('counter', 'Calls that waited for a free per-dependency concurrency slot (DEPENDENCY_CONCURRENCY_LIMITS)')
+}
+
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus-style registry (counters + histograms) with no dependencies
+    
+    Each gunicorn worker keeps its own in-memory values and periodically writes a
+    snapshot to SQLite; render() merges the snapshots of every worker so /metrics
+    reports the same totals whichever worker serves the scrape.
+    """
+    
+    def __init__(self, db_path=None, flush_seconds=None, buckets=DEFAULT_BUCKETS):
+        self.db_path = db_path or config.METRICS_DB_PATH
+        self.flush_seconds = flush_seconds or config.METRICS_FLUSH_SECONDS
+        self.buckets = tuple(buckets)
+        self.process_key = f"{socket.gethostname()}:{os.getpid()}"
+        
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._dirty = False
+    
+    @staticmethod
+    def _labels_key(labels):
+        return json.dumps(sorted((k, str(v)) for k, v in labels.items()))
+    
+    def increment(self, name, amount=1, **labels):
+        """Increase a counter"""
+        key = self._labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+            self._dirty = True
+        self._ensure_flusher()
+    
+    def observe(self, name, value, **labels):
+        """Record a histogram observation (seconds)"""
+        key = self._labels_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # Layout: per-bucket counts (non-cumulative), then sum, then count
+            values = series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += value
+            values[-1] += 1
+            self._dirty = True
+        self._ensure_flusher()
+    
+    def record_stage(self, stage, seconds, outcome='success'):
+        """Record one pipeline stage execution (duration histogram + outcome counter)"""
+        self.observe('invoice_stage_duration_seconds', seconds, stage=stage, outcome=outcome)
+        self.increment('invoice_stage_total', stage=stage, outcome=outcome)
+    
+    @contextmanager
+    def stage_timer(self, stage):
+        """
+        Time a pipeline stage
+        
+        Records outcome 'error' if the block raises; callers that handle errors
+        themselves can set ``timer.outcome`` (e.g., 'error', 'skipped') inside the block.
+        """
+        timer = _StageTimer()
+        start = time.perf_counter()
+        try:
+            yield timer
+        except Exception:
+            timer.outcome = 'error'
+            raise
+        finally:
+            self.record_stage(stage, time.perf_counter() - start, timer.outcome)
+    
+    def _snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return json.dumps({'counters': self._counters, 'histograms': self._histograms})
+    
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection (commit on success, always close)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS metrics_snapshots (
+                        process_key TEXT PRIMARY KEY,
+                        snapshot_json TEXT NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                yield conn
+        finally:
+            conn.close()
+    
+    def flush(self):
+        """Write this process's values to the shared snapshot table"""
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            snapshot = self._snapshot()
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO metrics_snapshots (process_key, snapshot_json, updated_at) VALUES (?, ?, ?)",
+                    (self.process_key, snapshot, time.time())
+                )
+        except Exception as e:
+            print(f"⚠️ Metrics flush error (non-critical): {e}")
+    
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            if self._dirty:
+                self.flush()
+    
+    def _merged_snapshots(self):
+        """Sum the snapshots of every worker process (including exited ones, so counters stay monotonic)"""
+        self.flush()
+        counters = {}
+        histograms = {}
+        
+        try:
+            with self._connect() as conn:
+                rows = conn.execute("SELECT snapshot_json FROM metrics_snapshots").fetchall()
+        except Exception as e:
+            print(f"⚠️ Metrics read error (non-critical): {e}")
+            rows = [(self._snapshot(),)]
+        
+        for (snapshot_json,) in rows:
+            snapshot = json.loads(snapshot_json)
+            for name, series in snapshot.get('counters', {}).items():
+                merged = counters.setdefault(name, {})
+                for key, value in series.items():
+                    merged[key] = merged.get(key, 0) + value
+            for name, series in snapshot.get('histograms', {}).items():
+                merged = histograms.setdefault(name, {})
+                for key, values in series.items():
+                    if len(values) != len(self.buckets) + 2:
+                        continue
+                    current = merged.setdefault(key, [0] * len(values))
+                    merged[key] = [a + b for a, b in zip(current, values)]
+        
+        return counters, histograms
+    
+    @staticmethod
+    def _format_labels(key, extra=None):
+        pairs = [tuple(pair) for pair in json.loads(key)]
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = (
+            f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for k, v in pairs
+        )
+        return '{' + ','.join(escaped) + '}'
+    
+    def render(self):
+        """
+        Render all metrics in Prometheus text exposition format (version 0.0.4)
+        
+        Returns:
+            String suitable for a text/plain /metrics response
+        """
+        counters, histograms = self._merged_snapshots()
+        lines = []
+        
+        for name in sorted(set(counters) | set(histograms)):
+            metric_type, help_text = METRIC_HELP.get(name, ('counter' if name in counters else 'histogram', name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            
+            for key, value in sorted(counters.get(name, {}).items()):
+                lines.append(f"{name}{self._format_labels(key)} {value}")
+            
+            for key, values in sorted(histograms.get(name, {}).items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, values):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._format_labels(key, ('le', repr(float(bound))))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(key, ('le', '+Inf'))} {values[-1]}")
+                lines.append(f"{name}_sum{self._format_labels(key)} {values[-2]}")
+                lines.append(f"{name}_count{self._format_labels(key)} {values[-1]}")
+        
+        return '\n'.join(lines) + '\n'
+
+
+class _StageTimer:
+    """Mutable outcome holder yielded by MetricsRegistry.stage_timer"""
+    
+    def __init__(self):
+        self.outcome = 'success'
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,145 @@
+import json
+
+WHITESPACE = ' \t\r\n'
+
+
+class StreamingFieldParser:
+    """
+    Incremental JSON scanner that reports selected scalar fields as soon as they are complete
+    
+    Fed with the text of a streamed Gemini response as it grows, it tracks the
+    object/array nesting and emits values at the requested dotted paths (e.g.
+    'vendor.name', 'totals.total', 'lineItems.0.description') without waiting for
+    the document to close. Text before the first '{' (such as a ```json fence)
+    is ignored. Parsing is best-effort: malformed input stops the scan, and the
+    final response is still parsed and validated as a whole.
+    """
+    
+    def __init__(self, paths):
+        """
+        Args:
+            paths: Dotted paths to report
+        """
+        self.paths = set(paths)
+        self.emitted = {}
+        self._reset()
+    
+    def _reset(self):
+        self._text = ''
+        self._stack = []
+        self._started = False
+        self._done = False
+        self._failed = False
+        self._string = None
+        self._string_is_key = False
+        self._escape = False
+        self._scalar = None
+    
+    def update(self, text_so_far):
+        """
+        Scan the newly arrived part of the response
+        
+        Args:
+            text_so_far: Full response text received so far on the current stream
+                         (a text that does not extend the previous one restarts the scan,
+                         e.g., after the call was rerouted mid-stream)
+        
+        Returns:
+            dict of {path: value} for fields completed (or changed) by this update
+        """
+        if not text_so_far.startswith(self._text):
+            self._reset()
+        new_text = text_so_far[len(self._text):]
+        self._text = text_so_far
+        
+        completed = {}
+        if self._done or self._failed:
+            return completed
+        
+        try:
+            for char in new_text:
+                self._consume(char, completed)
+                if self._done:
+                    break
+        except ValueError:
+            self._failed = True
+        
+        for path, value in list(completed.items()):
+            if path in self.emitted and self.emitted[path] == value:
+                del completed[path]
+            else:
+                self.emitted[path] = value
+        return completed
+    
+    def _path(self):
+        return '.'.join(str(frame['key']) for frame in self._stack)
+    
+    def _value(self, value, completed):
+        if not self._stack:
+            return
+        path = self._path()
+        if path in self.paths:
+            completed[path] = value
+    
+    def _finish_scalar(self, completed):
+        token, self._scalar = self._scalar, None
+        self._value(json.loads(token), completed)
+    
+    def _consume(self, char, completed):
+        if self._string is not None:
+            if self._escape:
+                self._escape = False
+                self._string += char
+            elif char == '\\':
+                self._escape = True
+                self._string += char
+            elif char == '"':
+                text = json.loads(f'"{self._string}"')
+                self._string = None
+                if self._string_is_key:
+                    self._stack[-1]['key'] = text
+                else:
+                    self._value(text, completed)
+            else:
+                self._string += char
+            return
+        
+        if self._scalar is not None:
+            if char in WHITESPACE or char in ',}]':
+                self._finish_scalar(completed)
+            else:
+                self._scalar += char
+                return
+        
+        if not self._started:
+            if char == '{':
+                self._started = True
+                self._stack.append({'type': 'object', 'key': None, 'await_key': True})
+            return
+        
+        top = self._stack[-1]
+        if char in WHITESPACE:
+            return
+        if char == '{':
+            self._stack.append({'type': 'object', 'key': None, 'await_key': True})
+        elif char == '[':
+            self._stack.append({'type': 'array', 'key': 0})
+        elif char in '}]':
+            self._stack.pop()
+            if not self._stack:
+                self._done = True
+        elif char == ':':
+            top['await_key'] = False
+        elif char == ',':
+            if top['type'] == 'object':
+                top['await_key'] = True
+                top['key'] = None
+            else:
+                top['key'] += 1
+        elif char == '"':
+            self._string = ''
+            self._string_is_key = top['type'] == 'object' and top['await_key']
+        elif char in '-0123456789tfn':
+            self._scalar = char
+        else:
+            raise ValueError(f"Unexpected character {char!r} in streamed JSON")
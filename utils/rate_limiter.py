@@ -0,0 +1,234 @@
+import time
+import random
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from config import config
+from utils.metrics import metrics
+
+
+def parse_model_limits(spec):
+    """
+    Parse "model=rpm/tpm,model=rpm/tpm" into {model: (rpm, tpm)}
+    
+    Malformed entries are skipped with a warning.
+    """
+    limits = {}
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            model, values = entry.split('=', 1)
+            rpm, tpm = values.split('/', 1)
+            limits[model.strip()] = (float(rpm), float(tpm))
+        except ValueError:
+            print(f"⚠️ Ignoring malformed Gemini rate limit entry: {entry}")
+    return limits
+
+
+def parse_concurrency_limits(spec):
+    """
+    Parse "dependency=n,dependency=n" into {dependency: n}
+    
+    Malformed entries are skipped with a warning.
+    """
+    limits = {}
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            dependency, value = entry.split('=', 1)
+            limits[dependency.strip()] = int(value)
+        except ValueError:
+            print(f"⚠️ Ignoring malformed concurrency limit entry: {entry}")
+    return limits
+
+
+def backoff_delay(attempt, base_seconds=None, max_seconds=None):
+    """
+    Exponential backoff with full jitter
+    
+    Args:
+        attempt: Zero-based retry number
+        base_seconds: Delay scale (default: config.GEMINI_BACKOFF_BASE_SECONDS)
+        max_seconds: Upper bound (default: config.GEMINI_BACKOFF_MAX_SECONDS)
+    
+    Returns:
+        Seconds to sleep, uniformly drawn from [0, min(max, base * 2^attempt)]
+    """
+    base_seconds = config.GEMINI_BACKOFF_BASE_SECONDS if base_seconds is None else base_seconds
+    max_seconds = config.GEMINI_BACKOFF_MAX_SECONDS if max_seconds is None else max_seconds
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute, holding at most capacity"""
+    
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+        self.updated = now
+    
+    def wait_time(self, amount=1):
+        """Seconds until `amount` tokens are available (0 if available now)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = min(amount, self.capacity) - self.tokens
+            if missing <= 0:
+                return 0.0
+            return missing / self.rate_per_second if self.rate_per_second > 0 else float('inf')
+    
+    def try_acquire(self, amount=1):
+        """Take `amount` tokens if available; requests larger than the bucket take it whole"""
+        with self._lock:
+            self._refill(time.monotonic())
+            amount = min(amount, self.capacity)
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+    
+    def adjust(self, amount):
+        """Give back (positive) or additionally charge (negative) tokens after the fact"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+    
+    def drain(self, seconds):
+        """Empty the bucket so it only refills after roughly `seconds` (used after a server-side 429)"""
+        with self._lock:
+            self.updated = time.monotonic()
+            self.tokens = -seconds * self.rate_per_second
+
+
+class ModelQuota:
+    """Requests-per-minute and tokens-per-minute buckets for one (API key, model) pair"""
+    
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+    
+    def wait_time(self, estimated_tokens):
+        return max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+    
+    def try_acquire(self, estimated_tokens):
+        """Reserve one request plus the estimated tokens, all or nothing"""
+        if not self.requests.try_acquire(1):
+            return False
+        if not self.tokens.try_acquire(estimated_tokens):
+            self.requests.adjust(1)
+            return False
+        return True
+    
+    def settle(self, estimated_tokens, actual_tokens):
+        """Correct the token bucket once usage_metadata reports the real count"""
+        if actual_tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+    
+    def cool_down(self, seconds):
+        self.requests.drain(seconds)
+
+
+class RateLimiterRegistry:
+    """
+    Process-wide quotas keyed by (API key fingerprint, model)
+    
+    Every GeminiService instance in a worker shares the same buckets, so the
+    configured per-project quota is split across GEMINI_RATE_LIMIT_PROCESSES
+    gunicorn workers.
+    """
+    
+    def __init__(self):
+        self._quotas = {}
+        self._lock = threading.Lock()
+        self._limits = parse_model_limits(config.GEMINI_RATE_LIMITS)
+    
+    def quota(self, key_fingerprint, model):
+        key = (key_fingerprint, model)
+        with self._lock:
+            if key not in self._quotas:
+                rpm, tpm = self._limits.get(model, (config.GEMINI_DEFAULT_RPM, config.GEMINI_DEFAULT_TPM))
+                processes = max(config.GEMINI_RATE_LIMIT_PROCESSES, 1)
+                self._quotas[key] = ModelQuota(rpm / processes, tpm / processes)
+            return self._quotas[key]
+
+
+rate_limiters = RateLimiterRegistry()
+
+
+class ConcurrencyLimiter:
+    """
+    Process-wide caps on in-flight calls per dependency (DEPENDENCY_CONCURRENCY_LIMITS)
+    
+    Parallel callers (Gmail Stage 3 workers, job queue and batch pipelines) share
+    one semaphore per dependency, so running several invoices at once stays inside
+    the Document AI and Gemini quotas. Dependencies without a cap (or with 0)
+    are not limited.
+    """
+    
+    def __init__(self, spec=None):
+        self._limits = parse_concurrency_limits(config.DEPENDENCY_CONCURRENCY_LIMITS if spec is None else spec)
+        self._semaphores = {}
+        self._lock = threading.Lock()
+    
+    def _semaphore(self, dependency):
+        limit = self._limits.get(dependency, 0)
+        if limit < 1:
+            return None
+        with self._lock:
+            if dependency not in self._semaphores:
+                self._semaphores[dependency] = threading.BoundedSemaphore(limit)
+            return self._semaphores[dependency]
+    
+    @contextmanager
+    def slot(self, dependency):
+        """Hold one of the dependency's slots for the duration of a call, waiting if all are taken"""
+        semaphore = self._semaphore(dependency)
+        if semaphore is None:
+            yield
+            return
+        
+        if not semaphore.acquire(blocking=False):
+            metrics.increment('dependency_concurrency_waits_total', dependency=dependency)
+            semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    @asynccontextmanager
+    async def async_slot(self, dependency):
+        """
+        slot() for coroutines (AsyncGeminiService), sharing the same semaphores
+        
+        Waiting happens on a worker thread so the event loop keeps running. If the
+        waiting coroutine is cancelled, the slot is released as soon as it is granted.
+        """
+        semaphore = self._semaphore(dependency)
+        if semaphore is None:
+            yield
+            return
+        
+        if not semaphore.acquire(blocking=False):
+            metrics.increment('dependency_concurrency_waits_total', dependency=dependency)
+            acquired = asyncio.ensure_future(asyncio.to_thread(semaphore.acquire))
+            try:
+                await asyncio.shield(acquired)
+            except asyncio.CancelledError:
+                acquired.add_done_callback(lambda _: semaphore.release())
+                raise
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+concurrency_limits = ConcurrencyLimiter()